@@ -1,50 +1,123 @@
-"""Append-only audit log service. No deletes/updates to audit rows."""
+"""Append-only audit log service. No deletes/updates to audit rows.
+
+Writes join the caller's db.unit_of_work() when there is one, so audit rows commit with the change they describe.
+The case_id / transaction_id / decision_id found in a payload are also stored in indexed link columns.
+Committed events are published to event_bus for the live stream.
+Each row gets the next seq at insert. SQLite has one writer at a time, holding its lock from the first
+write to commit, so seq order is commit order (unlike created_at, stamped before the commit): stream
+resume (events_after) follows seq.
+"""
 import json
 import uuid
 from datetime import datetime, timezone
 
-from db import get_cursor
+from db import after_commit, get_cursor
+from event_bus import publish
+from pagination import keyset_page
 
 
 def _now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
+_INSERT_SQL = """
+    INSERT INTO audit_log (event_id, actor, event_type, payload_json, created_at, case_id, transaction_id, decision_id, seq)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM audit_log))
+"""
+
+
+def _row(actor: str, event_type: str, payload: dict, created_at: str) -> tuple:
+    payload = payload or {}
+    return (
+        str(uuid.uuid4()),
+        actor,
+        event_type,
+        json.dumps(payload) if payload else None,
+        created_at,
+        payload.get("case_id"),
+        payload.get("transaction_id"),
+        payload.get("decision_id"),
+    )
+
+
+def _event(row: tuple) -> dict:
+    return {"event_id": row[0], "actor": row[1], "event_type": row[2], "payload_json": row[3], "created_at": row[4]}
+
+
 def append(actor: str, event_type: str, payload: dict) -> str:
     """Append an audit event. Returns event_id."""
-    event_id = str(uuid.uuid4())
-    payload_json = json.dumps(payload) if payload else None
+    row = _row(actor, event_type, payload, _now_iso())
     with get_cursor() as cur:
-        cur.execute(
-            """
-            INSERT INTO audit_log (event_id, actor, event_type, payload_json, created_at)
-            VALUES (?, ?, ?, ?, ?)
-            """,
-            (event_id, actor, event_type, payload_json, _now_iso()),
+        cur.execute(_INSERT_SQL, row)
+    after_commit(lambda: publish([_event(row)]))
+    return row[0]
+
+
+def append_many(events: list[tuple[str, str, dict]]) -> list[str]:
+    """Append several (actor, event_type, payload) events with one executemany. Returns event_ids in input order."""
+    created_at = _now_iso()
+    rows = [_row(actor, event_type, payload, created_at) for actor, event_type, payload in events]
+    with get_cursor() as cur:
+        cur.executemany(_INSERT_SQL, rows)
+    # In insert (seq) order, the order events_after replays them in
+    after_commit(lambda: publish([_event(r) for r in rows]))
+    return [r[0] for r in rows]
+
+
+def query(
+    limit: int = 200,
+    cursor: str | None = None,
+    actor: str | None = None,
+    event_type: str | None = None,
+    since: str | None = None,
+    until: str | None = None,
+    case_id: str | None = None,
+    transaction_id: str | None = None,
+    decision_id: str | None = None,
+) -> tuple[list[dict], str | None]:
+    """One page of audit events, newest first. Returns (events, next cursor or None). Raises ValueError on a bad cursor."""
+    with get_cursor() as cur:
+        return keyset_page(
+            "audit_log",
+            "event_id, actor, event_type, payload_json, created_at",
+            "event_id",
+            [
+                ("case_id = ?", case_id),
+                ("transaction_id = ?", transaction_id),
+                ("decision_id = ?", decision_id),
+                ("actor = ?", actor),
+                ("event_type = ?", event_type),
+                ("created_at >= ?", since),
+                ("created_at < ?", until),
+            ],
+            limit,
+            cursor,
+            cur,
         )
-    return event_id
 
 
-def get_recent(limit: int = 200) -> list[dict]:
-    """Return latest audit events (newest first)."""
+def events_after(event_id: str, event_types: set[str] | None = None, limit: int = 500) -> list[dict] | None:
+    """
+    Up to `limit` events committed after event_id, in commit (seq) order (stream resume).
+    None if event_id is unknown.
+    """
     with get_cursor() as cur:
+        cur.execute("SELECT seq FROM audit_log WHERE event_id = ?", (event_id,))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        type_filter, params = "", []
+        if event_types:
+            type_filter = f" AND event_type IN ({','.join('?' * len(event_types))})"
+            params = sorted(event_types)
         cur.execute(
-            """
+            f"""
             SELECT event_id, actor, event_type, payload_json, created_at
             FROM audit_log
-            ORDER BY created_at DESC
+            WHERE seq > ?{type_filter}
+            ORDER BY seq
             LIMIT ?
             """,
-            (limit,),
+            (row["seq"], *params, limit),
         )
-        rows = cur.fetchall()
-    return [
-        {
-            "event_id": r["event_id"],
-            "actor": r["actor"],
-            "event_type": r["event_type"],
-            "payload_json": r["payload_json"],
-            "created_at": r["created_at"],
-        }
-        for r in rows
-    ]
+        return [dict(r) for r in cur.fetchall()]
@@ -0,0 +1,469 @@
+"""Historical re-score of already scored transactions with the current rules (after a rule change).
+
+Users with transactions in the window are split into partitions by a hash of user_id and scored by a
+process pool, a chunk of users at a time, with risk_engine.score_batch over each user's full history.
+Each chunk's decisions and its partition checkpoint commit together, so an interrupted run resumes
+where it stopped. Dry runs only report decision deltas.
+
+Decisions are rule-based (no LLM adjudication) and are compared with the rule outcome stored with the
+current decision (its signals and candidate), not with its final decision. A current decision set by the
+LLM is never overwritten; where the rules now disagree it is only reported (under "adjudicated"). The
+feature store and cases are left alone; a changed decision becomes the transaction's latest decision
+and status unless an analyst has acted since.
+
+Rules reading device/IP velocity (risk_engine.CROSS_USER_FACT_KEYS) are not re-evaluated: live, those
+counters see every user's transactions, which a per-user history cannot rebuild. Each transaction keeps
+their outcome from its current decision (unfired for rules added since), so their threshold or weight
+changes show up only in decisions scored from then on, not in backfill deltas.
+
+Queued runs (POST /admin/backfill) run on BACKFILL_JOB_WORKERS job workers of their own, so they never
+hold the shared job workers, and renew their job lease with every checkpoint.
+
+Run: python backfill.py [--days 30 | --since ISO] [--until ISO] [--dry-run] [--workers 4] [--resume RUN_ID]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import uuid
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from audit_service import append_many as audit_append_many
+from case_service import touch_cases_for_transactions
+from db import get_cursor, init_db, unit_of_work
+from job_queue import current_lease, enqueue, register_handler, renew_lease
+from risk_engine import (
+    CROSS_USER_FACT_KEYS,
+    columns_from_rows,
+    compile_rules,
+    current_rules,
+    override_fired,
+    risk_score_and_candidate,
+    score_batch,
+    signals_at,
+)
+
+BACKFILL_JOB = "backfill"
+
+BACKFILL_WORKERS = int(os.getenv("BACKFILL_WORKERS", "4"))
+BACKFILL_PARTITIONS = int(os.getenv("BACKFILL_PARTITIONS", "16"))
+BACKFILL_CHUNK_USERS = int(os.getenv("BACKFILL_CHUNK_USERS", "500"))
+BACKFILL_STALE_SECONDS = float(os.getenv("BACKFILL_STALE_SECONDS", "120"))  # a running run silent this long may be taken over
+BACKFILL_JOB_WORKERS = int(os.getenv("BACKFILL_JOB_WORKERS", "1"))  # queued runs executing at once
+BACKFILL_REPORT_SAMPLES = 20  # example deltas kept per partition
+
+_CANDIDATE_DECISIONS = {"block_candidate": "block", "review_candidate": "review", "approve_candidate": "approve"}
+_RULE_BASED_MARKER = "rule-based decision"  # in the rationale of every decision made without the LLM
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def partition_of(user_id: str, partitions: int) -> int:
+    """Stable partition for a user (same in every process, unlike hash())."""
+    return zlib.crc32(user_id.encode()) % partitions
+
+
+def start_run(since: str | None, until: str | None = None, dry_run: bool = True, partitions: int = BACKFILL_PARTITIONS) -> str:
+    """Register a run over transactions with since <= timestamp < until, pinned to the current rules. Returns run_id."""
+    plan = current_rules()
+    run_id = str(uuid.uuid4())
+    with get_cursor() as cur:
+        cur.execute(
+            """
+            INSERT INTO backfill_runs (run_id, since, until, dry_run, partitions, rules_version, rules_json, status, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, 'queued', ?)
+            """,
+            (
+                run_id,
+                since,
+                until or _now().isoformat(),
+                int(dry_run),
+                partitions,
+                str(plan.version),
+                json.dumps(plan.config),
+                _now().isoformat(),
+            ),
+        )
+    return run_id
+
+
+def _acquire(run_id: str) -> dict | None:
+    """Mark the run running unless another runner is alive on it. Returns the run row or None."""
+    now = _now()
+    with get_cursor() as cur:
+        cur.execute(
+            """
+            UPDATE backfill_runs SET status = 'running', heartbeat_at = ?, last_error = NULL
+            WHERE run_id = ? AND status != 'done' AND (status != 'running' OR heartbeat_at IS NULL OR heartbeat_at < ?)
+            """,
+            (now.isoformat(), run_id, (now - timedelta(seconds=BACKFILL_STALE_SECONDS)).isoformat()),
+        )
+        if cur.rowcount == 0:
+            return None
+        cur.execute("SELECT * FROM backfill_runs WHERE run_id = ?", (run_id,))
+        return dict(cur.fetchone())
+
+
+def _partition_users(run: dict) -> dict[int, list[str]]:
+    """Users with transactions in the window, by partition, sorted (checkpoints are the last user done)."""
+    with get_cursor() as cur:
+        cur.execute(
+            "SELECT DISTINCT user_id FROM transactions WHERE timestamp >= ? AND timestamp < ? AND latest_decision_id IS NOT NULL",
+            (run["since"] or "", run["until"]),
+        )
+        users = sorted(r["user_id"] for r in cur.fetchall())
+    by_partition: dict[int, list[str]] = {p: [] for p in range(run["partitions"])}
+    for user_id in users:
+        by_partition[partition_of(user_id, run["partitions"])].append(user_id)
+    return by_partition
+
+
+def _load_chunk(user_ids: list[str], until: str) -> list[dict]:
+    """
+    Full history (before until) of the users, sorted by (user_id, timestamp), with each row's latest
+    decision and the rule candidate recorded in its audit row.
+    """
+    with get_cursor() as cur:
+        cur.execute(
+            """
+            SELECT t.id, t.timestamp, t.type, t.amount, t.currency, t.user_id, t.account_age_days,
+                   t.country, t.device_id, t.ip_hash, t.psp, t.status, t.latest_decision_id,
+                   d.decision AS old_decision, d.risk_score AS old_score, d.signals_json AS old_signals_json,
+                   d.llm_rationale AS old_rationale,
+                   (SELECT json_extract(a.payload_json, '$.candidate') FROM audit_log a
+                    WHERE a.decision_id = t.latest_decision_id AND a.event_type IN ('DECISION_CREATED', 'DECISION_REFINED')
+                    LIMIT 1) AS old_candidate
+            FROM transactions t
+            LEFT JOIN risk_decisions d ON d.id = t.latest_decision_id
+            WHERE t.user_id IN (SELECT value FROM json_each(?)) AND t.timestamp < ?
+            ORDER BY t.user_id, t.timestamp
+            """,
+            (json.dumps(user_ids), until),
+        )
+        return [dict(r) for r in cur.fetchall()]
+
+
+def _keep_live_outcomes(batch: dict, rows: list[dict], live_rules: list) -> tuple[dict, list[dict]]:
+    """
+    Replace the live-only rules' outcomes in a score_batch result by those stored with each row's
+    current decision, and rescore. Returns (batch, the stored signals by rule name per row).
+    """
+    stored = [
+        {s.get("name"): s for s in json.loads(r["old_signals_json"] or "[]")} if r["latest_decision_id"] else {}
+        for r in rows
+    ]
+    fired = {
+        rule.name: np.array([bool(signals.get(rule.name, {}).get("fired")) for signals in stored], dtype=bool)
+        for rule in live_rules
+    }
+    return override_fired(batch, fired), stored
+
+
+def _stored_rule_outcome(tx: dict, plan) -> tuple[int, str, bool]:
+    """
+    (base score, candidate) of the rules that produced a row's current decision, from its stored signals
+    and audited candidate, and whether the final decision was adjudicated by the LLM instead.
+    """
+    score, candidate = risk_score_and_candidate(json.loads(tx["old_signals_json"] or "[]"), plan)
+    candidate = tx["old_candidate"] or candidate
+    adjudicated = (
+        _RULE_BASED_MARKER not in (tx["old_rationale"] or "")
+        or (tx["old_decision"], tx["old_score"]) != (_CANDIDATE_DECISIONS[candidate], score)
+    )
+    return score, candidate, adjudicated
+
+
+def _write_decisions(run_id: str, rules_version: str, changes: list[dict]) -> None:
+    """Bulk-write re-scored decisions (joins the caller's unit of work)."""
+    created_at = _now().isoformat()
+    with get_cursor() as cur:
+        cur.executemany(
+            """
+            INSERT INTO risk_decisions (id, transaction_id, risk_score, decision, signals_json, llm_rationale, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            [
+                (
+                    c["decision_id"],
+                    c["transaction_id"],
+                    c["risk_score"],
+                    c["decision"],
+                    json.dumps(c["signals"]),
+                    f"Backfill re-score (rules v{rules_version}); rule-based decision. "
+                    + "; ".join(s["explanation"] for s in c["signals"] if s["fired"]),
+                    created_at,
+                )
+                for c in changes
+            ],
+        )
+        # Leave the status alone if an analyst has acted on it since
+        cur.executemany(
+            """
+            UPDATE transactions
+            SET status = CASE WHEN status = ? THEN ? ELSE status END, latest_decision_id = ?
+            WHERE id = ?
+            """,
+            [(c["old_decision"], c["decision"], c["decision_id"], c["transaction_id"]) for c in changes],
+        )
+    touch_cases_for_transactions([c["transaction_id"] for c in changes])
+    audit_append_many(
+        [
+            (
+                "system",
+                "DECISION_CREATED",
+                {
+                    "decision_id": c["decision_id"],
+                    "transaction_id": c["transaction_id"],
+                    "decision": c["decision"],
+                    "risk_score": c["risk_score"],
+                    "candidate": c["candidate"],
+                    "previous_decision": c["old_decision"],
+                    "backfill_run_id": run_id,
+                },
+            )
+            for c in changes
+        ]
+    )
+
+
+def _run_partition(run_id: str, partition: int, user_ids: list[str], lease: tuple[str, str] | None = None) -> dict:
+    """
+    Worker process: score one partition chunk by chunk from its checkpoint. Each checkpoint also renews
+    the job lease, when run from the job queue. Returns the partition's counters.
+    """
+    with get_cursor() as cur:
+        cur.execute("SELECT * FROM backfill_runs WHERE run_id = ?", (run_id,))
+        run = dict(cur.fetchone())
+        cur.execute(
+            "SELECT * FROM backfill_checkpoints WHERE run_id = ? AND partition = ?",
+            (run_id, partition),
+        )
+        row = cur.fetchone()
+    checkpoint = dict(row) if row else {"last_user_id": None, "scanned": 0, "changed": 0, "done": 0}
+    transitions = json.loads(checkpoint.get("transitions_json") or "{}")
+    adjudicated = json.loads(checkpoint.get("adjudicated_json") or "{}")
+    samples = json.loads(checkpoint.get("samples_json") or "[]")
+    if checkpoint["done"]:
+        return {"scanned": checkpoint["scanned"], "changed": checkpoint["changed"], "transitions": transitions,
+                "adjudicated": adjudicated, "samples": samples}
+
+    plan = compile_rules(json.loads(run["rules_json"]), f"backfill run {run_id}")
+    live_rules = [rule for rule in plan.rules if rule.params.get("feature") in CROSS_USER_FACT_KEYS]
+    since, until, dry_run = run["since"] or "", run["until"], bool(run["dry_run"])
+    last_user = checkpoint["last_user_id"]
+    pending = [u for u in user_ids if last_user is None or u > last_user]
+    scanned, changed = checkpoint["scanned"], checkpoint["changed"]
+
+    for start in range(0, len(pending) or 1, BACKFILL_CHUNK_USERS):
+        chunk_users = pending[start:start + BACKFILL_CHUNK_USERS]
+        changes = []
+        if chunk_users:
+            rows = _load_chunk(chunk_users, until)
+            columns = columns_from_rows(rows)
+            batch = score_batch(columns, plan)
+            stored = None
+            if live_rules:
+                batch, stored = _keep_live_outcomes(batch, rows, live_rules)
+            for i, tx in enumerate(rows):
+                if tx["timestamp"] < since or tx["latest_decision_id"] is None:
+                    continue  # history only, or not scored yet (scoring queue's job)
+                scanned += 1
+                score = int(batch["risk_score"][i])
+                candidate = str(batch["candidate"][i])
+                decision = _CANDIDATE_DECISIONS[candidate]
+                old_score, old_candidate, llm_set = _stored_rule_outcome(tx, plan)
+                if candidate == old_candidate and score == old_score:
+                    continue
+                key = f"{tx['old_decision']}->{decision}"
+                if llm_set:
+                    adjudicated[key] = adjudicated.get(key, 0) + 1
+                    continue
+                transitions[key] = transitions.get(key, 0) + 1
+                if len(samples) < BACKFILL_REPORT_SAMPLES:
+                    samples.append({
+                        "transaction_id": tx["id"],
+                        "user_id": tx["user_id"],
+                        "old": [tx["old_decision"], tx["old_score"]],
+                        "new": [decision, score],
+                    })
+                changes.append({
+                    "decision_id": str(uuid.uuid4()),
+                    "transaction_id": tx["id"],
+                    "decision": decision,
+                    "risk_score": score,
+                    "candidate": candidate,
+                    "old_decision": tx["old_decision"],
+                    "signals": _signals(batch, columns, i, live_rules, stored),
+                })
+        changed += len(changes)
+        done = start + BACKFILL_CHUNK_USERS >= len(pending)
+        now = _now().isoformat()
+        with unit_of_work():
+            if changes and not dry_run:
+                _write_decisions(run_id, str(plan.version), changes)
+            with get_cursor() as cur:
+                cur.execute(
+                    """
+                    INSERT INTO backfill_checkpoints
+                        (run_id, partition, last_user_id, scanned, changed, transitions_json, adjudicated_json,
+                         samples_json, done, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(run_id, partition) DO UPDATE SET
+                        last_user_id = excluded.last_user_id, scanned = excluded.scanned, changed = excluded.changed,
+                        transitions_json = excluded.transitions_json, adjudicated_json = excluded.adjudicated_json,
+                        samples_json = excluded.samples_json,
+                        done = excluded.done, updated_at = excluded.updated_at
+                    """,
+                    (
+                        run_id,
+                        partition,
+                        chunk_users[-1] if chunk_users else last_user,
+                        scanned,
+                        changed,
+                        json.dumps(transitions),
+                        json.dumps(adjudicated),
+                        json.dumps(samples),
+                        int(done),
+                        now,
+                    ),
+                )
+                cur.execute("UPDATE backfill_runs SET heartbeat_at = ? WHERE run_id = ?", (now, run_id))
+            if lease is not None:
+                renew_lease(*lease)
+    return {"scanned": scanned, "changed": changed, "transitions": transitions, "adjudicated": adjudicated, "samples": samples}
+
+
+def _signals(batch: dict, columns: dict, i: int, live_rules: list, stored: list[dict] | None) -> list[dict]:
+    """Row i's signals; live-only rules show the signal stored with the current decision."""
+    signals = signals_at(batch, columns, i)
+    if not live_rules:
+        return signals
+    live = {rule.name: rule for rule in live_rules}
+    for j, signal in enumerate(signals):
+        rule = live.get(signal["name"])
+        if rule is None:
+            continue
+        old = stored[i].get(rule.name)
+        if old is not None:
+            signals[j] = {**old, "threshold": rule.threshold, "weight": rule.weight}
+        else:
+            signals[j] = {**signal, "value": None}
+    return signals
+
+
+def run_backfill(run_id: str, workers: int = BACKFILL_WORKERS, lease: tuple[str, str] | None = None) -> dict | None:
+    """
+    Run (or resume) a registered run across a process pool; blocks until it finishes.
+    lease: the job queue lease (job id, claim token) to keep renewed.
+    Returns the report, or None if another runner holds the run.
+    """
+    run = _acquire(run_id)
+    if run is None:
+        return None
+    try:
+        by_partition = _partition_users(run)
+        # spawn: children open their own SQLite connections instead of inheriting ours
+        with ProcessPoolExecutor(max_workers=max(1, workers), mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = [pool.submit(_run_partition, run_id, p, users, lease) for p, users in by_partition.items()]
+            for future in as_completed(futures):
+                future.result()
+    except Exception as e:
+        with get_cursor() as cur:
+            cur.execute(
+                "UPDATE backfill_runs SET status = 'failed', last_error = ? WHERE run_id = ?",
+                (f"{type(e).__name__}: {e}", run_id),
+            )
+        raise
+    report = run_status(run_id)
+    with get_cursor() as cur:
+        cur.execute(
+            "UPDATE backfill_runs SET status = 'done', report_json = ?, finished_at = ? WHERE run_id = ?",
+            (json.dumps(report), _now().isoformat(), run_id),
+        )
+    return run_status(run_id)
+
+
+def run_status(run_id: str) -> dict | None:
+    """Run parameters, status and the delta report so far (merged across partitions)."""
+    with get_cursor() as cur:
+        cur.execute(
+            "SELECT run_id, since, until, dry_run, partitions, rules_version, status, last_error, created_at, finished_at "
+            "FROM backfill_runs WHERE run_id = ?",
+            (run_id,),
+        )
+        row = cur.fetchone()
+        if row is None:
+            return None
+        cur.execute("SELECT * FROM backfill_checkpoints WHERE run_id = ? ORDER BY partition", (run_id,))
+        checkpoints = [dict(r) for r in cur.fetchall()]
+    run = dict(row)
+    run["dry_run"] = bool(run["dry_run"])
+    transitions: dict[str, int] = {}
+    adjudicated: dict[str, int] = {}
+    samples: list[dict] = []
+    for cp in checkpoints:
+        for key, count in json.loads(cp["transitions_json"] or "{}").items():
+            transitions[key] = transitions.get(key, 0) + count
+        for key, count in json.loads(cp["adjudicated_json"] or "{}").items():
+            adjudicated[key] = adjudicated.get(key, 0) + count
+        samples.extend(json.loads(cp["samples_json"] or "[]"))
+    run.update({
+        "partitions_done": sum(cp["done"] for cp in checkpoints),
+        "scanned": sum(cp["scanned"] for cp in checkpoints),
+        "changed": sum(cp["changed"] for cp in checkpoints),
+        "transitions": dict(sorted(transitions.items(), key=lambda kv: -kv[1])),
+        "adjudicated": dict(sorted(adjudicated.items(), key=lambda kv: -kv[1])),
+        "samples": samples[:BACKFILL_REPORT_SAMPLES],
+    })
+    return run
+
+
+def enqueue_backfill(since: str | None, until: str | None, dry_run: bool, workers: int = BACKFILL_WORKERS) -> str:
+    """Register a run and queue it on the job queue (admin endpoint). Returns run_id."""
+    with unit_of_work():
+        run_id = start_run(since, until, dry_run)
+        enqueue(BACKFILL_JOB, {"run_id": run_id, "workers": workers})
+    return run_id
+
+
+def _run_backfill_job(payload: dict) -> None:
+    run_backfill(payload["run_id"], payload.get("workers", BACKFILL_WORKERS), current_lease())
+
+
+register_handler(BACKFILL_JOB, _run_backfill_job, dedicated_workers=BACKFILL_JOB_WORKERS)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-score historical transactions with the current rules")
+    parser.add_argument("--days", type=float, default=30, help="window length when --since is not given")
+    parser.add_argument("--since", help="ISO timestamp, inclusive")
+    parser.add_argument("--until", help="ISO timestamp, exclusive (default: now)")
+    parser.add_argument("--dry-run", action="store_true", help="report decision deltas without writing")
+    parser.add_argument("--workers", type=int, default=BACKFILL_WORKERS)
+    parser.add_argument("--resume", metavar="RUN_ID", help="continue an interrupted run")
+    args = parser.parse_args()
+    init_db()
+    if args.resume:
+        run_id = args.resume
+    else:
+        since = args.since or (_now() - timedelta(days=args.days)).isoformat()
+        run_id = start_run(since, args.until, args.dry_run)
+    print(f"Backfill run {run_id}")
+    report = run_backfill(run_id, args.workers)
+    if report is None:
+        print(f"⚠️  Run {run_id} is already running elsewhere (or finished)")
+    else:
+        mode = "would change" if report["dry_run"] else "changed"
+        print(f"✅ Scanned {report['scanned']} transactions, {mode} {report['changed']}")
+        for transition, count in report["transitions"].items():
+            print(f"  {transition}: {count}")
+        if report["adjudicated"]:
+            print(f"⚠️  {sum(report['adjudicated'].values())} LLM-adjudicated decisions disagree with the rules (left as is)")
+            for transition, count in report["adjudicated"].items():
+                print(f"  {transition}: {count}")
@@ -1,73 +1,49 @@
-"""Case generation (investigation pack) for review/block decisions."""
+"""Case generation (investigation pack) for review/block decisions.
+
+Cases are stored immediately as 'pending'; the pack is built by a job_queue worker and the case moves to 'ready'.
+With aggregation on, a flagged transaction close in time to an open case on the same user/device/IP joins
+that case: its evidence and timeline entries are appended instead of generating another pack.
+
+Every write to a case bumps cases.version. Case detail responses are cached as ready-to-send JSON keyed
+by that version, which also serves as the ETag.
+"""
 import json
+import os
+import threading
 import uuid
-from datetime import datetime, timezone
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
 
-from audit_service import append as audit_append
-from db import get_cursor
+from audit_service import append as audit_append, append_many as audit_append_many, query as audit_query
+from db import get_cursor, unit_of_work
+from job_queue import enqueue, register_handler
 from llm_client import generate_case_pack
-from models import LLMCaseOutput
-
-
-def _now_iso() -> str:
-    return datetime.now(timezone.utc).isoformat()
+from models import RiskDecision
+from pagination import keyset_page
+from scoring_context import ScoringContext
 
+CASE_PACK_JOB = "case_pack"
 
-def _tx_to_dict(row) -> dict:
-    if hasattr(row, "keys"):
-        return dict(row)
-    return row
+CASE_AGGREGATION_ENABLED = os.getenv("CASE_AGGREGATION_ENABLED", "0") == "1"
+CASE_AGGREGATION_WINDOW_MINUTES = float(os.getenv("CASE_AGGREGATION_WINDOW_MINUTES", "30"))
+CASE_AGGREGATION_KEYS = [
+    k.strip()
+    for k in os.getenv("CASE_AGGREGATION_KEYS", "user_id,device_id,ip_hash").split(",")
+    if k.strip() in ("user_id", "device_id", "ip_hash")
+]
+CASE_RELATED_MAX = 5  # other users' cases cross-referenced per flagged transaction
 
+CASE_BULK_MAX_CASES = int(os.getenv("CASE_BULK_MAX_CASES", "1000"))
+CASE_CACHE_MAX_ENTRIES = int(os.getenv("CASE_CACHE_MAX_ENTRIES", "1000"))  # 0 disables the detail cache
+CASE_DETAIL_AUDIT_LIMIT = 20
 
-def get_user_history(user_id: str, before_ts: str, limit: int = 100) -> list[dict]:
-    """Fetch user transactions before given timestamp (chronological for case build)."""
-    with get_cursor() as cur:
-        cur.execute(
-            """
-            SELECT id, timestamp, type, amount, currency, user_id, account_age_days,
-                   country, ip_hash, device_id, psp, status
-            FROM transactions
-            WHERE user_id = ? AND timestamp < ?
-            ORDER BY timestamp ASC
-            LIMIT ?
-            """,
-            (user_id, before_ts, limit),
-        )
-        rows = cur.fetchall()
-    return [_tx_to_dict(r) for r in rows]
+_detail_cache: OrderedDict[str, tuple[int, bytes]] = OrderedDict()
+_detail_cache_lock = threading.Lock()
+_detail_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
 
 
-def get_linked_context(transaction: dict, limit: int = 50) -> list[dict]:
-    """Transactions from same ip_hash or device_id (excluding current user)."""
-    ip_hash = transaction.get("ip_hash")
-    device_id = transaction.get("device_id")
-    user_id = transaction.get("user_id")
-    if not ip_hash and not device_id:
-        return []
-    with get_cursor() as cur:
-        conditions = []
-        params = []
-        if ip_hash:
-            conditions.append("ip_hash = ?")
-            params.append(ip_hash)
-        if device_id:
-            conditions.append("device_id = ?")
-            params.append(device_id)
-        where = " OR ".join(conditions)
-        params.append(user_id)
-        cur.execute(
-            f"""
-            SELECT id, timestamp, type, amount, currency, user_id, account_age_days,
-                   country, ip_hash, device_id, psp, status
-            FROM transactions
-            WHERE ({where}) AND user_id != ?
-            ORDER BY timestamp DESC
-            LIMIT ?
-            """,
-            (*params, limit),
-        )
-        rows = cur.fetchall()
-    return [_tx_to_dict(r) for r in rows]
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
 
 
 def build_timeline_events(transaction: dict, user_txs: list[dict], linked: list[dict]) -> list[dict]:
@@ -104,26 +80,25 @@ def build_timeline_events(transaction: dict, user_txs: list[dict], linked: list[
     return [{"timestamp": e["timestamp"], "event": e["event"]} for e in events]
 
 
-def create_case_for_decision(transaction: dict, decision, user_history: list[dict]) -> str:
+def _rule_based_pack(tx_id: str, timeline: list[dict], reason: str) -> dict:
+    return {
+        "confidence": "medium",
+        "hypotheses": [{"title": "Rule-based flags", "why": "Automated signals triggered review/block."}],
+        "evidence": [{"item": f"Transaction {tx_id}", "transaction_ids": [tx_id]}],
+        "timeline": timeline,
+        "recommendations": [{"action": "Manual review", "reason": reason}],
+        "investigation_suggestions": ["Check user history and linked accounts"],
+    }
+
+
+def build_case_pack(ctx: ScoringContext, decision: RiskDecision) -> dict:
     """
     Gather evidence, build timeline, call LLM for hypotheses/evidence/recommendations.
-    Store case and audit. Returns case_id.
+    History and linked context come from the scoring context (loaded there at most once).
+    Reads and LLM only; nothing is written. Runs on a job_queue worker.
     """
-    case_id = str(uuid.uuid4())
+    transaction = ctx.transaction
     tx_id = transaction.get("id", "")
-    user_id = transaction.get("user_id", "")
-    tx_ts = transaction.get("timestamp", "")
-
-    user_txs = get_user_history(user_id, tx_ts, limit=50)
-    user_txs = list(reversed(user_txs))
-    linked = get_linked_context(transaction, limit=50)
-
-    signals = []
-    if decision.signals_json:
-        try:
-            signals = json.loads(decision.signals_json)
-        except Exception:
-            pass
 
     decision_summary = {
         "decision": decision.decision,
@@ -131,59 +106,286 @@ def create_case_for_decision(transaction: dict, decision, user_history: list[dic
         "rationale": decision.llm_rationale,
     }
 
-    llm_case = generate_case_pack(transaction, user_txs, linked, signals, decision_summary)
+    llm_case = generate_case_pack(ctx, decision_summary)
 
     if llm_case is None:
         # Fallback: minimal case without LLM
-        timeline = build_timeline_events(transaction, user_txs, linked)
-        confidence = "medium"
-        hypotheses = [{"title": "Rule-based flags", "why": "Automated signals triggered review/block."}]
-        evidence = [{"item": f"Transaction {tx_id}", "transaction_ids": [tx_id]}]
-        recommendations = [{"action": "Manual review", "reason": "LLM case pack unavailable"}]
-        investigation_suggestions = ["Check user history and linked accounts"]
-    else:
-        confidence = llm_case.confidence
-        hypotheses = [h.model_dump() for h in llm_case.hypotheses]
-        evidence = [e.model_dump() for e in llm_case.evidence]
-        timeline = [t.model_dump() for t in llm_case.timeline]
-        recommendations = [r.model_dump() for r in llm_case.recommendations]
-        investigation_suggestions = llm_case.investigation_suggestions
-
-    created_at = _now_iso()
+        timeline = build_timeline_events(transaction, ctx.user_history(), ctx.linked_context())
+        return _rule_based_pack(tx_id, timeline, "LLM case pack unavailable")
+    return {
+        "confidence": llm_case.confidence,
+        "hypotheses": [h.model_dump() for h in llm_case.hypotheses],
+        "evidence": [e.model_dump() for e in llm_case.evidence],
+        "timeline": [t.model_dump() for t in llm_case.timeline],
+        "recommendations": [r.model_dump() for r in llm_case.recommendations],
+        "investigation_suggestions": llm_case.investigation_suggestions,
+    }
+
+
+def insert_pending_case(ctx: ScoringContext, decision: RiskDecision) -> str:
+    """
+    Store a case with pack_status 'pending' plus its CASE_CREATED audit, and queue the case pack job
+    (all joining the caller's unit of work). The job carries the scoring context. Returns case_id.
+    """
+    case_id = str(uuid.uuid4())
+    tx_id = ctx.transaction.get("id", "")
     with get_cursor() as cur:
         cur.execute(
             """
-            INSERT INTO cases (
-                case_id, primary_transaction_id, status, confidence,
-                hypothesis_json, evidence_json, timeline_json, recommendations_json, investigation_suggestions_json, created_at
-            )
-            VALUES (?, ?, 'open', ?, ?, ?, ?, ?, ?, ?)
+            INSERT INTO cases (case_id, primary_transaction_id, status, pack_status, created_at)
+            VALUES (?, ?, 'open', 'pending', ?)
             """,
-            (
-                case_id,
-                tx_id,
-                confidence,
-                json.dumps(hypotheses),
-                json.dumps(evidence),
-                json.dumps(timeline),
-                json.dumps(recommendations),
-                json.dumps(investigation_suggestions),
-                created_at,
-            ),
+            (case_id, tx_id, _now_iso()),
         )
-
+        cur.execute(
+            "INSERT INTO case_transactions (case_id, transaction_id, decision_id, added_at) VALUES (?, ?, ?, ?)",
+            (case_id, tx_id, decision.id, _now_iso()),
+        )
+    enqueue(
+        CASE_PACK_JOB,
+        {
+            "case_id": case_id,
+            "context": ctx.to_payload(),
+            "decision": decision.model_dump(exclude={"signals_json"}),  # signals travel parsed, in the context
+        },
+    )
     audit_append(
         "system",
         "CASE_CREATED",
         {
             "case_id": case_id,
             "transaction_id": tx_id,
-            "confidence": confidence,
+            "pack_status": "pending",
         },
     )
     return case_id
 
 
+def _store_case_pack(case_id: str, tx_id: str, pack: dict, pack_status: str) -> None:
+    """Write the pack onto a pending case, keeping evidence/timeline of transactions attached meanwhile."""
+    with unit_of_work():
+        with get_cursor() as cur:
+            cur.execute(
+                "SELECT evidence_json, timeline_json FROM cases WHERE case_id = ? AND pack_status = 'pending'",
+                (case_id,),
+            )
+            row = cur.fetchone()
+            if row is None:
+                return  # already stored (job re-run after its lease expired)
+            evidence = pack["evidence"] + json.loads(row["evidence_json"] or "[]")
+            timeline = sorted(pack["timeline"] + json.loads(row["timeline_json"] or "[]"), key=lambda e: e.get("timestamp", ""))
+            cur.execute(
+                """
+                UPDATE cases
+                SET confidence = ?, hypothesis_json = ?, evidence_json = ?, timeline_json = ?,
+                    recommendations_json = ?, investigation_suggestions_json = ?, pack_status = ?,
+                    version = version + 1
+                WHERE case_id = ?
+                """,
+                (
+                    pack["confidence"],
+                    json.dumps(pack["hypotheses"]),
+                    json.dumps(evidence),
+                    json.dumps(timeline),
+                    json.dumps(pack["recommendations"]),
+                    json.dumps(pack["investigation_suggestions"]),
+                    pack_status,
+                    case_id,
+                ),
+            )
+        audit_append(
+            "system",
+            "CASE_PACK_READY" if pack_status == "ready" else "CASE_PACK_FAILED",
+            {"case_id": case_id, "transaction_id": tx_id, "confidence": pack["confidence"]},
+        )
+
+
+def _run_case_pack_job(payload: dict) -> None:
+    """Job handler: build the case pack (history, linked context, LLM) and mark the case ready."""
+    ctx = ScoringContext.from_payload(payload["context"])
+    pack = build_case_pack(ctx, RiskDecision(**payload["decision"]))
+    _store_case_pack(payload["case_id"], ctx.transaction.get("id", ""), pack, "ready")
+
+
+def _case_pack_failed(payload: dict, error: str) -> None:
+    """Retries exhausted: keep the case usable with the rule-based pack, flagged as failed."""
+    tx_id = payload["context"]["transaction"].get("id", "")
+    pack = _rule_based_pack(tx_id, [], f"Case pack generation failed: {error}")
+    _store_case_pack(payload["case_id"], tx_id, pack, "failed")
+
+
+register_handler(CASE_PACK_JOB, _run_case_pack_job, on_failure=_case_pack_failed)
+
+
+def _matching_cases(transaction: dict, keys: list[str], same_user: bool, limit: int) -> list[dict]:
+    """
+    Open cases holding a transaction that shares one of keys within the aggregation window, on cases of
+    the transaction's own user (same_user) or of other users. A case the transaction already belongs to
+    comes first, then the most recent match; one row per case.
+    """
+    conditions, params = [], []
+    for key in keys:
+        if transaction.get(key):
+            conditions.append(f"t.{key} = ?")
+            params.append(transaction[key])
+    try:
+        ts = datetime.fromisoformat(transaction.get("timestamp", ""))
+    except ValueError:
+        return []
+    if not conditions:
+        return []
+    window = timedelta(minutes=CASE_AGGREGATION_WINDOW_MINUTES)
+    with get_cursor() as cur:
+        cur.execute(
+            f"""
+            SELECT * FROM (
+                SELECT ct.case_id, t.id, t.user_id, t.device_id, t.ip_hash, t.timestamp, t.id = ? AS own,
+                       ROW_NUMBER() OVER (PARTITION BY ct.case_id ORDER BY t.id = ? DESC, t.timestamp DESC) AS rn
+                FROM transactions t
+                JOIN case_transactions ct ON ct.transaction_id = t.id
+                JOIN cases c ON c.case_id = ct.case_id
+                JOIN transactions p ON p.id = c.primary_transaction_id
+                WHERE ({" OR ".join(conditions)}) AND t.timestamp BETWEEN ? AND ? AND c.status = 'open'
+                  AND (p.user_id = ?) = ?
+            )
+            WHERE rn = 1
+            ORDER BY own DESC, timestamp DESC
+            LIMIT ?
+            """,
+            (
+                transaction.get("id", ""),
+                transaction.get("id", ""),
+                *params,
+                (ts - window).isoformat(),
+                (ts + window).isoformat(),
+                transaction.get("user_id"),
+                int(same_user),
+                limit,
+            ),
+        )
+        rows = [dict(r) for r in cur.fetchall()]
+    for row in rows:
+        row["matched_on"] = "self" if row["own"] else next(k for k in keys if transaction.get(k) and row[k] == transaction[k])
+    return rows
+
+
+def _find_open_case(transaction: dict) -> tuple[str, str] | None:
+    """
+    Open case of the transaction's own user holding a transaction on the same user/device/IP within the
+    aggregation window. A case the transaction already belongs to wins. Returns (case_id, matched key) or None.
+    """
+    rows = _matching_cases(transaction, CASE_AGGREGATION_KEYS, same_user=True, limit=1)
+    return (rows[0]["case_id"], rows[0]["matched_on"]) if rows else None
+
+
+def _append_evidence(case_id: str, evidence_item: dict, timeline_event: dict | None = None) -> None:
+    """Add an evidence (and timeline) entry to a case and bump its version."""
+    with get_cursor() as cur:
+        cur.execute("SELECT evidence_json, timeline_json FROM cases WHERE case_id = ?", (case_id,))
+        row = cur.fetchone()
+        evidence = json.loads(row["evidence_json"] or "[]") + [evidence_item]
+        timeline = json.loads(row["timeline_json"] or "[]")
+        if timeline_event is not None:
+            timeline = sorted(timeline + [timeline_event], key=lambda e: e.get("timestamp", ""))
+        cur.execute(
+            "UPDATE cases SET evidence_json = ?, timeline_json = ?, version = version + 1 WHERE case_id = ?",
+            (json.dumps(evidence), json.dumps(timeline), case_id),
+        )
+
+
+def _attach_to_case(case_id: str, ctx: ScoringContext, decision: RiskDecision, matched_on: str) -> None:
+    """Link a flagged transaction to an open case and append its evidence and timeline entries."""
+    tx = ctx.transaction
+    tx_id = tx.get("id", "")
+    fired = [s.get("name", "") for s in ctx.signals if s.get("fired")]
+    evidence_item = {
+        "item": (
+            f"Linked {tx.get('type')} {tx.get('amount')} {tx.get('currency')} (same {matched_on}): "
+            f"{decision.decision}, score {decision.risk_score}" + (f", signals: {', '.join(fired)}" if fired else "")
+        ),
+        "transaction_ids": [tx_id],
+    }
+    timeline_event = {
+        "timestamp": tx.get("timestamp", ""),
+        "event": f"Linked: {tx.get('type')} {tx.get('amount')} {tx.get('currency')} ({decision.decision})",
+    }
+    with get_cursor() as cur:
+        cur.execute(
+            "INSERT INTO case_transactions (case_id, transaction_id, decision_id, added_at) VALUES (?, ?, ?, ?)",
+            (case_id, tx_id, decision.id, _now_iso()),
+        )
+    _append_evidence(case_id, evidence_item, timeline_event)
+    audit_append(
+        "system",
+        "CASE_TRANSACTION_ATTACHED",
+        {"case_id": case_id, "transaction_id": tx_id, "decision_id": decision.id, "matched_on": matched_on},
+    )
+
+
+def _link_related_cases(case_id: str, ctx: ScoringContext, decision: RiskDecision) -> None:
+    """
+    Cross-reference a case with other users' open cases sharing the transaction's device/IP: evidence on
+    both sides, but no case_transactions rows, since actions only change a case's own user's transactions.
+    """
+    tx = ctx.transaction
+    tx_id = tx.get("id", "")
+    keys = [k for k in CASE_AGGREGATION_KEYS if k != "user_id"]
+    for row in _matching_cases(tx, keys, same_user=False, limit=CASE_RELATED_MAX):
+        matched_on = row["matched_on"]
+        if matched_on == "self":
+            continue  # attached to another user's case before cases were kept per user
+        _append_evidence(case_id, {
+            "item": f"Same {matched_on} as user {row['user_id']} (open case {row['case_id']})",
+            "transaction_ids": [row["id"]],
+        })
+        _append_evidence(row["case_id"], {
+            "item": (
+                f"Same {matched_on} used by user {tx.get('user_id')}: {tx.get('type')} {tx.get('amount')} "
+                f"{tx.get('currency')}, {decision.decision} (open case {case_id})"
+            ),
+            "transaction_ids": [tx_id],
+        })
+        audit_append(
+            "system",
+            "CASE_LINKED",
+            {"case_id": case_id, "linked_case_id": row["case_id"], "transaction_id": tx_id, "matched_on": matched_on},
+        )
+
+
+def open_or_attach_case(ctx: ScoringContext, decision: RiskDecision) -> str:
+    """
+    Case for a review/block decision (joins the caller's unit of work). With aggregation on, attach to an
+    open case of the same user matching on user/device/IP, otherwise open a pending case, and cross-reference
+    other users' open cases on the same device/IP. Returns case_id.
+    """
+    if not CASE_AGGREGATION_ENABLED:
+        return insert_pending_case(ctx, decision)
+    match = _find_open_case(ctx.transaction)
+    if match is not None and match[1] == "self":
+        return match[0]
+    if match is not None:
+        case_id = match[0]
+        _attach_to_case(case_id, ctx, decision, match[1])
+    else:
+        case_id = insert_pending_case(ctx, decision)
+    _link_related_cases(case_id, ctx, decision)
+    return case_id
+
+
+def touch_cases_for_transactions(transaction_ids: list[str]) -> None:
+    """Bump the version of cases containing the transactions (their status or decision changed outside the case)."""
+    with get_cursor() as cur:
+        cur.execute(
+            """
+            UPDATE cases SET version = version + 1
+            WHERE case_id IN (
+                SELECT case_id FROM case_transactions WHERE transaction_id IN (SELECT value FROM json_each(?))
+            )
+            """,
+            (json.dumps(transaction_ids),),
+        )
+
+
 def get_case(case_id: str) -> dict | None:
     """Return full case pack + primary transaction + decision + relevant audit entries."""
     with get_cursor() as cur:
@@ -201,8 +403,14 @@ def get_case(case_id: str) -> dict | None:
             (tx_id,),
         )
         dec_row = cur.fetchone()
+        cur.execute(
+            "SELECT transaction_id FROM case_transactions WHERE case_id = ? ORDER BY added_at",
+            (case_id,),
+        )
+        linked_ids = [r["transaction_id"] for r in cur.fetchall()]
     case["transaction"] = dict(tx_row) if tx_row else None
     case["decision"] = dict(dec_row) if dec_row else None
+    case["transaction_ids"] = linked_ids or [tx_id]
     # Parse JSON fields
     for key in ("hypothesis_json", "evidence_json", "timeline_json", "recommendations_json", "investigation_suggestions_json"):
         if case.get(key):
@@ -215,53 +423,260 @@ def get_case(case_id: str) -> dict | None:
     return case
 
 
-def list_cases() -> list[dict]:
-    """List cases: case_id, primary_transaction_id, status, confidence, created_at."""
+def case_etag(case_id: str, version: int) -> str:
+    return f'"{case_id}.{version}"'
+
+
+def get_case_detail(case_id: str) -> tuple[str, bytes] | None:
+    """
+    Case detail as served by /cases/{case_id}: get_case plus the latest audit entries, JSON-encoded.
+    Returns (etag, body) or None. An unchanged case costs one primary-key lookup.
+    """
     with get_cursor() as cur:
-        cur.execute(
-            """
-            SELECT case_id, primary_transaction_id, status, confidence, created_at
-            FROM cases
-            ORDER BY created_at DESC
-            """
+        cur.execute("SELECT version FROM cases WHERE case_id = ?", (case_id,))
+        row = cur.fetchone()
+    if row is None:
+        return None
+    version = row["version"]
+    with _detail_cache_lock:
+        entry = _detail_cache.get(case_id)
+        if entry is not None and entry[0] == version:
+            _detail_cache.move_to_end(case_id)
+            _detail_cache_stats["hits"] += 1
+            return case_etag(case_id, version), entry[1]
+        _detail_cache_stats["misses"] += 1
+
+    case = get_case(case_id)
+    if case is None:
+        return None
+    # Read after the version, so the body is never older than the tag it is cached under
+    case["audit_entries"], case["audit_next_cursor"] = audit_query(limit=CASE_DETAIL_AUDIT_LIMIT, case_id=case_id)
+    body = json.dumps(case).encode()
+    if CASE_CACHE_MAX_ENTRIES > 0:
+        with _detail_cache_lock:
+            current = _detail_cache.get(case_id)
+            if current is None or current[0] <= version:
+                _detail_cache[case_id] = (version, body)
+                _detail_cache.move_to_end(case_id)
+            while len(_detail_cache) > CASE_CACHE_MAX_ENTRIES:
+                _detail_cache.popitem(last=False)
+                _detail_cache_stats["evictions"] += 1
+    return case_etag(case_id, version), body
+
+
+def detail_cache_stats() -> dict:
+    with _detail_cache_lock:
+        return {"entries": len(_detail_cache), "max_entries": CASE_CACHE_MAX_ENTRIES, **_detail_cache_stats}
+
+
+def list_cases(
+    limit: int = 100,
+    cursor: str | None = None,
+    status: str | None = None,
+    confidence: str | None = None,
+    created_from: str | None = None,
+    created_to: str | None = None,
+) -> tuple[list[dict], str | None]:
+    """
+    One page of cases, newest first: case_id, primary_transaction_id, status, confidence, pack_status, created_at.
+    Returns (cases, next cursor or None). Raises ValueError on a bad cursor.
+    """
+    with get_cursor() as cur:
+        return keyset_page(
+            "cases",
+            "case_id, primary_transaction_id, status, confidence, pack_status, created_at",
+            "case_id",
+            [
+                ("status = ?", status),
+                ("confidence = ?", confidence),
+                ("created_at >= ?", created_from),
+                ("created_at < ?", created_to),
+            ],
+            limit,
+            cursor,
+            cur,
         )
-        rows = cur.fetchall()
-    return [dict(r) for r in rows]
+
+
+def count_cases_by_status() -> dict:
+    """Case counts by status and by pack_status (index-only scans)."""
+    with get_cursor() as cur:
+        cur.execute("SELECT status, COUNT(*) AS n FROM cases GROUP BY status")
+        by_status = {r["status"]: r["n"] for r in cur.fetchall()}
+        cur.execute("SELECT pack_status, COUNT(*) AS n FROM cases GROUP BY pack_status")
+        by_pack_status = {r["pack_status"]: r["n"] for r in cur.fetchall()}
+    return {"total": sum(by_status.values()), "by_status": by_status, "by_pack_status": by_pack_status}
+
+
+# case_transactions rows (ct) whose transaction belongs to the user of the case's primary transaction
+_PRIMARY_USER_LINKS = """
+    case_transactions ct
+    JOIN cases c ON c.case_id = ct.case_id
+    JOIN transactions p ON p.id = c.primary_transaction_id
+    JOIN transactions t ON t.id = ct.transaction_id AND t.user_id = p.user_id
+"""
+
+# action -> (transaction status, case status; None keeps the case's status)
+_ACTION_OUTCOMES = {
+    "approve": ("approved", "closed"),
+    "hold": ("review", None),
+    "request_kyc": ("review", None),
+    "block": ("blocked", "closed"),
+}
 
 
 def apply_action(case_id: str, action: str, note: str | None, actor: str = "analyst") -> dict | None:
     """
     Update case status and/or transaction status; write audit.
     action: approve | hold | request_kyc | block
+    The transaction status applies to the case's own user only: transactions of other users linked by
+    device/IP are evidence and keep their status.
     """
-    case = get_case(case_id)
-    if not case:
-        return None
-    tx_id = case["primary_transaction_id"]
-
-    new_tx_status = None
-    new_case_status = case.get("status", "open")
-    if action == "approve":
-        new_tx_status = "approved"
-        new_case_status = "closed"
-    elif action == "hold":
-        new_tx_status = "review"
-        # case stays open
-    elif action == "request_kyc":
-        new_tx_status = "review"
-        # case stays open
-    elif action == "block":
-        new_tx_status = "blocked"
-        new_case_status = "closed"
-
     with get_cursor() as cur:
-        if new_tx_status:
-            cur.execute("UPDATE transactions SET status = ? WHERE id = ?", (new_tx_status, tx_id))
-        cur.execute("UPDATE cases SET status = ? WHERE case_id = ?", (new_case_status, case_id))
+        cur.execute("SELECT primary_transaction_id, status FROM cases WHERE case_id = ?", (case_id,))
+        case = cur.fetchone()
+        if not case:
+            return None
+        tx_id = case["primary_transaction_id"]
+        cur.execute(
+            f"SELECT ct.transaction_id FROM {_PRIMARY_USER_LINKS} WHERE ct.case_id = ? ORDER BY ct.added_at",
+            (case_id,),
+        )
+        transaction_ids = [r["transaction_id"] for r in cur.fetchall()] or [tx_id]
+
+    new_tx_status, new_case_status = _ACTION_OUTCOMES.get(action, (None, None))
+    new_case_status = new_case_status or case["status"] or "open"
+
+    with unit_of_work():
+        with get_cursor() as cur:
+            if new_tx_status:
+                changed = list({tx_id, *transaction_ids})
+                cur.execute(
+                    "UPDATE transactions SET status = ? WHERE id IN (SELECT value FROM json_each(?))",
+                    (new_tx_status, json.dumps(changed)),
+                )
+                # Other cases holding these transactions show their status too
+                touch_cases_for_transactions(changed)
+            cur.execute(
+                "UPDATE cases SET status = ?, version = version + 1 WHERE case_id = ?",
+                (new_case_status, case_id),
+            )
 
-    audit_append(
-        actor,
-        "CASE_ACTION",
-        {"case_id": case_id, "action": action, "note": note, "transaction_id": tx_id},
-    )
+        audit_append(
+            actor,
+            "CASE_ACTION",
+            {
+                "case_id": case_id,
+                "action": action,
+                "note": note,
+                "transaction_id": tx_id,
+                "transaction_ids": transaction_ids,
+            },
+        )
     return get_case(case_id)
+
+
+def apply_bulk_action(
+    action: str,
+    note: str | None,
+    case_ids: list[str] | None = None,
+    filters: dict | None = None,
+    actor: str = "analyst",
+) -> dict:
+    """
+    apply_action over many cases in one transaction: cases given by id, or matching filters
+    (status, confidence, created_from, created_to). Status updates run set-wise and the CASE_ACTION
+    audit rows (one per case, sharing a bulk_action_id) are written in one batch.
+    Returns a summary. Raises ValueError when more than CASE_BULK_MAX_CASES cases match.
+    """
+    if case_ids is not None:
+        case_ids = list(dict.fromkeys(case_ids))
+        target, params = "case_id IN (SELECT value FROM json_each(?))", [json.dumps(case_ids)]
+    else:
+        filters = filters or {}
+        conditions = [
+            (cond, filters.get(key))
+            for cond, key in (
+                ("status = ?", "status"),
+                ("confidence = ?", "confidence"),
+                ("created_at >= ?", "created_from"),
+                ("created_at < ?", "created_to"),
+            )
+            if filters.get(key) is not None
+        ]
+        target = " AND ".join(cond for cond, _ in conditions) or "1"
+        params = [value for _, value in conditions]
+    selected = f"SELECT case_id FROM cases WHERE {target} ORDER BY created_at DESC, case_id DESC LIMIT ?"
+    params.append(CASE_BULK_MAX_CASES + 1)
+
+    new_tx_status, new_case_status = _ACTION_OUTCOMES.get(action, (None, None))
+    bulk_action_id = str(uuid.uuid4())
+    updated_transactions = 0
+    with unit_of_work():
+        with get_cursor() as cur:
+            # Write first: the lock keeps the matched set fixed until commit
+            cur.execute(f"UPDATE cases SET version = version + 1 WHERE case_id IN ({selected})", params)
+            cur.execute(
+                f"SELECT case_id, primary_transaction_id FROM cases WHERE case_id IN ({selected}) "
+                "ORDER BY created_at DESC, case_id DESC",
+                params,
+            )
+            cases = cur.fetchall()
+            if len(cases) > CASE_BULK_MAX_CASES:
+                raise ValueError(f"more than {CASE_BULK_MAX_CASES} cases match; narrow the filter")
+            matched_json = json.dumps([c["case_id"] for c in cases])
+            if new_case_status:
+                cur.execute(
+                    "UPDATE cases SET status = ? WHERE case_id IN (SELECT value FROM json_each(?))",
+                    (new_case_status, matched_json),
+                )
+            cur.execute(
+                f"""
+                SELECT ct.case_id, ct.transaction_id FROM {_PRIMARY_USER_LINKS}
+                WHERE ct.case_id IN (SELECT value FROM json_each(?))
+                ORDER BY ct.added_at
+                """,
+                (matched_json,),
+            )
+            linked: dict[str, list[str]] = {}
+            for r in cur.fetchall():
+                linked.setdefault(r["case_id"], []).append(r["transaction_id"])
+            if new_tx_status:
+                # Like apply_action: only each case's own user's transactions change status
+                own = {c["primary_transaction_id"] for c in cases}
+                own.update(tx for ids in linked.values() for tx in ids)
+                cur.execute(
+                    "UPDATE transactions SET status = ? WHERE id IN (SELECT value FROM json_each(?))",
+                    (new_tx_status, json.dumps(list(own))),
+                )
+                updated_transactions = cur.rowcount
+                touch_cases_for_transactions(list(own))
+
+        audit_append_many(
+            [
+                (
+                    actor,
+                    "CASE_ACTION",
+                    {
+                        "case_id": c["case_id"],
+                        "action": action,
+                        "note": note,
+                        "transaction_id": c["primary_transaction_id"],
+                        "transaction_ids": linked.get(c["case_id"]) or [c["primary_transaction_id"]],
+                        "bulk_action_id": bulk_action_id,
+                    },
+                )
+                for c in cases
+            ]
+        )
+
+    matched = [c["case_id"] for c in cases]
+    matched_set = set(matched)
+    return {
+        "bulk_action_id": bulk_action_id,
+        "action": action,
+        "matched": len(matched),
+        "updated_transactions": updated_transactions,
+        "case_ids": matched,
+        "not_found": [cid for cid in case_ids if cid not in matched_set] if case_ids is not None else [],
+    }
@@ -1,22 +1,127 @@
-"""SQLite database."""
+"""SQLite database: one long-lived, tuned connection per thread, plus a per-thread unit of work.
+
+A thread's connection is closed when the thread exits (server worker threads come and go), or by close_all.
+"""
 import os
 import sqlite3
+import threading
+import weakref
 from contextlib import contextmanager
 from pathlib import Path
 
 DATABASE_PATH = os.getenv("DATABASE_PATH", "./fraudops.db")
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "20000"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+DB_STATEMENT_CACHE = int(os.getenv("DB_STATEMENT_CACHE", "256"))
+
+_local = threading.local()
+_lock = threading.Lock()
+_connections: dict[int, sqlite3.Connection] = {}  # id -> open connection
+_generation = 0  # bumped by close_all so threads drop their closed connection
+_stats = {"opened": 0, "reused": 0, "closed": 0}
+_dir_ready = False
+
+
+def _open_connection() -> sqlite3.Connection:
+    global _dir_ready
+    if not _dir_ready:
+        Path(DATABASE_PATH).parent.mkdir(parents=True, exist_ok=True)
+        _dir_ready = True
+    conn = sqlite3.connect(
+        DATABASE_PATH,
+        check_same_thread=False,
+        timeout=DB_BUSY_TIMEOUT_MS / 1000,
+        cached_statements=DB_STATEMENT_CACHE,
+    )
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+    return conn
+
+
+class _ThreadConnection:
+    """Lives only in its thread's _local: when the thread exits it is collected and its finalizer closes the connection."""
+
+    __slots__ = ("conn", "generation", "__weakref__")
+
+    def __init__(self, conn: sqlite3.Connection, generation: int):
+        self.conn = conn
+        self.generation = generation
+
+
+def _release(conn: sqlite3.Connection) -> None:
+    with _lock:
+        if _connections.pop(id(conn), None) is None:
+            return  # already closed by close_all
+        _stats["closed"] += 1
+    conn.close()
+
+
+def get_connection() -> sqlite3.Connection:
+    """Return this thread's SQLite connection, opening it on first use. Do not close it."""
+    held = getattr(_local, "held", None)
+    if held is not None and held.generation == _generation:
+        with _lock:
+            _stats["reused"] += 1
+        return held.conn
+    conn = _open_connection()
+    held = _ThreadConnection(conn, _generation)
+    weakref.finalize(held, _release, conn)
+    with _lock:
+        _connections[id(conn)] = conn
+        _stats["opened"] += 1
+    _local.held = held  # outside the lock: dropping a stale holder runs its finalizer
+    return conn
+
+
+def close_all() -> None:
+    """Close every open connection (shutdown). Threads reopen lazily on next use."""
+    global _generation
+    with _lock:
+        conns = list(_connections.values())
+        _connections.clear()
+        _stats["closed"] += len(conns)
+        _generation += 1
+    for conn in conns:
+        conn.close()
+
+
+def pool_stats() -> dict:
+    """Connection pool counters for the ops endpoint."""
+    with _lock:
+        return {
+            "database_path": DATABASE_PATH,
+            "open_connections": len(_connections),
+            "opened": _stats["opened"],
+            "reused": _stats["reused"],
+            "closed": _stats["closed"],
+            "statement_cache_size": DB_STATEMENT_CACHE,
+            "busy_timeout_ms": DB_BUSY_TIMEOUT_MS,
+            "cache_size_kb": DB_CACHE_SIZE_KB,
+            "mmap_size": DB_MMAP_SIZE,
+        }
 
 
-def get_connection():
-    """Return connection to SQLite database."""
-    Path(DATABASE_PATH).parent.mkdir(parents=True, exist_ok=True)
-    return sqlite3.connect(DATABASE_PATH, check_same_thread=False)
+def _ensure_column(conn: sqlite3.Connection, table: str, column: str, decl: str) -> bool:
+    """Add a column to a table created by an older schema. Returns True if it was added."""
+    columns = {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}
+    if column in columns:
+        return False
+    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+    return True
 
 
 def init_db():
     """Create all tables if they do not exist."""
     conn = get_connection()
     try:
+        had_case_links = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'case_transactions'"
+        ).fetchone() is not None
         conn.executescript("""
             CREATE TABLE IF NOT EXISTS transactions (
                 id TEXT PRIMARY KEY,
@@ -30,7 +135,12 @@ def init_db():
                 ip_hash TEXT,
                 device_id TEXT,
                 psp TEXT,
-                status TEXT DEFAULT 'pending'
+                status TEXT DEFAULT 'pending',
+                latest_decision_id TEXT,
+                scored_at TEXT,
+                claim_token TEXT,
+                claimed_until TEXT,
+                claim_attempts INTEGER NOT NULL DEFAULT 0
             );
 
             CREATE TABLE IF NOT EXISTS risk_decisions (
@@ -54,42 +164,251 @@ def init_db():
                 timeline_json TEXT,
                 recommendations_json TEXT,
                 investigation_suggestions_json TEXT,
+                pack_status TEXT NOT NULL DEFAULT 'ready',
+                version INTEGER NOT NULL DEFAULT 0,
                 created_at TEXT NOT NULL,
                 FOREIGN KEY (primary_transaction_id) REFERENCES transactions(id)
             );
 
+            CREATE TABLE IF NOT EXISTS case_transactions (
+                case_id TEXT NOT NULL,
+                transaction_id TEXT NOT NULL,
+                decision_id TEXT,
+                added_at TEXT NOT NULL,
+                PRIMARY KEY (case_id, transaction_id),
+                FOREIGN KEY (case_id) REFERENCES cases(case_id),
+                FOREIGN KEY (transaction_id) REFERENCES transactions(id)
+            );
+
             CREATE TABLE IF NOT EXISTS audit_log (
                 event_id TEXT PRIMARY KEY,
                 actor TEXT NOT NULL,
                 event_type TEXT NOT NULL,
                 payload_json TEXT,
+                created_at TEXT NOT NULL,
+                case_id TEXT,
+                transaction_id TEXT,
+                decision_id TEXT,
+                seq INTEGER  -- commit order (see audit_service)
+            );
+
+            CREATE TABLE IF NOT EXISTS user_features (
+                user_id TEXT PRIMARY KEY,
+                last_ts TEXT NOT NULL,
+                last_country TEXT,
+                known_devices_json TEXT,
+                known_psps_json TEXT,
+                withdrawals_json TEXT,
+                window_30d_json TEXT,
+                sum_30d REAL NOT NULL DEFAULT 0,
+                updated_at TEXT NOT NULL,
+                version INTEGER NOT NULL DEFAULT 0
+            );
+
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                payload_json TEXT,
+                status TEXT NOT NULL DEFAULT 'queued',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL DEFAULT 3,
+                available_at TEXT NOT NULL,
+                locked_until TEXT,
+                claim_token TEXT,
+                last_error TEXT,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            );
+
+            CREATE TABLE IF NOT EXISTS backfill_runs (
+                run_id TEXT PRIMARY KEY,
+                since TEXT,
+                until TEXT NOT NULL,
+                dry_run INTEGER NOT NULL,
+                partitions INTEGER NOT NULL,
+                rules_version TEXT,
+                rules_json TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                heartbeat_at TEXT,
+                report_json TEXT,
+                last_error TEXT,
+                created_at TEXT NOT NULL,
+                finished_at TEXT
+            );
+
+            CREATE TABLE IF NOT EXISTS backfill_checkpoints (
+                run_id TEXT NOT NULL,
+                partition INTEGER NOT NULL,
+                last_user_id TEXT,
+                scanned INTEGER NOT NULL DEFAULT 0,
+                changed INTEGER NOT NULL DEFAULT 0,
+                transitions_json TEXT,
+                adjudicated_json TEXT,
+                samples_json TEXT,
+                done INTEGER NOT NULL DEFAULT 0,
+                updated_at TEXT,
+                PRIMARY KEY (run_id, partition),
+                FOREIGN KEY (run_id) REFERENCES backfill_runs(run_id)
+            );
+
+            -- One row per (challenger rule set, transaction); see shadow.py
+            CREATE TABLE IF NOT EXISTS shadow_decisions (
+                shadow_set TEXT NOT NULL,
+                transaction_id TEXT NOT NULL,
+                rules_version TEXT NOT NULL,
+                live_decision TEXT NOT NULL,
+                live_score INTEGER NOT NULL,
+                shadow_decision TEXT NOT NULL,
+                shadow_score INTEGER NOT NULL,
+                fired TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                PRIMARY KEY (shadow_set, transaction_id)
+            ) WITHOUT ROWID;
+
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                fingerprint TEXT PRIMARY KEY,
+                output_json TEXT NOT NULL,
                 created_at TEXT NOT NULL
             );
 
             CREATE INDEX IF NOT EXISTS idx_transactions_user_id ON transactions(user_id);
+            CREATE INDEX IF NOT EXISTS idx_transactions_user_timestamp ON transactions(user_id, timestamp);
             CREATE INDEX IF NOT EXISTS idx_transactions_status ON transactions(status);
-            CREATE INDEX IF NOT EXISTS idx_transactions_timestamp ON transactions(timestamp);
+            DROP INDEX IF EXISTS idx_transactions_timestamp;
+            CREATE INDEX IF NOT EXISTS idx_transactions_timestamp_id ON transactions(timestamp, id);
+            CREATE INDEX IF NOT EXISTS idx_transactions_device_id ON transactions(device_id);
+            CREATE INDEX IF NOT EXISTS idx_transactions_ip_hash ON transactions(ip_hash);
             CREATE INDEX IF NOT EXISTS idx_risk_decisions_transaction_id ON risk_decisions(transaction_id);
-            CREATE INDEX IF NOT EXISTS idx_cases_status ON cases(status);
+            DROP INDEX IF EXISTS idx_cases_status;
+            CREATE INDEX IF NOT EXISTS idx_cases_created ON cases(created_at, case_id);
+            CREATE INDEX IF NOT EXISTS idx_cases_status_created ON cases(status, created_at, case_id);
+            CREATE INDEX IF NOT EXISTS idx_cases_confidence_created ON cases(confidence, created_at, case_id);
             CREATE INDEX IF NOT EXISTS idx_cases_primary_transaction_id ON cases(primary_transaction_id);
-            CREATE INDEX IF NOT EXISTS idx_audit_log_created_at ON audit_log(created_at);
-            CREATE INDEX IF NOT EXISTS idx_audit_log_actor ON audit_log(actor);
+            CREATE INDEX IF NOT EXISTS idx_case_transactions_transaction_id ON case_transactions(transaction_id);
+            DROP INDEX IF EXISTS idx_audit_log_created_at;
+            DROP INDEX IF EXISTS idx_audit_log_actor;
+            CREATE INDEX IF NOT EXISTS idx_audit_log_created ON audit_log(created_at, event_id);
+            CREATE INDEX IF NOT EXISTS idx_audit_log_actor_created ON audit_log(actor, created_at, event_id);
+            CREATE INDEX IF NOT EXISTS idx_audit_log_event_type_created ON audit_log(event_type, created_at, event_id);
+            CREATE INDEX IF NOT EXISTS idx_jobs_status_available ON jobs(status, available_at);
+            CREATE INDEX IF NOT EXISTS idx_jobs_claim_token ON jobs(claim_token);
+            CREATE INDEX IF NOT EXISTS idx_shadow_decisions_set_created ON shadow_decisions(shadow_set, created_at);
         """)
+        _ensure_column(conn, "cases", "pack_status", "TEXT NOT NULL DEFAULT 'ready'")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cases_pack_status ON cases(pack_status)")
+        _ensure_column(conn, "cases", "version", "INTEGER NOT NULL DEFAULT 0")
+        _ensure_column(conn, "user_features", "version", "INTEGER NOT NULL DEFAULT 0")
+        _ensure_column(conn, "backfill_checkpoints", "adjudicated_json", "TEXT")
+        if _ensure_column(conn, "transactions", "latest_decision_id", "TEXT"):
+            conn.execute(
+                """
+                UPDATE transactions SET latest_decision_id = (
+                    SELECT r.id FROM risk_decisions r WHERE r.transaction_id = transactions.id
+                    ORDER BY r.created_at DESC LIMIT 1
+                )
+                """
+            )
+        # Scoring queue: unscored rows are scored_at IS NULL; claims lease them to one worker
+        if _ensure_column(conn, "transactions", "scored_at", "TEXT"):
+            conn.execute(
+                """
+                UPDATE transactions SET scored_at = (
+                    SELECT r.created_at FROM risk_decisions r WHERE r.id = transactions.latest_decision_id
+                )
+                WHERE latest_decision_id IS NOT NULL
+                """
+            )
+        _ensure_column(conn, "transactions", "claim_token", "TEXT")
+        _ensure_column(conn, "transactions", "claimed_until", "TEXT")
+        _ensure_column(conn, "transactions", "claim_attempts", "INTEGER NOT NULL DEFAULT 0")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_transactions_unscored ON transactions(timestamp, id) WHERE scored_at IS NULL"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_transactions_claim_token ON transactions(claim_token) WHERE claim_token IS NOT NULL"
+        )
+        # Audit events link to the entities they describe (older rows are backfilled from their payload)
+        for column in ("case_id", "transaction_id", "decision_id"):
+            if _ensure_column(conn, "audit_log", column, "TEXT"):
+                conn.execute(
+                    f"UPDATE audit_log SET {column} = json_extract(payload_json, '$.{column}') WHERE payload_json IS NOT NULL"
+                )
+            conn.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_audit_log_{column} ON audit_log({column}, created_at, event_id)"
+            )
+        if _ensure_column(conn, "audit_log", "seq", "INTEGER"):
+            conn.execute("UPDATE audit_log SET seq = rowid")  # insert order of the existing rows
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_audit_log_seq ON audit_log(seq)")
+        if not had_case_links:
+            # Cases from before aggregation hold just their primary transaction
+            conn.execute(
+                """
+                INSERT OR IGNORE INTO case_transactions (case_id, transaction_id, added_at)
+                SELECT case_id, primary_transaction_id, created_at FROM cases WHERE primary_transaction_id IS NOT NULL
+                """
+            )
         conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+@contextmanager
+def unit_of_work():
+    """
+    Group every get_cursor block on this thread into one transaction, committed once on exit
+    and rolled back as a whole on error. Nested units join the outermost one.
+    Keep slow work (LLM calls) outside: the SQLite write lock is held from the first write to commit.
+    """
+    conn = get_connection()
+    depth = getattr(_local, "uow_depth", 0)
+    if depth == 0:
+        _local.after_commit = []
+    _local.uow_depth = depth + 1
+    try:
+        yield
+        if depth == 0:
+            conn.commit()
+    except Exception:
+        if depth == 0:
+            conn.rollback()
+            _local.after_commit = []
+        raise
     finally:
-        conn.close()
+        _local.uow_depth = depth
+    if depth == 0:
+        callbacks, _local.after_commit = _local.after_commit, []
+        for callback in callbacks:
+            callback()
+
+
+def after_commit(callback) -> None:
+    """Run callback once the current unit of work has committed (right away if there is none; dropped on rollback)."""
+    if getattr(_local, "uow_depth", 0):
+        _local.after_commit.append(callback)
+    else:
+        callback()
 
 
 @contextmanager
 def get_cursor():
-    """Context manager for database cursor with row factory."""
+    """
+    Context manager for a cursor on this thread's connection; commits on exit, rolls back on error.
+    Inside unit_of_work() the commit/rollback is left to the unit.
+    """
     conn = get_connection()
-    conn.row_factory = sqlite3.Row
+    cur = conn.cursor()
+    if getattr(_local, "uow_depth", 0):
+        try:
+            yield cur
+        finally:
+            cur.close()
+        return
     try:
-        yield conn.cursor()
+        yield cur
         conn.commit()
     except Exception:
         conn.rollback()
         raise
     finally:
-        conn.close()
+        cur.close()
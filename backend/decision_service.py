@@ -1,61 +1,114 @@
 """Orchestrates risk scoring (deterministic + LLM) and decision persistence."""
 import json
+import os
+import random
+import threading
 import uuid
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 
-from audit_service import append as audit_append
-from case_service import create_case_for_decision
-from db import get_cursor
+from audit_service import append as audit_append, append_many as audit_append_many
+from case_service import open_or_attach_case, touch_cases_for_transactions
+from db import after_commit, get_cursor, unit_of_work
+from feature_store import features_at, fold, fold_late, load_state, rows_between, save_states, stored_ids
 from llm_client import adjudicate_decision
 from models import RiskDecision
-from risk_engine import compute_signals, risk_score_and_candidate
+from risk_engine import (
+    AVG_WINDOW_DAYS,
+    DAY_US,
+    build_features,
+    compute_signals_from_features,
+    current_rules,
+    history_epochs,
+    risk_score_and_candidate,
+    to_epoch_us,
+)
+from scoring_context import ScoringContext, load_user_profile, load_user_window
+from shadow import enabled as shadow_enabled, submit as shadow_submit
+from velocity import counted_ids, lookup_batch as lookup_velocity, record as record_velocity
 
 
 def _now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
-def _tx_to_dict(row) -> dict:
-    if hasattr(row, "keys"):
-        return dict(row)
-    return row
+HISTORY_LIMIT = 100  # history rows handed to case packs from re-scores
 
+# sync: adjudicate inside the request. async: answer with the rule-based decision at once and
+# let a background worker write the LLM-refined decision as a new row.
+LLM_ADJUDICATION_MODE = os.getenv("LLM_ADJUDICATION_MODE", "sync").lower()
+LLM_ASYNC_WORKERS = int(os.getenv("LLM_ASYNC_WORKERS", "4"))
 
-def get_user_history(user_id: str, before_ts: str, limit: int = 100) -> list[dict]:
-    """Fetch user transactions before given timestamp, ordered by timestamp desc (so recent first)."""
-    with get_cursor() as cur:
-        cur.execute(
-            """
-            SELECT id, timestamp, type, amount, currency, user_id, account_age_days,
-                   country, ip_hash, device_id, psp, status
-            FROM transactions
-            WHERE user_id = ? AND timestamp < ?
-            ORDER BY timestamp DESC
-            LIMIT ?
-            """,
-            (user_id, before_ts, limit),
-        )
-        rows = cur.fetchall()
-    return [_tx_to_dict(r) for r in rows]
+_refinement_pool: ThreadPoolExecutor | None = None
 
+# Only base scores in [LLM_GATE_MIN_SCORE, LLM_GATE_MAX_SCORE] go to the LLM; outside the band the
+# model cannot change much (and the hard policy overrides it on blocks). LLM_GATE_SAMPLE_RATE sends
+# that fraction of out-of-band traffic anyway, for quality checks.
+LLM_GATE_MIN_SCORE = int(os.getenv("LLM_GATE_MIN_SCORE", "30"))
+LLM_GATE_MAX_SCORE = int(os.getenv("LLM_GATE_MAX_SCORE", "85"))
+LLM_GATE_SAMPLE_RATE = float(os.getenv("LLM_GATE_SAMPLE_RATE", "0"))
 
-def run_decision(transaction: dict) -> tuple[RiskDecision, str | None]:
+_gate_lock = threading.Lock()
+_gate_stats = {"in_band": 0, "sampled": 0, "skipped_low": 0, "skipped_high": 0}
+
+
+def _route_to_llm(risk_score_base: int) -> bool:
+    """Gating policy: should this base score be adjudicated by the LLM?"""
+    if LLM_GATE_MIN_SCORE <= risk_score_base <= LLM_GATE_MAX_SCORE:
+        key = "in_band"
+    elif LLM_GATE_SAMPLE_RATE > 0 and random.random() < LLM_GATE_SAMPLE_RATE:
+        key = "sampled"
+    else:
+        key = "skipped_low" if risk_score_base < LLM_GATE_MIN_SCORE else "skipped_high"
+    with _gate_lock:
+        _gate_stats[key] += 1
+    return key in ("in_band", "sampled")
+
+
+def gate_stats() -> dict:
+    """LLM gating policy and how often the model was skipped."""
+    with _gate_lock:
+        stats = dict(_gate_stats)
+    routed = stats["in_band"] + stats["sampled"]
+    total = routed + stats["skipped_low"] + stats["skipped_high"]
+    return {
+        "min_score": LLM_GATE_MIN_SCORE,
+        "max_score": LLM_GATE_MAX_SCORE,
+        "sample_rate": LLM_GATE_SAMPLE_RATE,
+        **stats,
+        "skipped": total - routed,
+        "skip_rate": round((total - routed) / total, 4) if total else None,
+    }
+
+
+def _decide(ctx: ScoringContext, features: dict, velocity_facts: dict) -> RiskDecision:
     """
-    Run full pipeline: signals -> base score -> LLM adjudication -> persist decision.
-    If decision is review or block, create case and return case_id.
-    Returns (RiskDecision, case_id or None).
+    Score one transaction from its user features and velocity facts: signals -> base score -> LLM
+    adjudication (only when the gating policy routes it there). Fills in ctx's signals, score and candidate.
+    In async mode the LLM step is skipped here and queued after commit (see _queue_refinement).
+    Does not write anything.
     """
-    user_id = transaction.get("user_id")
-    tx_ts = transaction.get("timestamp", "")
-    user_history = get_user_history(user_id, tx_ts, limit=100)
-    # For risk_engine we need chronological order (oldest first)
-    user_history = list(reversed(user_history))
-
-    signals = compute_signals(transaction, user_history)
-    risk_score_base, candidate = risk_score_and_candidate(signals)
+    transaction = ctx.transaction
+    # The live counters see every user's transactions on a device/IP, not only this user's history
+    features = {**features, **velocity_facts}
+    ctx.features = features
+    rules = current_rules()
+    ctx.signals = compute_signals_from_features(transaction, features, rules)
+    ctx.risk_score_base, ctx.candidate = risk_score_and_candidate(ctx.signals, rules)
 
     # LLM adjudication with guardrails
-    llm_out = adjudicate_decision(transaction, signals, risk_score_base, candidate)
+    ctx.routed = _route_to_llm(ctx.risk_score_base)
+    llm_out = None
+    if ctx.routed and LLM_ADJUDICATION_MODE != "async":
+        llm_out = adjudicate_decision(transaction, ctx.signals, ctx.risk_score_base, ctx.candidate)
+    return _build_decision(ctx, llm_out)
+
+
+def _build_decision(ctx: ScoringContext, llm_out) -> RiskDecision:
+    """Final decision from the LLM output, or the rule-based decision when there is none."""
+    transaction, signals, candidate = ctx.transaction, ctx.signals, ctx.candidate
+    risk_score_base = ctx.risk_score_base
     if llm_out is None:
         # Fallback: use deterministic decision, confidence medium
         if candidate == "block_candidate":
@@ -65,11 +118,13 @@ def run_decision(transaction: dict) -> tuple[RiskDecision, str | None]:
         else:
             decision_str = "approve"
         risk_score_final = risk_score_base
-        rationale = "LLM unavailable; using rule-based decision. " + "; ".join(
-            s.get("explanation", "") for s in signals if s.get("fired")
-        )
-        top_signals = [s["name"] for s in signals if s.get("fired")]
-        confidence = "medium"
+        if not ctx.routed:
+            prefix = "Outside LLM adjudication band; rule-based decision. "
+        elif LLM_ADJUDICATION_MODE == "async":
+            prefix = "Rule-based decision; LLM adjudication queued. "
+        else:
+            prefix = "LLM unavailable; using rule-based decision. "
+        rationale = prefix + "; ".join(s.get("explanation", "") for s in signals if s.get("fired"))
     else:
         decision_str = llm_out.decision
         # Hard policy: cannot turn block_candidate into approve
@@ -77,51 +132,283 @@ def run_decision(transaction: dict) -> tuple[RiskDecision, str | None]:
             decision_str = "block"
         risk_score_final = llm_out.risk_score
         rationale = llm_out.rationale
-        top_signals = llm_out.top_signals
-        confidence = llm_out.confidence
 
-    decision_id = str(uuid.uuid4())
-    tx_id = transaction.get("id", "")
-    signals_json = json.dumps(signals)
-    created_at = _now_iso()
+    return RiskDecision(
+        id=str(uuid.uuid4()),
+        transaction_id=transaction.get("id", ""),
+        risk_score=risk_score_final,
+        decision=decision_str,
+        signals_json=json.dumps(signals),
+        llm_rationale=rationale,
+        created_at=_now_iso(),
+    )
 
+
+def _decision_audit_payload(risk_decision: RiskDecision, candidate: str) -> dict:
+    return {
+        "decision_id": risk_decision.id,
+        "transaction_id": risk_decision.transaction_id,
+        "decision": risk_decision.decision,
+        "risk_score": risk_decision.risk_score,
+        "candidate": candidate,
+    }
+
+
+def persist_decisions(decided: list[tuple[RiskDecision, str]]) -> None:
+    """
+    Write decisions, transaction status updates and DECISION_CREATED audit rows, and bump the version of
+    cases already holding the transactions (re-scores) so cached case details refresh.
+    Joins the caller's unit of work.
+    """
     with get_cursor() as cur:
-        cur.execute(
+        cur.executemany(
             """
             INSERT INTO risk_decisions (id, transaction_id, risk_score, decision, signals_json, llm_rationale, created_at)
             VALUES (?, ?, ?, ?, ?, ?, ?)
             """,
-            (decision_id, tx_id, risk_score_final, decision_str, signals_json, rationale, created_at),
+            [
+                (d.id, d.transaction_id, d.risk_score, d.decision, d.signals_json, d.llm_rationale, d.created_at)
+                for d, _ in decided
+            ],
         )
-        cur.execute(
-            "UPDATE transactions SET status = ? WHERE id = ?",
-            (decision_str, tx_id),
+        # Also takes the row off the scoring queue (see scoring_queue)
+        cur.executemany(
+            """
+            UPDATE transactions
+            SET status = ?, latest_decision_id = ?, scored_at = ?, claim_token = NULL, claimed_until = NULL
+            WHERE id = ?
+            """,
+            [(d.decision, d.id, d.created_at, d.transaction_id) for d, _ in decided],
         )
-
-    audit_append(
-        "system",
-        "DECISION_CREATED",
-        {
-            "decision_id": decision_id,
-            "transaction_id": tx_id,
-            "decision": decision_str,
-            "risk_score": risk_score_final,
-            "candidate": candidate,
-        },
+    touch_cases_for_transactions([d.transaction_id for d, _ in decided])
+    audit_append_many(
+        [("system", "DECISION_CREATED", _decision_audit_payload(d, candidate)) for d, candidate in decided]
     )
 
-    risk_decision = RiskDecision(
-        id=decision_id,
-        transaction_id=tx_id,
-        risk_score=risk_score_final,
-        decision=decision_str,
-        signals_json=signals_json,
-        llm_rationale=rationale,
-        created_at=created_at,
-    )
 
-    case_id = None
-    if decision_str in ("review", "block"):
-        case_id = create_case_for_decision(transaction, risk_decision, user_history)
+def prepare_decisions(transactions: list[dict]) -> tuple[list[dict], dict[str, dict]]:
+    """
+    Everything slow and read-only for a set of transactions: scoring and LLM adjudication.
+    Nothing is written, so no write lock is held meanwhile.
+    Returns (items in input order, feature updates) for commit_decisions;
+    each item is {"context": ScoringContext, "decision": RiskDecision}.
+    """
+    decided, feature_updates = _decide_batch(transactions)
+    items = [{"context": ctx, "decision": risk_decision} for ctx, risk_decision in decided]
+    return items, feature_updates
+
+
+def commit_decisions(items: list[dict], feature_updates: dict[str, dict]) -> list[tuple[RiskDecision, str | None]]:
+    """
+    Write prepared decisions, feature state, cases (new ones pending with their pack queued, or
+    attached to a matching open case) and their audit rows.
+    Call inside db.unit_of_work() so it all lands in one commit. Returns (RiskDecision, case_id or None) per item.
+    """
+    persist_decisions([(item["decision"], item["context"].candidate) for item in items])
+    save_states(feature_updates)
+    # Velocity counters take a transaction once, on its first decision, and only if that commits
+    first_scored = [item["context"].transaction for item in items if not item["context"].velocity_counted]
+    if first_scored:
+        after_commit(lambda: record_velocity(first_scored))
+    results = []
+    for item in items:
+        ctx, risk_decision = item["context"], item["decision"]
+        case_id = None
+        if risk_decision.decision in ("review", "block"):
+            case_id = open_or_attach_case(ctx, risk_decision)
+        results.append((risk_decision, case_id))
+        if LLM_ADJUDICATION_MODE == "async" and ctx.routed:
+            _queue_refinement(ctx, risk_decision, case_id)
+    if shadow_enabled():
+        # Challenger rule sets see the same transaction and features, after commit and off this thread
+        shadow_items = [(ctx.transaction, ctx.features, ctx.candidate, ctx.risk_score_base)
+                        for ctx in (item["context"] for item in items)]
+        after_commit(lambda: shadow_submit(shadow_items))
+    return results
+
+
+_SEVERITY = {"approve": 0, "review": 1, "block": 2}
+
+
+def _queue_refinement(ctx: ScoringContext, decision: RiskDecision, case_id: str | None) -> None:
+    """Submit LLM adjudication to the worker pool once the rule-based decision has committed."""
+    global _refinement_pool
+    if _refinement_pool is None:
+        _refinement_pool = ThreadPoolExecutor(max_workers=LLM_ASYNC_WORKERS, thread_name_prefix="llm-refine")
+    pool = _refinement_pool
+    after_commit(lambda: pool.submit(_refine_decision, ctx, decision, case_id))
 
+
+def _refine_decision(ctx: ScoringContext, decision: RiskDecision, case_id: str | None) -> None:
+    """
+    Worker: ask the LLM about a committed rule-based decision and store its answer as a new decision row
+    (hard policy still applies). The LLM can escalate the decision but never lower it: the committed one
+    may already have been acted on, so a milder answer is kept only in the rationale.
+    Opens a case if the refinement escalates an approve.
+    """
+    transaction, candidate = ctx.transaction, ctx.candidate
+    try:
+        llm_out = adjudicate_decision(transaction, ctx.signals, ctx.risk_score_base, candidate)
+        if llm_out is None:
+            return  # rule-based decision stands
+        refined = _build_decision(ctx, llm_out)
+        if _SEVERITY[refined.decision] < _SEVERITY[decision.decision]:
+            refined = refined.model_copy(update={
+                "decision": decision.decision,
+                "risk_score": max(refined.risk_score, decision.risk_score),
+                "llm_rationale": f"LLM recommended {refined.decision} (score {refined.risk_score}); "
+                                 f"keeping {decision.decision}. {refined.llm_rationale}",
+            })
+
+        with unit_of_work():
+            with get_cursor() as cur:
+                cur.execute(
+                    """
+                    INSERT INTO risk_decisions (id, transaction_id, risk_score, decision, signals_json, llm_rationale, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (
+                        refined.id,
+                        refined.transaction_id,
+                        refined.risk_score,
+                        refined.decision,
+                        refined.signals_json,
+                        refined.llm_rationale,
+                        refined.created_at,
+                    ),
+                )
+                # Leave the status alone if an analyst has acted on it since
+                cur.execute(
+                    """
+                    UPDATE transactions
+                    SET status = CASE WHEN status = ? THEN ? ELSE status END, latest_decision_id = ?
+                    WHERE id = ?
+                    """,
+                    (decision.decision, refined.decision, refined.id, refined.transaction_id),
+                )
+            touch_cases_for_transactions([refined.transaction_id])
+            audit_append(
+                "system",
+                "DECISION_REFINED",
+                {**_decision_audit_payload(refined, candidate), "previous_decision_id": decision.id},
+            )
+            if case_id is None and refined.decision in ("review", "block"):
+                open_or_attach_case(ctx, refined)
+    except Exception as e:
+        print(f"⚠️  LLM refinement failed for tx {decision.transaction_id}: {e}")
+
+
+def stop_refinement_workers() -> None:
+    """Let queued refinements finish, then stop the pool (app shutdown)."""
+    global _refinement_pool
+    if _refinement_pool is not None:
+        _refinement_pool.shutdown(wait=True)
+        _refinement_pool = None
+
+
+def run_decision(transaction: dict) -> tuple[RiskDecision, str | None]:
+    """
+    Run full pipeline: signals -> base score -> LLM adjudication -> persist decision.
+    If decision is review or block, create case and return case_id.
+    Decision, case and audit rows are written in one commit.
+    Returns (RiskDecision, case_id or None).
+    """
+    items, feature_updates = prepare_decisions([transaction])
+    with unit_of_work():
+        [(risk_decision, case_id)] = commit_decisions(items, feature_updates)
     return risk_decision, case_id
+
+
+def _decide_batch(transactions: list[dict]) -> tuple[list[tuple[ScoringContext, RiskDecision]], dict[str, dict]]:
+    """
+    Score transactions without writing anything.
+    Each user's feature state is loaded once; their transactions and any stored rows in between
+    are folded in timestamp order, so later transactions in a batch see earlier ones.
+    Returns ((ScoringContext, RiskDecision) per transaction in input order, feature updates for save_states).
+    """
+    by_user: dict[str, list[int]] = {}
+    for i, tx in enumerate(transactions):
+        by_user.setdefault(tx.get("user_id"), []).append(i)
+
+    batch_ids = {tx.get("id") for tx in transactions}
+    counted = counted_ids(list(batch_ids))
+    velocity_facts = lookup_velocity(transactions, counted)
+    decided: list[tuple[ScoringContext, RiskDecision] | None] = [None] * len(transactions)
+    feature_updates: dict[str, dict] = {}
+    for user_id, idxs in by_user.items():
+        idxs.sort(key=lambda i: transactions[i].get("timestamp", ""))
+        earliest_ts = transactions[idxs[0]].get("timestamp", "")
+        latest_ts = transactions[idxs[-1]].get("timestamp", "")
+        state = load_state(user_id, earliest_ts)
+        feature_updates[user_id] = state
+
+        if state["last_ts"] >= earliest_ts:
+            # Store already covers this range (re-score, out-of-order ingest): scan the rows in the
+            # 30-day window of the earliest transaction once (no row limit, so the average sees them
+            # all), folding batch rows into the history as we go; devices, PSPs and the last country
+            # from before the window come from one summary query
+            since = _window_start(earliest_ts)
+            rows = load_user_window(user_id, since, latest_ts)
+            profile = load_user_profile(user_id, since)
+            # Re-ingested rows are replaced by their batch version below
+            history = [r for r in rows if r.get("id") not in batch_ids]
+            epochs = history_epochs(history)  # parsed once, kept in step with history
+            for i in idxs:
+                tx = transactions[i]
+                cut = bisect_left(history, tx.get("timestamp", ""), key=_timestamp_key)
+                # The scanned rows double as the case pack's history
+                ctx = ScoringContext(tx, history=history[max(0, cut - HISTORY_LIMIT):cut], velocity_counted=tx.get("id") in counted)
+                features = _with_profile(build_features(tx, history[:cut], epochs[:cut]), profile, cut)
+                decided[i] = (ctx, _decide(ctx, features, velocity_facts[i]))
+                at = bisect_right(history, tx.get("timestamp", ""), key=_timestamp_key)
+                history.insert(at, tx)
+                epochs.insert(at, to_epoch_us(tx.get("timestamp", "")))
+            # Then update the store in place: new rows older than last_ts are added out of order,
+            # stored ones (re-scores) are already counted, newer ones are folded as usual
+            covered = stored_ids([transactions[i].get("id") for i in idxs if transactions[i].get("timestamp", "") <= state["last_ts"]])
+            for i in idxs:
+                tx, ts = transactions[i], transactions[i].get("timestamp", "")
+                if ts <= state["last_ts"]:
+                    if tx.get("id") not in covered:
+                        fold_late(state, tx)
+                    continue
+                for r in rows_between(user_id, state["last_ts"], ts):
+                    if r.get("id") not in batch_ids:
+                        fold(state, r)
+                fold(state, tx)
+            continue
+
+        stored = []
+        if latest_ts > earliest_ts:
+            stored = [(r.get("timestamp", ""), r, None) for r in rows_between(user_id, state["last_ts"], latest_ts)
+                      if r.get("id") not in batch_ids]
+        pending = sorted(stored + [(transactions[i].get("timestamp", ""), transactions[i], i) for i in idxs],
+                         key=lambda e: e[0])
+        for ts, tx, i in pending:
+            if i is not None:
+                ctx = ScoringContext(tx, velocity_counted=tx.get("id") in counted)
+                decided[i] = (ctx, _decide(ctx, features_at(state, ts), velocity_facts[i]))
+            fold(state, tx)
+    return decided, feature_updates
+
+
+def _timestamp_key(tx: dict) -> str:
+    return tx.get("timestamp", "")
+
+
+def _window_start(ts: str) -> str:
+    """Start of the 30-day average window of a transaction at ts (UTC midnight, AVG_WINDOW_DAYS - 1 days before)."""
+    ts_us = to_epoch_us(ts)
+    if ts_us is None:
+        return ""
+    first_day = ts_us // DAY_US - AVG_WINDOW_DAYS + 1
+    return datetime.fromtimestamp(first_day * DAY_US / 1_000_000, tz=timezone.utc).isoformat()
+
+
+def _with_profile(features: dict, profile: dict, window_rows: int) -> dict:
+    """Add what load_user_profile found before the window to features built from window_rows rows."""
+    features["known_devices"] |= profile["known_devices"]
+    features["known_psps"] |= profile["known_psps"]
+    if not window_rows:
+        features["last_country"] = profile["last_country"]
+    return features
@@ -0,0 +1,76 @@
+"""In-process fan-out of committed audit events to live stream clients (see /stream in main.py).
+
+Publishers run on any thread; each subscriber owns a bounded asyncio queue on its event loop.
+A subscriber that falls STREAM_CLIENT_BUFFER events behind is cut off (the stream tells it where
+it stopped, and it resumes from the audit log with Last-Event-ID) rather than slowing anyone else.
+"""
+import asyncio
+import os
+import threading
+
+STREAM_CLIENT_BUFFER = int(os.getenv("STREAM_CLIENT_BUFFER", "256"))
+
+
+class Subscription:
+    def __init__(self, loop: asyncio.AbstractEventLoop, event_types: set[str] | None):
+        self.loop = loop
+        self.event_types = event_types  # None = every event
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=STREAM_CLIENT_BUFFER)
+        self.overflowed = False
+
+    def _offer(self, event: dict) -> None:
+        # Runs on the subscriber's loop
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            with _lock:
+                _stats["dropped_clients"] += 1
+            # Discard the backlog (the client replays it from the audit log) and wake the reader
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+
+_lock = threading.Lock()
+_subscribers: set[Subscription] = set()
+_stats = {"published": 0, "delivered": 0, "dropped_clients": 0}
+
+
+def subscribe(event_types: set[str] | None = None) -> Subscription:
+    """Register a subscriber on the running event loop."""
+    sub = Subscription(asyncio.get_running_loop(), event_types)
+    with _lock:
+        _subscribers.add(sub)
+    return sub
+
+
+def unsubscribe(sub: Subscription) -> None:
+    with _lock:
+        _subscribers.discard(sub)
+
+
+def publish(events: list[dict]) -> None:
+    """Fan events out to every interested subscriber (thread-safe, never blocks). Call after commit."""
+    if not _subscribers:
+        return
+    with _lock:
+        subscribers = list(_subscribers)
+        _stats["published"] += len(events)
+    for sub in subscribers:
+        for event in events:
+            if sub.event_types is None or event["event_type"] in sub.event_types:
+                try:
+                    sub.loop.call_soon_threadsafe(sub._offer, event)
+                except RuntimeError:
+                    unsubscribe(sub)  # loop closed
+                    break
+                with _lock:
+                    _stats["delivered"] += 1
+
+
+def bus_stats() -> dict:
+    with _lock:
+        return {"subscribers": len(_subscribers), "client_buffer": STREAM_CLIENT_BUFFER, **_stats}
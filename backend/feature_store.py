@@ -0,0 +1,231 @@
+"""Persistent per-user feature store: the rolling aggregates compute_signals needs, updated on ingest.
+
+A user's row always covers a prefix of their transactions (every row with timestamp <= last_ts).
+Rows that reached the table without going through scoring (seed, bypassed writes) are folded in
+lazily by load_state, so a lookup costs one row read plus one indexed probe for newer rows.
+The 30-day average is kept as at most AVG_WINDOW_DAYS daily (count, cents) totals, so a row stays
+the same size however active the user is. Transactions older than last_ts (out-of-order ingest)
+are added in place with fold_late; re-scoring a stored transaction leaves the row alone.
+"""
+import json
+from bisect import bisect_left, insort
+from datetime import datetime, timezone
+
+from db import get_cursor
+from risk_engine import AVG_WINDOW_DAYS, DAY_US, VELOCITY_WINDOW_US, to_cents, to_epoch_us
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _empty_state(user_id: str) -> dict:
+    return {
+        "user_id": user_id,
+        "last_ts": "",
+        "last_country": None,
+        "known_devices": set(),
+        "known_psps": set(),
+        "withdrawals": [],  # epoch-us of withdrawals still inside the velocity window
+        "days": {},  # UTC day number -> [count, cents], the last AVG_WINDOW_DAYS days up to last_ts
+        "version": None,  # row version as read, None if there was no row
+    }
+
+
+def _days_from_json(raw: str | None) -> dict[int, list[int]]:
+    days: dict[int, list[int]] = {}
+    for entry in json.loads(raw or "[]"):
+        if len(entry) == 2:  # rows written before daily totals: [epoch-us, amount]
+            day = days.setdefault(entry[0] // DAY_US, [0, 0])
+            day[0] += 1
+            day[1] += to_cents(entry[1])
+        else:
+            days[entry[0]] = [entry[1], entry[2]]
+    return days
+
+
+def _row_to_state(row) -> dict:
+    return {
+        "user_id": row["user_id"],
+        "last_ts": row["last_ts"],
+        "last_country": row["last_country"],
+        "known_devices": set(json.loads(row["known_devices_json"] or "[]")),
+        "known_psps": set(json.loads(row["known_psps_json"] or "[]")),
+        "withdrawals": json.loads(row["withdrawals_json"] or "[]"),
+        "days": _days_from_json(row["window_30d_json"]),
+        "version": row["version"],
+    }
+
+
+def rows_between(user_id: str, after_ts: str, before_ts: str) -> list[dict]:
+    """User transactions with after_ts < timestamp < before_ts, oldest first."""
+    with get_cursor() as cur:
+        cur.execute(
+            """
+            SELECT id, timestamp, type, amount, country, device_id, psp
+            FROM transactions
+            WHERE user_id = ? AND timestamp > ? AND timestamp < ?
+            ORDER BY timestamp ASC
+            """,
+            (user_id, after_ts, before_ts),
+        )
+        rows = cur.fetchall()
+    return [dict(r) for r in rows]
+
+
+def fold(state: dict, transaction: dict) -> None:
+    """Advance state by one transaction. Transactions must be folded in timestamp order."""
+    ts = transaction.get("timestamp", "")
+    state["last_ts"] = ts
+    state["last_country"] = transaction.get("country")
+    if transaction.get("device_id"):
+        state["known_devices"].add(transaction["device_id"])
+    if transaction.get("psp"):
+        state["known_psps"].add(transaction["psp"])
+
+    now_us = to_epoch_us(ts)
+    if now_us is None:
+        return
+    if transaction.get("type") == "withdrawal":
+        state["withdrawals"].append(now_us)
+    _add_to_day(state, now_us, transaction)
+    # Later lookups are always newer than last_ts, so anything already out of window can go
+    state["withdrawals"] = [w for w in state["withdrawals"] if now_us - w <= VELOCITY_WINDOW_US]
+    first_day = now_us // DAY_US - AVG_WINDOW_DAYS + 1
+    for day in [d for d in state["days"] if d < first_day]:
+        del state["days"][day]
+
+
+def fold_late(state: dict, transaction: dict) -> None:
+    """
+    Add a new transaction older than last_ts (out-of-order ingest). The aggregates do not depend on
+    order, so this matches folding it in sequence; last_ts and last_country stay with the newest row.
+    """
+    if transaction.get("device_id"):
+        state["known_devices"].add(transaction["device_id"])
+    if transaction.get("psp"):
+        state["known_psps"].add(transaction["psp"])
+    tx_us, last_us = to_epoch_us(transaction.get("timestamp", "")), to_epoch_us(state["last_ts"])
+    if tx_us is None:
+        return
+    if last_us is None:
+        last_us = tx_us
+    if transaction.get("type") == "withdrawal" and last_us - tx_us <= VELOCITY_WINDOW_US:
+        insort(state["withdrawals"], tx_us)
+    if tx_us // DAY_US >= last_us // DAY_US - AVG_WINDOW_DAYS + 1:
+        _add_to_day(state, tx_us, transaction)
+
+
+def _add_to_day(state: dict, ts_us: int, transaction: dict) -> None:
+    day = state["days"].setdefault(ts_us // DAY_US, [0, 0])
+    day[0] += 1
+    day[1] += to_cents(transaction.get("amount"))
+
+
+def features_at(state: dict, ts: str) -> dict:
+    """Features for a transaction at ts (> last_ts), in the shape risk_engine.build_features returns."""
+    now_us = to_epoch_us(ts)
+    if now_us is None:
+        withdrawals_20m = 0
+        avg_30d = 0
+    else:
+        withdrawals = state["withdrawals"]
+        withdrawals_20m = len(withdrawals) - bisect_left(withdrawals, now_us - VELOCITY_WINDOW_US)
+        first_day = now_us // DAY_US - AVG_WINDOW_DAYS + 1
+        count = cents = 0
+        for day, (day_count, day_cents) in state["days"].items():
+            if day >= first_day:
+                count += day_count
+                cents += day_cents
+        avg_30d = cents / count / 100 if count else 0
+    return {
+        "withdrawals_20m_count": withdrawals_20m,
+        "avg_amount_30d": avg_30d,
+        "known_devices": set(state["known_devices"]),
+        "last_country": state["last_country"],
+        "known_psps": set(state["known_psps"]),
+    }
+
+
+def load_state(user_id: str, before_ts: str) -> dict:
+    """
+    Return the user's state caught up to every stored transaction older than before_ts. If the row
+    already covers before_ts (re-score or out-of-order ingest), it comes back as stored: then
+    state["last_ts"] >= before_ts and the caller scores from history instead of features_at.
+    """
+    with get_cursor() as cur:
+        cur.execute("SELECT * FROM user_features WHERE user_id = ?", (user_id,))
+        row = cur.fetchone()
+    state = _row_to_state(row) if row else _empty_state(user_id)
+    for tx in rows_between(user_id, state["last_ts"], before_ts):
+        fold(state, tx)
+    return state
+
+
+def stored_ids(transaction_ids: list[str]) -> set[str]:
+    """Which of these transactions are already in the table (and so covered by any state past their timestamp)."""
+    with get_cursor() as cur:
+        cur.execute(
+            "SELECT id FROM transactions WHERE id IN (SELECT value FROM json_each(?))",
+            (json.dumps(transaction_ids),),
+        )
+        return {r["id"] for r in cur.fetchall()}
+
+
+def save_state(state: dict) -> None:
+    """
+    Write state back (joins the caller's unit of work).
+    Optimistic: if another writer updated the row since load_state, drop it instead (rebuilt on next lookup).
+    """
+    days = sorted([day, count, cents] for day, (count, cents) in state["days"].items())
+    params = (
+        state["last_ts"],
+        state["last_country"],
+        json.dumps(sorted(state["known_devices"])),
+        json.dumps(sorted(state["known_psps"])),
+        json.dumps(state["withdrawals"]),
+        json.dumps(days),
+        sum(cents for _, _, cents in days) / 100,
+        _now_iso(),
+        state["user_id"],
+    )
+    with get_cursor() as cur:
+        if state["version"] is None:
+            cur.execute(
+                """
+                INSERT OR IGNORE INTO user_features (
+                    last_ts, last_country, known_devices_json, known_psps_json,
+                    withdrawals_json, window_30d_json, sum_30d, updated_at, user_id
+                )
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                params,
+            )
+        else:
+            cur.execute(
+                """
+                UPDATE user_features
+                SET last_ts = ?, last_country = ?, known_devices_json = ?, known_psps_json = ?,
+                    withdrawals_json = ?, window_30d_json = ?, sum_30d = ?, updated_at = ?, version = version + 1
+                WHERE user_id = ? AND version = ?
+                """,
+                (*params, state["version"]),
+            )
+        if cur.rowcount == 0:
+            cur.execute("DELETE FROM user_features WHERE user_id = ?", (state["user_id"],))
+
+
+def save_states(updates: dict[str, dict | None]) -> None:
+    """Apply {user_id: state} from prepare_decisions; a None state is invalidated instead (see invalidate)."""
+    for user_id, state in updates.items():
+        if state is None:
+            invalidate(user_id)
+        else:
+            save_state(state)
+
+
+def invalidate(user_id: str) -> None:
+    """Drop a user's state; it is rebuilt from transactions on the next lookup."""
+    with get_cursor() as cur:
+        cur.execute("DELETE FROM user_features WHERE user_id = ?", (user_id,))
+
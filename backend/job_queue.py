@@ -0,0 +1,236 @@
+"""Persistent local job queue (SQLite-backed) with retries, leases and a bounded worker pool."""
+import json
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional
+
+from db import after_commit, get_cursor
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "5"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "300"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1"))
+
+# kind -> (handler(payload), on_failure(payload, error) called once attempts are exhausted)
+_handlers: dict[str, tuple[Callable[[dict], None], Optional[Callable[[dict, str], None]]]] = {}
+# kind -> worker count, for kinds run only by their own workers (long jobs that must not starve the rest)
+_dedicated: dict[str, int] = {}
+_wake = threading.Event()
+_stop = threading.Event()
+_workers: list[threading.Thread] = []
+_local = threading.local()  # .job: the job the calling worker thread is running
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def register_handler(
+    kind: str,
+    handler: Callable[[dict], None],
+    on_failure: Optional[Callable[[dict, str], None]] = None,
+    dedicated_workers: int = 0,
+) -> None:
+    """
+    Register the function that runs jobs of this kind. With dedicated_workers, jobs of this kind run only
+    on that many workers of their own (started by start_workers), never on the shared JOB_WORKERS.
+    """
+    _handlers[kind] = (handler, on_failure)
+    if dedicated_workers > 0:
+        _dedicated[kind] = dedicated_workers
+    else:
+        _dedicated.pop(kind, None)
+
+
+def enqueue(kind: str, payload: dict, max_attempts: int = JOB_MAX_ATTEMPTS) -> str:
+    """Queue a job (joins the caller's unit of work, so it only exists if the caller commits). Returns job id."""
+    job_id = str(uuid.uuid4())
+    now = _now().isoformat()
+    with get_cursor() as cur:
+        cur.execute(
+            """
+            INSERT INTO jobs (id, kind, payload_json, status, attempts, max_attempts, available_at, created_at, updated_at)
+            VALUES (?, ?, ?, 'queued', 0, ?, ?, ?, ?)
+            """,
+            (job_id, kind, json.dumps(payload, default=str), max_attempts, now, now, now),
+        )
+    after_commit(_wake.set)
+    return job_id
+
+
+def _claim(kind: str | None = None) -> dict | None:
+    """
+    Atomically lease the next runnable job (queued and due, or running with an expired lease):
+    of the given kind, or of any kind without dedicated workers.
+    """
+    now = _now()
+    token = str(uuid.uuid4())
+    if kind is None:
+        kind_filter, kind_param = "kind NOT IN (SELECT value FROM json_each(?))", json.dumps(list(_dedicated))
+    else:
+        kind_filter, kind_param = "kind = ?", kind
+    with get_cursor() as cur:
+        cur.execute(
+            f"""
+            UPDATE jobs
+            SET status = 'running', attempts = attempts + 1, claim_token = ?, locked_until = ?, updated_at = ?
+            WHERE id = (
+                SELECT id FROM jobs
+                WHERE ((status = 'queued' AND available_at <= ?) OR (status = 'running' AND locked_until < ?))
+                  AND {kind_filter}
+                ORDER BY available_at
+                LIMIT 1
+            )
+            """,
+            (
+                token,
+                (now + timedelta(seconds=JOB_LEASE_SECONDS)).isoformat(),
+                now.isoformat(),
+                now.isoformat(),
+                now.isoformat(),
+                kind_param,
+            ),
+        )
+        if cur.rowcount == 0:
+            return None
+        cur.execute("SELECT * FROM jobs WHERE claim_token = ?", (token,))
+        row = cur.fetchone()
+    return dict(row) if row else None
+
+
+def current_lease() -> tuple[str, str] | None:
+    """(job id, claim token) of the job running on the calling worker thread, for renew_lease; None elsewhere."""
+    job = getattr(_local, "job", None)
+    return (job["id"], job["claim_token"]) if job else None
+
+
+def renew_lease(job_id: str, claim_token: str) -> bool:
+    """
+    Push the job's lease JOB_LEASE_SECONDS ahead (joins the caller's unit of work). Long handlers call it
+    as they make progress so the job is not claimed again meanwhile. False if the lease was lost.
+    """
+    now = _now()
+    with get_cursor() as cur:
+        cur.execute(
+            "UPDATE jobs SET locked_until = ?, updated_at = ? WHERE id = ? AND claim_token = ? AND status = 'running'",
+            ((now + timedelta(seconds=JOB_LEASE_SECONDS)).isoformat(), now.isoformat(), job_id, claim_token),
+        )
+        return cur.rowcount > 0
+
+
+def _finish(job: dict, error: str | None) -> None:
+    now = _now()
+    with get_cursor() as cur:
+        if error is None:
+            cur.execute(
+                "UPDATE jobs SET status = 'done', last_error = NULL, updated_at = ? WHERE id = ? AND claim_token = ?",
+                (now.isoformat(), job["id"], job["claim_token"]),
+            )
+        elif job["attempts"] < job["max_attempts"]:
+            backoff = JOB_RETRY_BASE_SECONDS * (2 ** (job["attempts"] - 1))
+            cur.execute(
+                """
+                UPDATE jobs SET status = 'queued', available_at = ?, last_error = ?, updated_at = ?
+                WHERE id = ? AND claim_token = ?
+                """,
+                ((now + timedelta(seconds=backoff)).isoformat(), error, now.isoformat(), job["id"], job["claim_token"]),
+            )
+        else:
+            cur.execute(
+                "UPDATE jobs SET status = 'failed', last_error = ?, updated_at = ? WHERE id = ? AND claim_token = ?",
+                (error, now.isoformat(), job["id"], job["claim_token"]),
+            )
+
+
+def run_one(kind: str | None = None) -> bool:
+    """
+    Claim and run a single job on the calling thread: of the given kind, or of any kind without
+    dedicated workers. Returns False when nothing was runnable.
+    """
+    job = _claim(kind)
+    if job is None:
+        return False
+    payload = json.loads(job["payload_json"] or "{}")
+    handler, on_failure = _handlers.get(job["kind"], (None, None))
+    error = None
+    _local.job = job
+    try:
+        if handler is None:
+            raise RuntimeError(f"no handler registered for job kind {job['kind']!r}")
+        handler(payload)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        print(f"⚠️  Job {job['id']} ({job['kind']}) attempt {job['attempts']}/{job['max_attempts']} failed: {error}")
+    finally:
+        _local.job = None
+    _finish(job, error)
+    if error is not None and job["attempts"] >= job["max_attempts"] and on_failure is not None:
+        try:
+            on_failure(payload, error)
+        except Exception as e:
+            print(f"⚠️  Job {job['id']} failure hook error: {e}")
+    return True
+
+
+def _worker_loop(kind: str | None = None) -> None:
+    while not _stop.is_set():
+        try:
+            ran = run_one(kind)
+        except Exception as e:
+            print(f"⚠️  Job worker error: {e}")
+            ran = False
+        if not ran:
+            _wake.wait(JOB_POLL_SECONDS)
+            _wake.clear()
+
+
+def start_workers(count: int = JOB_WORKERS) -> None:
+    """
+    Start the shared worker threads (at most `count` jobs run concurrently), plus the dedicated workers
+    of kinds registered with dedicated_workers.
+    """
+    if _workers:
+        return
+    _stop.clear()
+    lanes = [(None, f"job-worker-{i}") for i in range(count)]
+    lanes += [(kind, f"job-worker-{kind}-{i}") for kind, n in _dedicated.items() for i in range(n)]
+    for kind, name in lanes:
+        t = threading.Thread(target=_worker_loop, args=(kind,), name=name, daemon=True)
+        t.start()
+        _workers.append(t)
+
+
+def stop_workers(timeout: float = 10.0) -> None:
+    """Signal workers to stop after their current job and wait for them."""
+    _stop.set()
+    _wake.set()
+    for t in _workers:
+        t.join(timeout)
+    _workers.clear()
+
+
+def queue_stats() -> dict:
+    """Queue depth by kind and status, plus age of the oldest runnable job."""
+    with get_cursor() as cur:
+        cur.execute("SELECT kind, status, COUNT(*) AS n FROM jobs GROUP BY kind, status")
+        counts = cur.fetchall()
+        cur.execute("SELECT MIN(available_at) AS oldest FROM jobs WHERE status = 'queued'")
+        oldest = cur.fetchone()["oldest"]
+    by_kind: dict[str, dict[str, int]] = {}
+    for r in counts:
+        by_kind.setdefault(r["kind"], {})[r["status"]] = r["n"]
+    oldest_age = None
+    if oldest:
+        oldest_age = max(0.0, (_now() - datetime.fromisoformat(oldest)).total_seconds())
+    return {
+        "workers": len(_workers),
+        "dedicated_workers": dict(_dedicated),
+        "by_kind": by_kind,
+        "queued": sum(k.get("queued", 0) for k in by_kind.values()),
+        "running": sum(k.get("running", 0) for k in by_kind.values()),
+        "failed": sum(k.get("failed", 0) for k in by_kind.values()),
+        "oldest_queued_age_seconds": oldest_age,
+    }
@@ -1,6 +1,12 @@
 """Gemini LLM client for decision adjudication and case generation."""
+import hashlib
 import json
 import os
+import threading
+import time
+from bisect import bisect_right
+from collections import OrderedDict
+from datetime import datetime, timezone
 from typing import Any, Optional
 
 # Load .env file to read GEMINI_API_KEY
@@ -14,6 +20,7 @@ try:
 except ImportError:
     GEMINI_AVAILABLE = False
 
+from db import get_cursor
 from models import (
     EvidenceItem,
     HypothesisItem,
@@ -22,15 +29,275 @@ from models import (
     RecommendationItem,
     TimelineEvent,
 )
+from scoring_context import ScoringContext
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
 GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
 
+# Adjudication cache: identical fired signals + score band + candidate + amount bucket -> same answer
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1024"))
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", "3600"))
+LLM_CACHE_SCORE_BAND = int(os.getenv("LLM_CACHE_SCORE_BAND", "10"))
+LLM_CACHE_AMOUNT_BUCKETS = [float(x) for x in os.getenv("LLM_CACHE_AMOUNT_BUCKETS", "100,500,1000,5000,10000").split(",") if x.strip()]
+LLM_CACHE_PERSIST = os.getenv("LLM_CACHE_PERSIST", "0") == "1"  # write-through to the llm_cache table
+
+_cache: "OrderedDict[str, tuple[float, dict]]" = OrderedDict()
+_cache_lock = threading.Lock()
+_cache_stats = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+# One client per process; at most LLM_MAX_CONCURRENCY calls in flight, each with a hard deadline
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "10"))
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", "2"))  # wait for a free slot
+
+# Client-side quota (0 = unlimited) and circuit breaker on consecutive 429/5xx/timeouts
+LLM_RATE_PER_MINUTE = float(os.getenv("LLM_RATE_PER_MINUTE", "0"))
+LLM_RATE_BURST = float(os.getenv("LLM_RATE_BURST", "0")) or max(1.0, LLM_RATE_PER_MINUTE)
+LLM_DAILY_QUOTA = int(os.getenv("LLM_DAILY_QUOTA", "0"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "3"))
+LLM_BREAKER_COOLDOWN_SECONDS = float(os.getenv("LLM_BREAKER_COOLDOWN_SECONDS", "60"))
+
+_model = None
+_model_lock = threading.Lock()
+_call_slots = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+
+_guard_lock = threading.Lock()
+_bucket = {"tokens": LLM_RATE_BURST, "refilled_at": time.monotonic(), "day": None, "day_count": 0}
+_breaker = {"state": "closed", "consecutive_failures": 0, "opened_at": None, "probe_in_flight": False}
+_call_stats = {
+    "calls": 0,
+    "successes": 0,
+    "rate_limited": 0,  # upstream 429 / quota
+    "server_errors": 0,
+    "timeouts": 0,
+    "other_errors": 0,
+    "short_circuited": 0,  # skipped while the breaker was open
+    "throttled": 0,  # skipped by the local rate limiter / daily quota
+    "busy": 0,  # no free concurrency slot
+    "breaker_opened": 0,
+}
+
+
+class LLMSkipped(Exception):
+    """The call was not sent (breaker open, quota spent or no free slot); use the fallback."""
+
+
 def _get_model():
+    """The process-wide model (configured once, so its transport and connections are reused)."""
+    global _model
     if not GEMINI_AVAILABLE or not GEMINI_API_KEY:
         return None
-    genai.configure(api_key=GEMINI_API_KEY)
-    return genai.GenerativeModel(GEMINI_MODEL)
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                genai.configure(api_key=GEMINI_API_KEY)
+                _model = genai.GenerativeModel(GEMINI_MODEL)
+    return _model
+
+
+def _admit() -> bool:
+    """
+    Let a call through the breaker and rate limiter, or raise LLMSkipped.
+    Returns True when the call is the half-open probe.
+    """
+    now = time.monotonic()
+    with _guard_lock:
+        probe = False
+        if _breaker["state"] == "open":
+            if now - _breaker["opened_at"] < LLM_BREAKER_COOLDOWN_SECONDS:
+                _call_stats["short_circuited"] += 1
+                raise LLMSkipped("circuit open")
+            _breaker["state"] = "half_open"
+        if _breaker["state"] == "half_open":
+            if _breaker["probe_in_flight"]:
+                _call_stats["short_circuited"] += 1
+                raise LLMSkipped("circuit half-open, probe in flight")
+            probe = True
+
+        if LLM_RATE_PER_MINUTE > 0:
+            _bucket["tokens"] = min(
+                LLM_RATE_BURST, _bucket["tokens"] + (now - _bucket["refilled_at"]) * LLM_RATE_PER_MINUTE / 60
+            )
+            _bucket["refilled_at"] = now
+            if _bucket["tokens"] < 1:
+                _call_stats["throttled"] += 1
+                raise LLMSkipped("rate limit")
+        today = datetime.now(timezone.utc).date()
+        if _bucket["day"] != today:
+            _bucket["day"], _bucket["day_count"] = today, 0
+        if LLM_DAILY_QUOTA > 0 and _bucket["day_count"] >= LLM_DAILY_QUOTA:
+            _call_stats["throttled"] += 1
+            raise LLMSkipped("daily quota spent")
+
+        if LLM_RATE_PER_MINUTE > 0:
+            _bucket["tokens"] -= 1
+        _bucket["day_count"] += 1
+        _breaker["probe_in_flight"] = probe
+        _call_stats["calls"] += 1
+        return probe
+
+
+def _failure_kind(e: Exception) -> str:
+    msg = str(e).lower()
+    if _is_timeout(e):
+        return "timeouts"
+    if "429" in msg or "quota" in msg or "resource exhausted" in msg or "resourceexhausted" in msg:
+        return "rate_limited"
+    if any(code in msg for code in ("500", "502", "503")) or "unavailable" in msg or "internal" in msg:
+        return "server_errors"
+    return "other_errors"
+
+
+def _record(probe: bool, kind: str | None) -> None:
+    """Update breaker and counters after a call. kind is None on success."""
+    with _guard_lock:
+        if probe:
+            _breaker["probe_in_flight"] = False
+        if kind is None or kind == "other_errors":
+            # The API answered: whatever went wrong is not an outage
+            _call_stats["successes" if kind is None else kind] += 1
+            _breaker["consecutive_failures"] = 0
+            _breaker["state"] = "closed"
+            return
+        _call_stats[kind] += 1
+        _breaker["consecutive_failures"] += 1
+        if probe or (_breaker["state"] == "closed" and _breaker["consecutive_failures"] >= LLM_BREAKER_FAILURES):
+            if _breaker["state"] != "open":
+                _call_stats["breaker_opened"] += 1
+                print(f"⚠️  LLM circuit open for {LLM_BREAKER_COOLDOWN_SECONDS:g}s after {_breaker['consecutive_failures']} failures ({kind})")
+            _breaker["state"] = "open"
+            _breaker["opened_at"] = time.monotonic()
+
+
+def _generate(model, prompt: str) -> str:
+    """
+    Run one model call through the breaker, rate limiter and a concurrency slot, with a deadline.
+    Returns the response text. Raises LLMSkipped when the call was not sent, or the call's error.
+    """
+    probe = _admit()
+    if not _call_slots.acquire(timeout=LLM_QUEUE_TIMEOUT_SECONDS):
+        with _guard_lock:
+            if probe:
+                _breaker["probe_in_flight"] = False
+            _call_stats["busy"] += 1
+        raise LLMSkipped(f"no free LLM slot within {LLM_QUEUE_TIMEOUT_SECONDS}s ({LLM_MAX_CONCURRENCY} in flight)")
+    try:
+        response = model.generate_content(prompt, request_options={"timeout": LLM_TIMEOUT_SECONDS})
+        text = response.text.strip()
+    except Exception as e:
+        _record(probe, _failure_kind(e))
+        raise
+    finally:
+        _call_slots.release()
+    _record(probe, None)
+    return text
+
+
+def breaker_stats() -> dict:
+    """Circuit breaker state, rate limiter budget and call counters."""
+    with _guard_lock:
+        open_for = None
+        if _breaker["state"] == "open":
+            open_for = max(0.0, LLM_BREAKER_COOLDOWN_SECONDS - (time.monotonic() - _breaker["opened_at"]))
+        return {
+            "state": _breaker["state"],
+            "consecutive_failures": _breaker["consecutive_failures"],
+            "retry_in_seconds": open_for,
+            "failure_threshold": LLM_BREAKER_FAILURES,
+            "cooldown_seconds": LLM_BREAKER_COOLDOWN_SECONDS,
+            "rate_per_minute": LLM_RATE_PER_MINUTE or None,
+            "tokens_available": round(_bucket["tokens"], 2) if LLM_RATE_PER_MINUTE > 0 else None,
+            "daily_quota": LLM_DAILY_QUOTA or None,
+            "used_today": _bucket["day_count"],
+            "max_concurrency": LLM_MAX_CONCURRENCY,
+            **_call_stats,
+        }
+
+
+def _is_timeout(e: Exception) -> bool:
+    msg = str(e).lower()
+    return isinstance(e, TimeoutError) or "deadline" in msg or "timed out" in msg or "504" in msg
+
+
+def adjudication_fingerprint(transaction: dict, signals: list[dict], risk_score_base: int, candidate: str) -> str:
+    """Canonical cache key for an adjudication request."""
+    amount = transaction.get("amount") or 0
+    key = {
+        "fired": sorted(s.get("name", "") for s in signals if s.get("fired")),
+        "score_band": int(risk_score_base) // max(1, LLM_CACHE_SCORE_BAND),
+        "candidate": candidate,
+        "amount_bucket": bisect_right(LLM_CACHE_AMOUNT_BUCKETS, amount),
+        "type": transaction.get("type"),
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def _cache_get(key: str) -> Optional[dict]:
+    now = time.time()
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None:
+            stored_at, value = entry
+            if now - stored_at <= LLM_CACHE_TTL_SECONDS:
+                _cache.move_to_end(key)
+                _cache_stats["hits"] += 1
+                return value
+            del _cache[key]
+            _cache_stats["expired"] += 1
+    value = _disk_get(key, now) if LLM_CACHE_PERSIST else None
+    with _cache_lock:
+        if value is None:
+            _cache_stats["misses"] += 1
+            return None
+        _cache_stats["disk_hits"] += 1
+    _cache_put(key, value, persist=False)
+    return value
+
+
+def _cache_put(key: str, value: dict, persist: bool = True) -> None:
+    with _cache_lock:
+        _cache[key] = (time.time(), value)
+        _cache.move_to_end(key)
+        while len(_cache) > LLM_CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+            _cache_stats["evictions"] += 1
+    if persist and LLM_CACHE_PERSIST:
+        _disk_put(key, value)
+
+
+def _disk_get(key: str, now: float) -> Optional[dict]:
+    with get_cursor() as cur:
+        cur.execute("SELECT output_json, created_at FROM llm_cache WHERE fingerprint = ?", (key,))
+        row = cur.fetchone()
+    if not row:
+        return None
+    if now - datetime.fromisoformat(row["created_at"]).timestamp() > LLM_CACHE_TTL_SECONDS:
+        return None
+    return json.loads(row["output_json"])
+
+
+def _disk_put(key: str, value: dict) -> None:
+    with get_cursor() as cur:
+        cur.execute(
+            "INSERT OR REPLACE INTO llm_cache (fingerprint, output_json, created_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value), datetime.now(timezone.utc).isoformat()),
+        )
+
+
+def cache_stats() -> dict:
+    """Adjudication cache counters and settings."""
+    with _cache_lock:
+        lookups = _cache_stats["hits"] + _cache_stats["disk_hits"] + _cache_stats["misses"]
+        return {
+            **_cache_stats,
+            "hit_rate": round((_cache_stats["hits"] + _cache_stats["disk_hits"]) / lookups, 4) if lookups else None,
+            "size": len(_cache),
+            "enabled": LLM_CACHE_ENABLED,
+            "persist": LLM_CACHE_PERSIST,
+            "max_entries": LLM_CACHE_MAX_ENTRIES,
+            "ttl_seconds": LLM_CACHE_TTL_SECONDS,
+        }
 
 
 def adjudicate_decision(
@@ -43,7 +310,15 @@ def adjudicate_decision(
     Call LLM to produce final decision with rationale.
     Hard policy: LLM cannot turn a block_candidate into approve.
     Returns None if LLM unavailable or parse fails (caller should use fallback).
+    Answers for an identical fingerprint are served from the cache without calling Gemini.
     """
+    cache_key = None
+    if LLM_CACHE_ENABLED:
+        cache_key = adjudication_fingerprint(transaction, signals, risk_score_base, candidate)
+        cached = _cache_get(cache_key)
+        if cached is not None:
+            return LLMDecisionOutput(**cached)
+
     model = _get_model()
     if not model:
         print("⚠️  LLM not available (API key missing or library not installed)")
@@ -77,53 +352,54 @@ Output ONLY this JSON, no markdown or extra text:
         prompt += "\n" + block_rule + "\n"
 
     try:
-        response = model.generate_content(prompt)
-        text = response.text.strip()
+        text = _generate(model, prompt)
         # Strip markdown code block if present
         if text.startswith("```"):
             lines = text.split("\n")
             text = "\n".join(lines[1:-1]) if lines[0].strip() == "```json" else "\n".join(lines[1:-1])
         data = json.loads(text)
         print(f"✅ LLM adjudication successful for tx {transaction.get('transaction_id', 'unknown')}")
-        return LLMDecisionOutput(
+        out = LLMDecisionOutput(
             decision=data.get("decision", "review"),
             risk_score=max(0, min(100, int(data.get("risk_score", risk_score_base)))),
             rationale=data.get("rationale", ""),
             top_signals=data.get("top_signals", []),
             confidence=data.get("confidence", "medium"),
         )
+        if cache_key is not None:
+            _cache_put(cache_key, out.model_dump())
+        return out
+    except LLMSkipped:
+        return None
     except Exception as e:
         error_msg = str(e)
         if "429" in error_msg or "quota" in error_msg.lower():
             print(f"⚠️  LLM quota exceeded - using deterministic fallback (tx: {transaction.get('transaction_id', 'unknown')})")
         elif "401" in error_msg or "403" in error_msg:
             print(f"⚠️  LLM authentication error - check API key (tx: {transaction.get('transaction_id', 'unknown')})")
+        elif _is_timeout(e):
+            print(f"⚠️  LLM timed out ({error_msg}) - using deterministic fallback (tx: {transaction.get('transaction_id', 'unknown')})")
         else:
             print(f"⚠️  LLM error: {e} - using deterministic fallback")
         return None
 
 
-def generate_case_pack(
-    transaction: dict,
-    user_transactions: list[dict],
-    linked_context: list[dict],
-    signals: list[dict],
-    decision: dict,
-) -> Optional[LLMCaseOutput]:
+def generate_case_pack(ctx: ScoringContext, decision: dict) -> Optional[LLMCaseOutput]:
     """
     Ask LLM to generate hypotheses, evidence, timeline, recommendations.
-    linked_context: transactions from linked accounts (same ip_hash or device_id).
+    History, linked accounts (same ip_hash or device_id) and signals come from the scoring context.
     """
     model = _get_model()
     if not model:
         return None
+    transaction = ctx.transaction
 
     prompt = f"""You are a fraud investigator. Generate an investigation case pack as JSON.
 
 Primary transaction: {json.dumps(transaction, default=str)}
-User's last transactions (up to 50): {json.dumps(user_transactions[-50:], default=str)}
-Linked accounts context (same IP/device): {json.dumps(linked_context[:30], default=str)}
-Risk signals: {json.dumps(signals, default=str)}
+User's last transactions (up to 50): {json.dumps(ctx.user_history(50), default=str)}
+Linked accounts context (same IP/device): {json.dumps(ctx.linked_context()[:30], default=str)}
+Risk signals: {json.dumps(ctx.signals, default=str)}
 Decision summary: {json.dumps(decision, default=str)}
 
 Output ONLY valid JSON with this exact structure (no markdown):
@@ -143,8 +419,7 @@ Output ONLY valid JSON with this exact structure (no markdown):
 - investigation_suggestions: e.g. check shared IP/device, payment methods.
 """
     try:
-        response = model.generate_content(prompt)
-        text = response.text.strip()
+        text = _generate(model, prompt)
         if text.startswith("```"):
             lines = text.split("\n")
             text = "\n".join(lines[1:-1])
@@ -158,6 +433,8 @@ Output ONLY valid JSON with this exact structure (no markdown):
             recommendations=[RecommendationItem(**r) for r in data.get("recommendations", []) if isinstance(r, dict)],
             investigation_suggestions=data.get("investigation_suggestions", []),
         )
+    except LLMSkipped:
+        return None
     except Exception as e:
         error_msg = str(e)
         if "429" in error_msg or "quota" in error_msg.lower():
@@ -4,24 +4,58 @@ from dotenv import load_dotenv
 # Load .env file before other imports (so llm_client.py can read GEMINI_API_KEY)
 load_dotenv()
 
+import asyncio
+import json
+import os
 import uuid
+from datetime import datetime, timedelta, timezone
 from typing import Optional
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 
-from audit_service import append as audit_append, get_recent as audit_get_recent
-from case_service import apply_action, get_case, list_cases
-from db import get_cursor, init_db
-from decision_service import run_decision
+from audit_service import (
+    append as audit_append,
+    append_many as audit_append_many,
+    events_after as audit_events_after,
+    query as audit_query,
+)
+from backfill import BACKFILL_WORKERS, enqueue_backfill, run_status as backfill_status
+from case_service import apply_action, apply_bulk_action, count_cases_by_status, detail_cache_stats, get_case_detail, list_cases
+from db import close_all, get_cursor, init_db, pool_stats, unit_of_work
+from decision_service import commit_decisions, gate_stats, prepare_decisions, run_decision, stop_refinement_workers
+from event_bus import bus_stats, subscribe, unsubscribe
+from job_queue import queue_stats, start_workers, stop_workers
+from llm_client import breaker_stats as llm_breaker_stats, cache_stats as llm_cache_stats
 from models import (
+    BackfillRequest,
+    BatchIngestResponse,
     CaseActionRequest,
+    CaseBulkActionRequest,
+    CaseBulkActionResponse,
     IngestResponse,
     RiskDecision,
+    ScoringClaimRequest,
+    ScoringClaimResponse,
+    ScoringReleaseRequest,
     SeedResponse,
+    TransactionBatchCreate,
     TransactionCreate,
 )
+from pagination import MAX_PAGE_SIZE, decode_cursor, encode_cursor
+from risk_engine import current_rules, reload_rules
+from scoring_queue import (
+    SCORING_LEASE_SECONDS,
+    claim as scoring_claim,
+    queue_stats as scoring_queue_stats,
+    release as scoring_release,
+    score_claimed,
+)
 from seed import get_seed_queue, run_seed
+from shadow import load as load_shadow_rules, report as shadow_report, stop_worker as stop_shadow_worker
+from velocity import rebuild as rebuild_velocity, velocity_stats
 
 app = FastAPI(title="FraudOps Copilot API", version="1.0.0")
 app.add_middleware(
@@ -30,6 +64,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor"],
 )
 
 # Server-side simulation queue: list of transaction dicts to emit
@@ -45,6 +80,18 @@ def _refill_simulation_queue():
 @app.on_event("startup")
 def startup():
     init_db()
+    reload_rules()  # fail fast on a bad rule file
+    load_shadow_rules()
+    rebuild_velocity()
+    start_workers()
+
+
+@app.on_event("shutdown")
+def shutdown():
+    stop_refinement_workers()
+    stop_shadow_worker()
+    stop_workers()
+    close_all()
 
 
 # --- Seed ---
@@ -52,6 +99,7 @@ def startup():
 def post_seed():
     """Generate synthetic dataset (normal + suspicious)."""
     result = run_seed()
+    rebuild_velocity()  # the old transactions are gone
     return SeedResponse(
         transactions_created=result["transactions_created"],
         message=result["message"],
@@ -59,35 +107,41 @@ def post_seed():
 
 
 # --- Ingest + score + case + audit ---
+_INSERT_TRANSACTION_SQL = """
+    INSERT OR REPLACE INTO transactions
+    (id, timestamp, type, amount, currency, user_id, account_age_days, country, ip_hash, device_id, psp, status)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def _transaction_row(transaction: TransactionCreate) -> tuple:
+    return (
+        transaction.id,
+        transaction.timestamp,
+        transaction.type,
+        transaction.amount,
+        transaction.currency,
+        transaction.user_id,
+        transaction.account_age_days,
+        transaction.country,
+        transaction.ip_hash,
+        transaction.device_id,
+        transaction.psp,
+        transaction.status,
+    )
+
+
 @app.post("/transactions/ingest", response_model=IngestResponse)
 def post_ingest(transaction: TransactionCreate):
-    """Store transaction, run scoring, create case if review/block, audit."""
-    with get_cursor() as cur:
-        cur.execute(
-            """
-            INSERT OR REPLACE INTO transactions
-            (id, timestamp, type, amount, currency, user_id, account_age_days, country, ip_hash, device_id, psp, status)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
-                transaction.id,
-                transaction.timestamp,
-                transaction.type,
-                transaction.amount,
-                transaction.currency,
-                transaction.user_id,
-                transaction.account_age_days,
-                transaction.country,
-                transaction.ip_hash,
-                transaction.device_id,
-                transaction.psp,
-                transaction.status,
-            ),
-        )
-    audit_append("system", "TRANSACTION_INGESTED", {"transaction_id": transaction.id})
-
+    """Store transaction, run scoring, create case if review/block, audit. One commit."""
     tx_dict = transaction.model_dump()
-    decision, case_id = run_decision(tx_dict)
+    items, feature_updates = prepare_decisions([tx_dict])
+
+    with unit_of_work():
+        with get_cursor() as cur:
+            cur.execute(_INSERT_TRANSACTION_SQL, _transaction_row(transaction))
+        audit_append("system", "TRANSACTION_INGESTED", {"transaction_id": transaction.id})
+        [(decision, case_id)] = commit_decisions(items, feature_updates)
 
     return IngestResponse(
         transaction=tx_dict,
@@ -96,61 +150,104 @@ def post_ingest(transaction: TransactionCreate):
     )
 
 
+@app.post("/transactions/ingest/batch", response_model=BatchIngestResponse)
+def post_ingest_batch(batch: TransactionBatchCreate):
+    """
+    Ingest a burst of transactions in one request: score them (feature state loaded once per user,
+    timestamp order), then store transactions, decisions, cases and audit rows in one commit.
+    Results are in input order.
+    """
+    tx_dicts = [t.model_dump() for t in batch.transactions]
+    items, feature_updates = prepare_decisions(tx_dicts)
+
+    with unit_of_work():
+        with get_cursor() as cur:
+            cur.executemany(_INSERT_TRANSACTION_SQL, [_transaction_row(t) for t in batch.transactions])
+        audit_append_many([("system", "TRANSACTION_INGESTED", {"transaction_id": t["id"]}) for t in tx_dicts])
+        committed = commit_decisions(items, feature_updates)
+
+    return BatchIngestResponse(results=[
+        IngestResponse(transaction=tx_dict, decision=decision, case_id=case_id)
+        for tx_dict, (decision, case_id) in zip(tx_dicts, committed)
+    ])
+
+
 # --- Next (simulation: pop from queue, new id) ---
 @app.get("/transactions/next")
 def get_next_transaction():
-    """Return next unscored transaction in chronological order for fraud detection."""
+    """
+    Lease the next unscored transaction in chronological order for fraud detection.
+    Concurrent callers get different rows; an unscored row is handed out again once its lease expires.
+    """
+    _, transactions, _ = scoring_claim(limit=1)
+    return transactions[0] if transactions else None
+
+
+@app.post("/transactions/claim", response_model=ScoringClaimResponse)
+def post_claim_transactions(body: ScoringClaimRequest):
+    """Lease a batch of unscored transactions (oldest first) to one worker."""
+    token, transactions, lease_until = scoring_claim(body.limit, body.lease_seconds or SCORING_LEASE_SECONDS)
+    return ScoringClaimResponse(claim_token=token, lease_expires_at=lease_until, transactions=transactions)
+
+
+@app.post("/transactions/claim/{claim_token}/score", response_model=dict)
+def post_score_claimed(claim_token: str):
+    """Score the still-held, unscored transactions of a claim in place."""
     with get_cursor() as cur:
-        # Get oldest unscored transaction
         cur.execute(
             """
-            SELECT t.id, t.timestamp, t.type, t.amount, t.currency, t.user_id, t.account_age_days,
-                   t.country, t.ip_hash, t.device_id, t.psp, t.status
-            FROM transactions t
-            LEFT JOIN risk_decisions r ON t.id = r.transaction_id
-            WHERE r.id IS NULL
-            ORDER BY t.timestamp ASC
-            LIMIT 1
-            """
+            SELECT id, timestamp, type, amount, currency, user_id, account_age_days,
+                   country, ip_hash, device_id, psp, status
+            FROM transactions WHERE claim_token = ? AND scored_at IS NULL
+            """,
+            (claim_token,),
         )
-        row = cur.fetchone()
-        if not row:
-            return None
-        return dict(row)
+        transactions = [dict(r) for r in cur.fetchall()]
+    return {"scored": score_claimed(claim_token, transactions)}
+
+
+@app.post("/transactions/claim/{claim_token}/release", response_model=dict)
+def post_release_claim(claim_token: str, body: ScoringReleaseRequest):
+    """Hand claimed transactions back to the queue for another worker (counts as an attempt)."""
+    return {"released": scoring_release(claim_token, body.transaction_ids)}
 
 
 # --- Recent transactions + decision ---
 @app.get("/transactions/recent")
-def get_recent_transactions(limit: int = 50):
-    """Most recent transactions with joined decision."""
+def get_recent_transactions(response: Response, limit: int = 50, cursor: Optional[str] = None):
+    """
+    Most recent transactions with their latest decision and case.
+    Keyset-paginated on (timestamp, id): pass the X-Next-Cursor response header back as ?cursor=.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    keyset, params = "", []
+    if cursor:
+        try:
+            params = list(decode_cursor(cursor))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        keyset = "WHERE (t.timestamp, t.id) < (?, ?)"
     with get_cursor() as cur:
         cur.execute(
-            """
+            f"""
             SELECT t.id, t.timestamp, t.type, t.amount, t.currency, t.user_id, t.account_age_days,
                    t.country, t.ip_hash, t.device_id, t.psp, t.status,
                    r.id as decision_id, r.risk_score, r.decision as risk_decision_text,
                    r.llm_rationale, r.created_at as decision_at,
-                   c.case_id
+                   (SELECT ct.case_id FROM case_transactions ct WHERE ct.transaction_id = t.id
+                    ORDER BY ct.added_at DESC LIMIT 1) as case_id
             FROM transactions t
-            LEFT JOIN risk_decisions r ON r.transaction_id = t.id
-            LEFT JOIN cases c ON c.primary_transaction_id = t.id
-            ORDER BY t.timestamp DESC, r.created_at DESC
+            LEFT JOIN risk_decisions r ON r.id = t.latest_decision_id
+            {keyset}
+            ORDER BY t.timestamp DESC, t.id DESC
             LIMIT ?
             """,
-            (limit * 10,),
+            (*params, limit + 1),
         )
         rows = cur.fetchall()
-    # Dedupe by t.id (keep latest decision), then take up to limit
-    seen = set()
-    deduped = []
-    for r in rows:
-        tid = r["id"]
-        if tid not in seen:
-            seen.add(tid)
-            deduped.append(r)
-        if len(deduped) >= limit:
-            break
-    rows = deduped[:limit]
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(rows[-1]["timestamp"], rows[-1]["id"])
     out = []
     for r in rows:
         row = dict(r)
@@ -185,22 +282,77 @@ def post_score(transaction_id: str):
 
 # --- Cases ---
 @app.get("/cases")
-def get_cases_list():
-    """List cases (case_id, primary_transaction_id, status, confidence, created_at)."""
-    return list_cases()
+def get_cases_list(
+    response: Response,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    confidence: Optional[str] = None,
+    created_from: Optional[str] = None,
+    created_to: Optional[str] = None,
+):
+    """
+    List cases newest first (case_id, primary_transaction_id, status, confidence, pack_status, created_at).
+    Keyset-paginated: pass the X-Next-Cursor response header back as ?cursor= for the next page.
+    """
+    try:
+        cases, next_cursor = list_cases(limit, cursor, status, confidence, created_from, created_to)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return cases
+
+
+@app.get("/cases/counts")
+def get_case_counts():
+    """Case counts by status and pack status."""
+    return count_cases_by_status()
 
 
 @app.get("/cases/{case_id}")
-def get_case_detail(case_id: str):
-    """Full case pack + transaction + decision + audit entries."""
-    case = get_case(case_id)
-    if not case:
+def get_case_by_id(case_id: str, request: Request):
+    """
+    Full case pack + transaction + decision + latest audit entries (more via /cases/{case_id}/audit).
+    Sends an ETag; If-None-Match with the current one gets 304 Not Modified.
+    """
+    detail = get_case_detail(case_id)
+    if detail is None:
         raise HTTPException(status_code=404, detail="Case not found")
-    # Add relevant audit entries
-    audit_events = audit_get_recent(limit=200)
-    case_audit = [e for e in audit_events if e.get("payload_json") and case_id in (e.get("payload_json") or "")]
-    case["audit_entries"] = case_audit[:20]
-    return case
+    etag, body = detail
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(",")]):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
+
+
+@app.get("/cases/{case_id}/audit")
+def get_case_audit(case_id: str, response: Response, limit: int = 50, cursor: Optional[str] = None):
+    """A case's audit trail, newest first; keyset-paginated (X-Next-Cursor)."""
+    try:
+        events, next_cursor = audit_query(limit, cursor, case_id=case_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return events
+
+
+@app.post("/cases/actions/bulk", response_model=CaseBulkActionResponse)
+def post_bulk_case_action(body: CaseBulkActionRequest):
+    """
+    Apply one analyst action to many cases in one transaction, picked by case_ids or by filter.
+    Returns a summary (matched case ids, transactions updated), not the case packs.
+    """
+    if (body.case_ids is None) == (body.filter is None):
+        raise HTTPException(status_code=400, detail="Give either case_ids or filter")
+    filters = body.filter.model_dump(mode="json", exclude_none=True) if body.filter else None
+    if body.filter is not None and not filters:
+        raise HTTPException(status_code=400, detail="filter needs at least one condition")
+    try:
+        return apply_bulk_action(body.action.value, body.note, body.case_ids, filters, actor="analyst")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 @app.post("/cases/{case_id}/action")
@@ -214,6 +366,203 @@ def post_case_action(case_id: str, body: CaseActionRequest):
 
 # --- Audit ---
 @app.get("/audit")
-def get_audit(limit: int = 200):
-    """Latest audit events."""
-    return audit_get_recent(limit=limit)
+def get_audit(
+    response: Response,
+    limit: int = 200,
+    cursor: Optional[str] = None,
+    actor: Optional[str] = None,
+    event_type: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    case_id: Optional[str] = None,
+    transaction_id: Optional[str] = None,
+    decision_id: Optional[str] = None,
+):
+    """Audit events newest first, filterable; keyset-paginated like /cases (X-Next-Cursor)."""
+    try:
+        events, next_cursor = audit_query(
+            limit, cursor, actor, event_type, since, until, case_id, transaction_id, decision_id
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return events
+
+
+# --- Live stream ---
+
+STREAM_EVENT_TYPES = {
+    "DECISION_CREATED",
+    "DECISION_REFINED",
+    "CASE_CREATED",
+    "CASE_TRANSACTION_ATTACHED",
+    "CASE_LINKED",
+    "CASE_PACK_READY",
+    "CASE_PACK_FAILED",
+    "CASE_ACTION",
+}
+STREAM_HEARTBEAT_SECONDS = float(os.getenv("STREAM_HEARTBEAT_SECONDS", "15"))
+STREAM_REPLAY_PAGE = int(os.getenv("STREAM_REPLAY_PAGE", "500"))
+
+
+def _sse(event: dict) -> str:
+    return f"id: {event['event_id']}\nevent: {event['event_type']}\ndata: {json.dumps(event)}\n\n"
+
+
+@app.get("/stream")
+async def get_stream(request: Request, types: Optional[str] = None, last_event_id: Optional[str] = None):
+    """
+    Server-Sent Events feed of committed decision and case events (audit_log rows), pushed as they commit.
+    types: comma-separated event types, or * for every audit event.
+    Reconnect with Last-Event-ID (header or query) to replay what was missed from the audit log.
+    A client that falls too far behind gets an `overflow` event and should reconnect with its last id.
+    """
+    if types == "*":
+        event_types = None
+    elif types:
+        event_types = {t.strip() for t in types.split(",") if t.strip()}
+    else:
+        event_types = STREAM_EVENT_TYPES
+    resume_from = request.headers.get("last-event-id") or last_event_id
+    # Subscribe before replaying so nothing committed in between is missed
+    sub = subscribe(event_types)
+
+    async def events():
+        last_id = resume_from
+        replayed: set[str] = set()
+        try:
+            if resume_from:
+                while True:
+                    page = await run_in_threadpool(audit_events_after, last_id, event_types, STREAM_REPLAY_PAGE)
+                    if page is None:
+                        yield f"event: reset\ndata: {json.dumps({'unknown_event_id': resume_from})}\n\n"
+                        break
+                    for event in page:
+                        replayed.add(event["event_id"])
+                        last_id = event["event_id"]
+                        yield _sse(event)
+                    if len(page) < STREAM_REPLAY_PAGE:
+                        break
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(sub.queue.get(), STREAM_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if event is None:
+                    yield f"event: overflow\ndata: {json.dumps({'last_event_id': last_id})}\n\n"
+                    break
+                if event["event_id"] in replayed:
+                    continue
+                last_id = event["event_id"]
+                yield _sse(event)
+        finally:
+            unsubscribe(sub)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# --- Rules ---
+@app.get("/rules")
+def get_rules():
+    """Active rule set: version, source file, bands and signals."""
+    return current_rules().describe()
+
+
+@app.post("/rules/reload")
+def post_rules_reload():
+    """Recompile the rule file now and swap it in; a file that fails validation leaves the active rules in place (400)."""
+    try:
+        return reload_rules(force=True)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/shadow/report")
+def get_shadow_report(shadow_set: Optional[str] = None, since: Optional[str] = None, until: Optional[str] = None):
+    """
+    Shadow rule sets vs the live rules over [since, until): decision flips (live->shadow), decision mix,
+    average score delta, plus the shadow worker's queue and drop counters.
+    """
+    return shadow_report(shadow_set, since, until)
+
+
+# --- Admin ---
+@app.post("/admin/backfill")
+def post_backfill(body: BackfillRequest):
+    """
+    Queue a re-score of scored transactions in [since, until) with the current rules (dry run by default:
+    only reports decision deltas). Poll GET /admin/backfill/{run_id} for progress and the report.
+    """
+    since = body.since or (datetime.now(timezone.utc) - timedelta(days=body.days)).isoformat()
+    run_id = enqueue_backfill(since, body.until, body.dry_run, body.workers or BACKFILL_WORKERS)
+    return {"run_id": run_id, "dry_run": body.dry_run}
+
+
+@app.get("/admin/backfill/{run_id}")
+def get_backfill(run_id: str):
+    """Backfill run status, progress by partition and the decision delta report."""
+    status = backfill_status(run_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Backfill run not found")
+    return status
+
+
+# --- Ops ---
+@app.get("/db/stats")
+def get_db_stats():
+    """SQLite connection pool counters and settings."""
+    return pool_stats()
+
+
+@app.get("/jobs/stats")
+def get_job_stats():
+    """Background job queue depth (by kind/status) and oldest queued job age."""
+    return queue_stats()
+
+
+@app.get("/velocity/stats")
+def get_velocity_stats():
+    """Sliding-window velocity counters: keys tracked (by user/device/IP), evictions, transactions counted."""
+    return velocity_stats()
+
+
+@app.get("/scoring/stats")
+def get_scoring_stats():
+    """Scoring queue backlog, leased rows and rows out of attempts."""
+    return scoring_queue_stats()
+
+
+@app.get("/cases/cache/stats")
+def get_case_cache_stats():
+    """Case detail cache entries and hit/miss counters."""
+    return detail_cache_stats()
+
+
+@app.get("/llm/cache/stats")
+def get_llm_cache_stats():
+    """LLM adjudication cache hit/miss counters and settings."""
+    return llm_cache_stats()
+
+
+@app.get("/llm/breaker")
+def get_llm_breaker():
+    """Gemini circuit breaker state, client-side quota and call counters."""
+    return llm_breaker_stats()
+
+
+@app.get("/stream/stats")
+def get_stream_stats():
+    """Live stream subscribers, events published/delivered, and clients cut off for falling behind."""
+    return bus_stats()
+
+
+@app.get("/llm/gate")
+def get_llm_gate():
+    """LLM gating band, sampling rate and how many transactions skipped the model."""
+    return gate_stats()
@@ -58,6 +58,33 @@ class Transaction(TransactionCreate):
     pass
 
 
+class TransactionBatchCreate(BaseModel):
+    transactions: list[TransactionCreate] = Field(min_length=1, max_length=1000)
+
+
+class ScoringClaimRequest(BaseModel):
+    limit: int = Field(default=1, ge=1, le=500)
+    lease_seconds: Optional[float] = Field(default=None, gt=0)
+
+
+class ScoringClaimResponse(BaseModel):
+    claim_token: str
+    lease_expires_at: str
+    transactions: list[Transaction]
+
+
+class ScoringReleaseRequest(BaseModel):
+    transaction_ids: Optional[list[str]] = None  # None releases the whole claim
+
+
+class BackfillRequest(BaseModel):
+    since: Optional[str] = None  # default: now - days
+    until: Optional[str] = None  # default: now
+    days: float = 30
+    dry_run: bool = True
+    workers: Optional[int] = None
+
+
 # --- Risk / Decision ---
 class Signal(BaseModel):
     name: str
@@ -121,6 +148,29 @@ class CaseActionRequest(BaseModel):
     note: Optional[str] = None
 
 
+class CaseBulkFilter(BaseModel):
+    status: Optional[CaseStatus] = None
+    confidence: Optional[ConfidenceLevel] = None
+    created_from: Optional[str] = None
+    created_to: Optional[str] = None
+
+
+class CaseBulkActionRequest(BaseModel):
+    action: CaseAction
+    note: Optional[str] = None
+    case_ids: Optional[list[str]] = None  # either case_ids or filter
+    filter: Optional[CaseBulkFilter] = None
+
+
+class CaseBulkActionResponse(BaseModel):
+    bulk_action_id: str
+    action: str
+    matched: int
+    updated_transactions: int
+    case_ids: list[str]
+    not_found: list[str] = []
+
+
 # --- Audit ---
 class AuditEvent(BaseModel):
     event_id: str
@@ -142,6 +192,10 @@ class IngestResponse(BaseModel):
     case_id: Optional[str] = None
 
 
+class BatchIngestResponse(BaseModel):
+    results: list[IngestResponse]  # same order as the request
+
+
 class ScoreResponse(BaseModel):
     decision: RiskDecision
     case_id: Optional[str] = None
@@ -0,0 +1,61 @@
+"""Keyset pagination helpers for lists ordered newest first by (created_at, id).
+
+Cursors are opaque to clients: the (created_at, id) of the last row served, base64-encoded.
+"""
+import base64
+import json
+
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(created_at: str, row_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([created_at, row_id]).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[str, str]:
+    """Raises ValueError on anything that is not a cursor we issued."""
+    try:
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception as e:
+        raise ValueError("invalid cursor") from e
+    if not isinstance(created_at, str) or not isinstance(row_id, str):
+        raise ValueError("invalid cursor")
+    return created_at, row_id
+
+
+def keyset_page(
+    table: str,
+    columns: str,
+    id_column: str,
+    filters: list[tuple[str, object]],
+    limit: int,
+    cursor: str | None,
+    cur,
+) -> tuple[list[dict], str | None]:
+    """
+    One page of `table` newest first. filters are (SQL condition with one '?', value) pairs;
+    None values are skipped. Returns (rows, cursor for the next page or None).
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    conditions = [cond for cond, value in filters if value is not None]
+    params = [value for _, value in filters if value is not None]
+    if cursor:
+        conditions.append(f"(created_at, {id_column}) < (?, ?)")
+        params.extend(decode_cursor(cursor))
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    cur.execute(
+        f"""
+        SELECT {columns}
+        FROM {table}
+        {where}
+        ORDER BY created_at DESC, {id_column} DESC
+        LIMIT ?
+        """,
+        (*params, limit + 1),
+    )
+    rows = [dict(r) for r in cur.fetchall()]
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["created_at"], rows[-1][id_column])
+    return rows, next_cursor
@@ -1,171 +1,707 @@
-"""Deterministic risk scoring with explainable signals."""
-from typing import Any
+"""Deterministic risk scoring with explainable signals.
+
+Signal rules (thresholds, weights, explanations) and the decision bands live in a versioned JSON file
+(RISK_RULES_PATH, default rules.json). It is compiled once into a RulePlan and reloaded when the file
+changes; a reload swaps the whole plan at once, so a transaction is always scored by a single version.
+"""
+import json
+import os
+import string
+import threading
+import time
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Callable
+
+import numpy as np
 
 from models import Signal
 
-# Signal definitions: (name, weight, threshold description for explanation)
-SIGNAL_SPECS = [
-    ("velocity_withdrawals_20m", 25, "count of withdrawals in last 20 min"),
-    ("amount_vs_user_avg", 20, "ratio current amount / avg last 30 days"),
-    ("new_device", 15, "first time this device_id for user"),
-    ("geo_change", 20, "country differs from last known"),
-    ("young_account_high_amount", 25, "account_age_days < 30 and amount > 1000"),
-    ("psp_anomaly", 10, "PSP not in user's usual set"),
+RISK_RULES_PATH = os.getenv("RISK_RULES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "rules.json"))
+RISK_RULES_RELOAD_SECONDS = float(os.getenv("RISK_RULES_RELOAD_SECONDS", "5"))  # 0 = only POST /rules/reload
+
+# Feature windows are part of the feature store state, not of the tunable rules
+VELOCITY_WINDOW_US = 20 * 60 * 1_000_000
+# The 30-day average covers whole UTC days (the transaction's day and the 29 before it), so the feature
+# store can keep it as at most AVG_WINDOW_DAYS daily totals
+DAY_US = 86400 * 1_000_000
+AVG_WINDOW_DAYS = 30
+
+# Sliding velocity windows (live counters in velocity.py). Each window is VELOCITY_BUCKETS time buckets and
+# slides one bucket at a time (1m in 5 s steps ... 24h in 2 h steps); facts are {key}_{count|amount}_{window}
+VELOCITY_WINDOWS = {"1m": 60, "5m": 300, "1h": 3600, "24h": 86400}
+VELOCITY_BUCKETS = 12
+VELOCITY_KEYS = {"user": "user_id", "device": "device_id", "ip": "ip_hash"}
+VELOCITY_FACT_KEYS = [
+    f"{prefix}_{measure}_{window}" for prefix in VELOCITY_KEYS for measure in ("count", "amount") for window in VELOCITY_WINDOWS
 ]
+# Device/IP velocity counts every user's transactions live; per-user history (score_batch, backfill) can't rebuild it
+CROSS_USER_FACT_KEYS = frozenset(key for key in VELOCITY_FACT_KEYS if not key.startswith("user_"))
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def to_epoch_us(ts: str) -> int | None:
+    """ISO timestamp -> integer microseconds since epoch (naive timestamps are taken as UTC). None if unparseable."""
+    try:
+        dt = datetime.fromisoformat(ts.replace("Z", "+00:00"))
+    except Exception:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    delta = dt - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+
+def velocity_bucket_us(window: str) -> int:
+    """Bucket width of a velocity window in microseconds."""
+    return VELOCITY_WINDOWS[window] * 1_000_000 // VELOCITY_BUCKETS
+
+
+def to_cents(amount) -> int:
+    """Velocity amounts are summed in integer cents, so every path gets exactly the same totals."""
+    return round((amount or 0) * 100)
+
+
+def history_velocity(transaction: dict, tx_us: int | None, earlier: list[dict], epochs: list[int | None]) -> dict:
+    """
+    Velocity facts rebuilt from earlier transactions: those with the same key in the transaction's last
+    VELOCITY_BUCKETS buckets, the live counters' windows. Scoring passes the user's own history, so there
+    device and IP totals only see this user's transactions; velocity.py passes every user's for re-scores.
+    """
+    facts = {}
+    for prefix, field_name in VELOCITY_KEYS.items():
+        value = transaction.get(field_name)
+        for window in VELOCITY_WINDOWS:
+            count = cents = 0
+            if tx_us is not None and value:
+                width = velocity_bucket_us(window)
+                first_us = (tx_us // width - VELOCITY_BUCKETS + 1) * width
+                for t, t_us in zip(earlier, epochs):
+                    if t_us is not None and t_us >= first_us and t.get(field_name) == value:
+                        count += 1
+                        cents += to_cents(t.get("amount"))
+            facts[f"{prefix}_count_{window}"] = count
+            facts[f"{prefix}_amount_{window}"] = cents / 100
+    return facts
+
 
-# Decision bands (pre-LLM)
-BLOCK_THRESHOLD = 80
-REVIEW_MIN = 40  # Lowered from 50 to catch velocity attacks
-REVIEW_MAX = 79
-
-
-def _get_user_history(transaction: dict, user_txs: list[dict]) -> dict:
-    """Build a small context for signal computation."""
-    withdrawals_20m = [
-        t
-        for t in user_txs
-        if t.get("type") == "withdrawal"
-        and _minutes_ago(t.get("timestamp", ""), transaction.get("timestamp", "")) <= 20
-    ]
-    last_30d = [t for t in user_txs if _days_ago(t.get("timestamp", ""), transaction.get("timestamp", "")) <= 30]
-    avg_30d = sum(t.get("amount", 0) for t in last_30d) / len(last_30d) if last_30d else 0
+def _get_user_history(transaction: dict, user_txs: list[dict], epochs: list[int | None]) -> dict:
+    """Build a small context for signal computation. epochs[i] is user_txs[i]'s timestamp in epoch-us."""
+    tx_us = to_epoch_us(transaction.get("timestamp", ""))
+    withdrawals_20m = 0
+    count_30d = 0
+    cents_30d = 0
+    if tx_us is not None:
+        first_day = tx_us // DAY_US - AVG_WINDOW_DAYS + 1
+        for t, t_us in zip(user_txs, epochs):
+            if t_us is None:
+                continue
+            if t_us // DAY_US >= first_day:
+                count_30d += 1
+                cents_30d += to_cents(t.get("amount"))
+            if abs(tx_us - t_us) <= VELOCITY_WINDOW_US and t.get("type") == "withdrawal":
+                withdrawals_20m += 1
+    avg_30d = cents_30d / count_30d / 100 if count_30d else 0
     known_devices = {t.get("device_id") for t in user_txs if t.get("device_id")}
     last_country = user_txs[-1].get("country") if user_txs else None
     known_psps = {t.get("psp") for t in user_txs if t.get("psp")}
     return {
-        "withdrawals_20m_count": len(withdrawals_20m),
+        "withdrawals_20m_count": withdrawals_20m,
         "avg_amount_30d": avg_30d,
         "known_devices": known_devices,
         "last_country": last_country,
         "known_psps": known_psps,
+        **history_velocity(transaction, tx_us, user_txs, epochs),
     }
 
 
-def _minutes_ago(ts1: str, ts2: str) -> float:
+def build_features(transaction: dict, user_history: list[dict], epochs: list[int | None] | None = None) -> dict:
+    """
+    Per-user features for one transaction, scanned from its history (ordered by timestamp).
+    Same shape as feature_store.features_at. Callers scoring several transactions over the same
+    history pass epochs (to_epoch_us of each row, see history_epochs) so rows are not re-parsed each time.
+    """
+    # History is ordered by timestamp, so the rows strictly before this one are a prefix
+    cut = bisect_left(user_history, transaction.get("timestamp", ""), key=lambda t: t.get("timestamp", ""))
+    if epochs is None:
+        epochs = history_epochs(user_history[:cut])
+    return _get_user_history(transaction, user_history[:cut], epochs[:cut])
+
+
+def history_epochs(rows: list[dict]) -> list[int | None]:
+    """to_epoch_us of each row's timestamp, to pass along with the rows to build_features."""
+    return [to_epoch_us(t.get("timestamp", "")) for t in rows]
+
+
+# --- Rule plan ---
+
+# Facts every rule reads from (and explanations may reference): transaction fields plus user features
+FACT_KEYS = {
+    "amount",
+    "currency",
+    "account_age_days",
+    "device_id",
+    "country",
+    "psp",
+    "withdrawals_20m_count",
+    "avg_amount_30d",
+    "known_devices",
+    "last_country",
+    "known_psps",
+    *VELOCITY_FACT_KEYS,
+}
+
+
+def _kind_feature_at_least(rule: dict) -> Callable[[dict], tuple[Any, bool]]:
+    feature, threshold = rule["feature"], rule["threshold"]
+
+    def evaluate(facts: dict) -> tuple[Any, bool]:
+        value = facts[feature]
+        return value, value >= threshold
+
+    return evaluate
+
+
+def _kind_amount_ratio_at_least(rule: dict) -> Callable[[dict], tuple[Any, bool]]:
+    feature, threshold = rule["feature"], rule["threshold"]
+
+    def evaluate(facts: dict) -> tuple[Any, bool]:
+        ratio = facts["amount"] / (facts[feature] or 1)
+        return round(ratio, 2), ratio >= threshold
+
+    return evaluate
+
+
+def _kind_unseen_value(rule: dict) -> Callable[[dict], tuple[Any, bool]]:
+    field_name, feature = rule["field"], rule["feature"]
+    require_history = bool(rule.get("require_history", False))
+
+    def evaluate(facts: dict) -> tuple[Any, bool]:
+        value, known = facts[field_name], facts[feature]
+        fired = bool(value and (known or not require_history) and value not in known)
+        return fired, fired
+
+    return evaluate
+
+
+def _kind_changed_from(rule: dict) -> Callable[[dict], tuple[Any, bool]]:
+    field_name, feature = rule["field"], rule["feature"]
+
+    def evaluate(facts: dict) -> tuple[Any, bool]:
+        current, last = facts[field_name], facts[feature]
+        fired = bool(current and last and current != last)
+        return fired, fired
+
+    return evaluate
+
+
+def _kind_young_account_amount(rule: dict) -> Callable[[dict], tuple[Any, bool]]:
+    max_age, min_amount = rule["max_account_age_days"], rule["min_amount"]
+
+    def evaluate(facts: dict) -> tuple[Any, bool]:
+        fired = facts["account_age_days"] < max_age and facts["amount"] >= min_amount
+        return fired, fired
+
+    return evaluate
+
+
+RULE_KINDS: dict[str, Callable[[dict], Callable[[dict], tuple[Any, bool]]]] = {
+    "feature_at_least": _kind_feature_at_least,
+    "amount_ratio_at_least": _kind_amount_ratio_at_least,
+    "unseen_value": _kind_unseen_value,
+    "changed_from": _kind_changed_from,
+    "young_account_amount": _kind_young_account_amount,
+}
+
+
+@dataclass(frozen=True)
+class CompiledRule:
+    name: str
+    kind: str
+    weight: int
+    threshold: Any
+    evaluate: Callable[[dict], tuple[Any, bool]]
+    explanation: str  # template, formatted only when the signal fires
+    explanation_unfired: str  # formatted once at compile time
+    params: dict
+    description: str = ""
+
+
+@dataclass(frozen=True)
+class RulePlan:
+    version: Any
+    source: str
+    block_threshold: int
+    review_min: int
+    review_max: int
+    rules: tuple[CompiledRule, ...]
+    config: dict = field(default_factory=dict, repr=False)  # the source config, to recompile elsewhere (backfill workers)
+    loaded_at: str = field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
+
+    def describe(self) -> dict:
+        return {
+            "version": self.version,
+            "source": self.source,
+            "loaded_at": self.loaded_at,
+            "bands": {
+                "block_threshold": self.block_threshold,
+                "review_min": self.review_min,
+                "review_max": self.review_max,
+            },
+            "signals": [
+                {"name": r.name, "kind": r.kind, "weight": r.weight, "threshold": r.threshold, "description": r.description}
+                for r in self.rules
+            ],
+        }
+
+
+def _check_template(rule_name: str, template: str, allowed: set[str]) -> None:
+    for _, field_name, _, _ in string.Formatter().parse(template):
+        if field_name is not None and field_name not in allowed:
+            raise ValueError(f"rule {rule_name}: unknown placeholder {{{field_name}}} in explanation")
+
+
+def compile_rules(config: dict, source: str = "<config>") -> RulePlan:
+    """Validate a rule config (see rules.json) and compile it into a RulePlan. Raises ValueError."""
     try:
-        from datetime import datetime, timezone
-        t1 = datetime.fromisoformat(ts1.replace("Z", "+00:00"))
-        t2 = datetime.fromisoformat(ts2.replace("Z", "+00:00"))
-        return abs((t2 - t1).total_seconds()) / 60
-    except Exception:
-        return 999
+        bands = config["bands"]
+        compiled = []
+        seen = set()
+        for rule in config["signals"]:
+            name, kind = rule["name"], rule["kind"]
+            if name in seen:
+                raise ValueError(f"duplicate rule {name}")
+            seen.add(name)
+            if kind not in RULE_KINDS:
+                raise ValueError(f"rule {name}: unknown kind {kind}")
+            params = {k: v for k, v in rule.items() if k not in ("name", "kind", "weight", "description", "explanation", "explanation_unfired")}
+            for key in ("feature", "field"):
+                if key in params and params[key] not in FACT_KEYS:
+                    raise ValueError(f"rule {name}: unknown {key} {params[key]}")
+            explanation = rule.get("explanation", name)
+            _check_template(name, explanation, FACT_KEYS | set(params) | {"value"})
+            unfired = rule.get("explanation_unfired", "OK")
+            _check_template(name, unfired, set(params))
+            compiled.append(
+                CompiledRule(
+                    name=name,
+                    kind=kind,
+                    weight=int(rule["weight"]),
+                    threshold=rule.get("threshold", True),
+                    evaluate=RULE_KINDS[kind](rule),
+                    explanation=explanation,
+                    explanation_unfired=unfired.format_map(params),
+                    params=params,
+                    description=rule.get("description", ""),
+                )
+            )
+        return RulePlan(
+            version=config.get("version"),
+            source=source,
+            block_threshold=int(bands["block_threshold"]),
+            review_min=int(bands["review_min"]),
+            review_max=int(bands["review_max"]),
+            rules=tuple(compiled),
+            config=config,
+        )
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"invalid rule config {source}: missing or bad field {e}") from e
 
 
-def _days_ago(ts1: str, ts2: str) -> float:
+def load_rules(path: str) -> RulePlan:
+    """Read and compile a rule file. Raises ValueError (also for unreadable or malformed JSON)."""
     try:
-        from datetime import datetime, timezone
-        t1 = datetime.fromisoformat(ts1.replace("Z", "+00:00"))
-        t2 = datetime.fromisoformat(ts2.replace("Z", "+00:00"))
-        return abs((t2 - t1).total_seconds()) / 86400
-    except Exception:
-        return 999
+        with open(path, encoding="utf-8") as f:
+            config = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        raise ValueError(f"cannot read rule config {path}: {e}") from e
+    return compile_rules(config, path)
+
+
+class RuleSource:
+    """A rule file compiled into a RulePlan, recompiled when the file changes (checked at most every reload_seconds)."""
+
+    def __init__(self, path: str, reload_seconds: float = RISK_RULES_RELOAD_SECONDS):
+        self.path = path
+        self.reload_seconds = reload_seconds
+        self.plan: RulePlan | None = None
+        self._stamp: tuple[int, int] | None = None  # (mtime_ns, size) of the file last loaded (or rejected)
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    def reload(self, force: bool = False) -> dict:
+        """
+        Recompile the file if it changed (always with force) and swap it in. An invalid file keeps the
+        current plan; with force the error is raised (ValueError), otherwise printed.
+        Returns the active plan's description.
+        """
+        with self._lock:
+            self._next_check = time.monotonic() + self.reload_seconds
+            try:
+                st = os.stat(self.path)
+                stamp = (st.st_mtime_ns, st.st_size)
+            except OSError:
+                stamp = None
+            if force or self.plan is None or stamp != self._stamp:
+                self._stamp = stamp
+                try:
+                    plan = load_rules(self.path)
+                except ValueError as e:
+                    if force or self.plan is None:
+                        raise
+                    print(f"⚠️  Keeping rules v{self.plan.version} from {self.path}: {e}")
+                else:
+                    if self.plan is not None and plan.version == self.plan.version:
+                        print(f"⚠️  Rules reloaded from {self.path} without a version bump (v{plan.version})")
+                    self.plan = plan
+            return self.plan.describe()
+
+    def current(self) -> RulePlan:
+        """The active plan, picking up file changes. Never blocks on a reload in progress."""
+        plan = self.plan
+        if plan is None:
+            self.reload()
+            return self.plan
+        if self.reload_seconds > 0 and time.monotonic() >= self._next_check and not self._lock.locked():
+            self.reload()
+            return self.plan
+        return plan
+
 
+_live_rules = RuleSource(RISK_RULES_PATH)
 
-def compute_signals(transaction: dict, user_history: list[dict]) -> list[dict]:
+
+def reload_rules(force: bool = False) -> dict:
+    """Reload the live rules (RISK_RULES_PATH); see RuleSource.reload."""
+    return _live_rules.reload(force)
+
+
+def current_rules() -> RulePlan:
+    """The live plan, picking up file changes at most every RISK_RULES_RELOAD_SECONDS."""
+    return _live_rules.current()
+
+
+def _facts(transaction: dict, hist: dict) -> dict:
+    """Everything the rules read, looked up once per transaction."""
+    return {
+        **hist,
+        "amount": transaction.get("amount") or 0,
+        "currency": transaction.get("currency", "USD"),
+        "account_age_days": transaction.get("account_age_days") or 0,
+        "device_id": transaction.get("device_id"),
+        "country": transaction.get("country"),
+        "psp": transaction.get("psp"),
+    }
+
+
+def compute_signals(transaction: dict, user_history: list[dict], plan: RulePlan | None = None) -> list[dict]:
     """
     Compute explainable risk signals.
     user_history: list of past transactions for this user (same user_id), ordered by timestamp.
     Returns list of signal dicts: { name, value, threshold, weight, fired, explanation }.
     """
-    tx_ts = transaction.get("timestamp", "")
-    user_txs = [t for t in user_history if t.get("timestamp", "") < tx_ts]
-    hist = _get_user_history(transaction, user_txs)
+    return compute_signals_from_features(transaction, build_features(transaction, user_history), plan)
 
-    amount = transaction.get("amount") or 0
-    currency = transaction.get("currency", "USD")
-    account_age = transaction.get("account_age_days") or 0
-    device_id = transaction.get("device_id")
-    country = transaction.get("country")
-    psp = transaction.get("psp")
 
+def compute_signals_from_features(transaction: dict, hist: dict, plan: RulePlan | None = None) -> list[dict]:
+    """Compute explainable risk signals from precomputed features (see build_features) with the active (or given) plan."""
+    plan = plan or current_rules()
+    facts = _facts(transaction, hist)
     signals: list[dict] = []
-
-    # velocity_withdrawals_20m
-    count_20m = hist["withdrawals_20m_count"]
-    threshold_20m = 3
-    fired_20m = count_20m >= threshold_20m
-    signals.append({
-        "name": "velocity_withdrawals_20m",
-        "value": count_20m,
-        "threshold": threshold_20m,
-        "weight": 25,
-        "fired": fired_20m,
-        "explanation": f"Withdrawals in last 20 min: {count_20m} (threshold {threshold_20m})",
-    })
-
-    # amount_vs_user_avg
-    avg_30d = hist["avg_amount_30d"] or 1
-    ratio = amount / avg_30d if avg_30d else 0
-    threshold_ratio = 3.0
-    fired_ratio = ratio >= threshold_ratio
-    signals.append({
-        "name": "amount_vs_user_avg",
-        "value": round(ratio, 2),
-        "threshold": threshold_ratio,
-        "weight": 20,
-        "fired": fired_ratio,
-        "explanation": f"Amount vs 30d avg ratio: {round(ratio, 2)} (threshold {threshold_ratio})",
-    })
-
-    # new_device
-    known = hist["known_devices"]
-    new_device = bool(device_id and device_id not in known)
-    signals.append({
-        "name": "new_device",
-        "value": new_device,
-        "threshold": True,
-        "weight": 15,
-        "fired": new_device,
-        "explanation": "New device" if new_device else "Known device",
-    })
-
-    # geo_change
-    last_country = hist["last_country"]
-    geo_change = bool(country and last_country and country != last_country)
-    signals.append({
-        "name": "geo_change",
-        "value": geo_change,
-        "threshold": True,
-        "weight": 20,
-        "fired": geo_change,
-        "explanation": f"Country changed from {last_country} to {country}" if geo_change else "No geo change",
-    })
-
-    # young_account_high_amount
-    young_high = account_age < 30 and amount >= 1000
-    signals.append({
-        "name": "young_account_high_amount",
-        "value": young_high,
-        "threshold": True,
-        "weight": 25,
-        "fired": young_high,
-        "explanation": f"Account age {account_age} days, amount {amount}" if young_high else "OK",
-    })
-
-    # psp_anomaly
-    known_psps = hist["known_psps"]
-    psp_anomaly = bool(psp and known_psps and psp not in known_psps)
-    signals.append({
-        "name": "psp_anomaly",
-        "value": psp_anomaly,
-        "threshold": True,
-        "weight": 10,
-        "fired": psp_anomaly,
-        "explanation": "PSP not seen before for this user" if psp_anomaly else "Known PSP",
-    })
-
+    for rule in plan.rules:
+        value, fired = rule.evaluate(facts)
+        signals.append({
+            "name": rule.name,
+            "value": value,
+            "threshold": rule.threshold,
+            "weight": rule.weight,
+            "fired": fired,
+            "explanation": rule.explanation.format_map({**facts, **rule.params, "value": value})
+            if fired
+            else rule.explanation_unfired,
+        })
     return signals
 
 
-def risk_score_and_candidate(signals: list[dict]) -> tuple[int, str]:
+def risk_score_and_candidate(signals: list[dict], plan: RulePlan | None = None) -> tuple[int, str]:
     """
     risk_score_base = sum(weight for fired signals), clamped 0..100.
     Returns (risk_score, candidate) where candidate is 'block_candidate' | 'review_candidate' | 'approve_candidate'.
     """
+    plan = plan or current_rules()
     score = sum(s.get("weight", 0) for s in signals if s.get("fired"))
     score = max(0, min(100, score))
-    if score >= BLOCK_THRESHOLD:
+    if score >= plan.block_threshold:
         return score, "block_candidate"
-    if REVIEW_MIN <= score <= REVIEW_MAX:
+    if plan.review_min <= score <= plan.review_max:
         return score, "review_candidate"
     return score, "approve_candidate"
+
+
+# --- Columnar batch scoring ---
+
+BATCH_COLUMNS = ("user_id", "timestamp", "type", "amount", "account_age_days", "country", "device_id", "ip_hash", "psp")
+
+# Set-like / last-value features and the transaction field they are built from
+_HISTORY_FEATURE_FIELDS = {"known_devices": "device_id", "known_psps": "psp", "last_country": "country"}
+
+
+def columns_from_rows(rows: list[dict]) -> dict:
+    """Columnar arrays (BATCH_COLUMNS plus id and currency) for score_batch. Rows must already be sorted by (user_id, timestamp)."""
+    columns = {name: np.array([r.get(name) for r in rows], dtype=object) for name in ("id", "currency", *BATCH_COLUMNS)}
+    columns["amount"] = np.array([r.get("amount") or 0 for r in rows], dtype=np.float64)
+    columns["account_age_days"] = np.array([r.get("account_age_days") or 0 for r in rows], dtype=np.int64)
+    return columns
+
+
+def _truthy(values) -> "np.ndarray":
+    return np.array([bool(v) for v in values], dtype=bool)
+
+
+def _first_at_least(
+    group: "np.ndarray", sorted_values: "np.ndarray", queries: "np.ndarray", query_group: "np.ndarray | None" = None
+) -> "np.ndarray":
+    """
+    Per query i: first index j of query_group[i]'s rows with sorted_values[j] >= queries[i] (searchsorted within
+    each group). Rows must be grouped and sorted by value within a group; query_group defaults to group (one query per row).
+    """
+    query_group = group if query_group is None else query_group
+    n, m = len(group), len(queries)
+    order = np.lexsort((
+        np.concatenate([np.ones(n, dtype=np.int8), np.zeros(m, dtype=np.int8)]),  # queries sort before equal values
+        np.concatenate([sorted_values, queries]),
+        np.concatenate([group, query_group]),
+    ))
+    data_before = np.cumsum(order < n) - (order < n)
+    result = np.empty(m, dtype=np.int64)
+    is_query = order >= n
+    result[order[is_query] - n] = data_before[is_query]
+    return result
+
+
+def _seen_in_history(user_key: "np.ndarray", source: "np.ndarray", query: "np.ndarray", hist_end: "np.ndarray") -> "np.ndarray":
+    """Per row i: does source[j] == query[i] for some row j of the same user before hist_end[i]?"""
+    n = len(source)
+    # Empty source values are never "known"; \x01 keeps them from matching any query
+    source_keys = np.array([f"{u}\x00{v}" if v else f"{u}\x01" for u, v in zip(user_key, source)], dtype=object)
+    query_keys = np.array([f"{u}\x00{v}" for u, v in zip(user_key, query)], dtype=object)
+    uniq, first = np.unique(source_keys, return_index=True)
+    pos = np.clip(np.searchsorted(uniq, query_keys), 0, max(len(uniq) - 1, 0))
+    found = (uniq[pos] == query_keys) if n else np.zeros(0, dtype=bool)
+    return found & (first[pos] < hist_end)
+
+
+def _batch_features(columns: dict) -> dict:
+    """
+    Per-row user features over the chunk, matching build_features: each row's history is the earlier rows
+    of its user with a strictly smaller timestamp. Window sums use prefix sums and per-user searchsorted.
+    """
+    user, ts = columns["user_id"], columns["timestamp"]
+    n = len(user)
+    idx = np.arange(n)
+    new_user = np.ones(n, dtype=bool)
+    new_user[1:] = user[1:] != user[:-1]
+    group_start = np.maximum.accumulate(np.where(new_user, idx, 0))
+    group = np.cumsum(new_user)
+    # History ends at the first row with the same timestamp (ties are not history)
+    new_ts = new_user.copy()
+    new_ts[1:] |= ts[1:] != ts[:-1]
+    hist_end = np.maximum.accumulate(np.where(new_ts, idx, 0))
+
+    epoch_list = [to_epoch_us(t or "") for t in ts]
+    valid = np.array([e is not None for e in epoch_list], dtype=bool)
+    epoch = np.array([e if e is not None else 0 for e in epoch_list], dtype=np.int64)
+    # Monotone per user for searchsorted: unparseable rows take the previous parseable time (they carry no weight)
+    floor = np.iinfo(np.int64).min // 2
+    last_valid = np.maximum.accumulate(np.where(valid, idx, -1))
+    filled = np.where(last_valid >= group_start, epoch[np.maximum(last_valid, 0)], floor)
+
+    is_withdrawal = valid & (columns["type"] == "withdrawal")
+    amount = columns["amount"]
+    c_valid = np.concatenate([[0], np.cumsum(valid)])
+    c_cents = np.concatenate([[0], np.cumsum(np.where(valid, np.rint(amount * 100).astype(np.int64), 0))])
+    c_withdrawal = np.concatenate([[0], np.cumsum(is_withdrawal)])
+
+    lo_30d = np.maximum(_first_at_least(group, filled, (epoch // DAY_US - AVG_WINDOW_DAYS + 1) * DAY_US), group_start)
+    lo_20m = np.maximum(_first_at_least(group, filled, epoch - VELOCITY_WINDOW_US), group_start)
+    lo_30d, lo_20m = np.minimum(lo_30d, hist_end), np.minimum(lo_20m, hist_end)
+    count_30d = np.where(valid, c_valid[hist_end] - c_valid[lo_30d], 0)
+    cents_30d = c_cents[hist_end] - c_cents[lo_30d]
+    avg_30d = np.where(count_30d > 0, cents_30d / np.maximum(count_30d, 1) / 100, 0.0)
+    withdrawals_20m = np.where(valid, c_withdrawal[hist_end] - c_withdrawal[lo_20m], 0)
+
+    has_history = hist_end > group_start
+    features = {
+        "withdrawals_20m_count": withdrawals_20m,
+        "avg_amount_30d": avg_30d,
+        **_batch_velocity(columns, group, hist_end, epoch, valid),
+        "_user_key": group,
+        "_hist_end": hist_end,
+        "_has_history": has_history,
+    }
+    for feature, source in _HISTORY_FEATURE_FIELDS.items():
+        values = columns[source]
+        if feature.startswith("last_"):
+            features[feature] = np.where(has_history, values[np.maximum(hist_end - 1, 0)], None)
+        else:
+            truthy = _truthy(values)
+            c_truthy = np.concatenate([[0], np.cumsum(truthy)])
+            features[f"_{feature}_nonempty"] = c_truthy[hist_end] - c_truthy[group_start] > 0
+    return features
+
+
+def _batch_velocity(columns: dict, group: "np.ndarray", hist_end: "np.ndarray", epoch: "np.ndarray", valid: "np.ndarray") -> dict:
+    """Velocity facts per row, matching history_velocity: per (user, key value), the history rows in the window's buckets."""
+    n = len(group)
+    cents = np.rint(columns["amount"] * 100).astype(np.int64)
+    facts = {}
+    for prefix, field_name in VELOCITY_KEYS.items():
+        values = columns[field_name]
+        keyed = valid & _truthy(values)
+        _, code = np.unique(np.array([f"{g}\x00{v}" for g, v in zip(group, values)], dtype=object), return_inverse=True)
+        # Keyed rows grouped by (user, value), in timestamp order within a group
+        rows = np.flatnonzero(keyed)
+        rows = rows[np.lexsort((rows, code[rows]))]
+        c_cents = np.concatenate([[0], np.cumsum(cents[rows])])
+        hi = _first_at_least(code[rows], rows, hist_end, code)
+        for window in VELOCITY_WINDOWS:
+            width = velocity_bucket_us(window)
+            lo = np.minimum(_first_at_least(code[rows], epoch[rows], (epoch // width - VELOCITY_BUCKETS + 1) * width, code), hi)
+            facts[f"{prefix}_count_{window}"] = np.where(keyed, hi - lo, 0)
+            facts[f"{prefix}_amount_{window}"] = np.where(keyed, c_cents[hi] - c_cents[lo], 0) / 100
+    return facts
+
+
+def _vector_feature_at_least(rule: dict, facts: dict, columns: dict):
+    value = facts[rule["feature"]]
+    return value, value >= rule["threshold"]
+
+
+def _vector_amount_ratio_at_least(rule: dict, facts: dict, columns: dict):
+    denominator = facts[rule["feature"]]
+    ratio = facts["amount"] / np.where(denominator == 0, 1, denominator)
+    return ratio, ratio >= rule["threshold"]
+
+
+def _vector_unseen_value(rule: dict, facts: dict, columns: dict):
+    field_name, feature = rule["field"], rule["feature"]
+    values = columns[field_name]
+    seen = _seen_in_history(facts["_user_key"], columns[_HISTORY_FEATURE_FIELDS[feature]], values, facts["_hist_end"])
+    fired = _truthy(values) & ~seen
+    if rule.get("require_history", False):
+        fired &= facts[f"_{feature}_nonempty"]
+    return fired, fired
+
+
+def _vector_changed_from(rule: dict, facts: dict, columns: dict):
+    current, last = columns[rule["field"]], facts[rule["feature"]]
+    fired = _truthy(current) & _truthy(last) & (current != last)
+    return fired, fired
+
+
+def _vector_young_account_amount(rule: dict, facts: dict, columns: dict):
+    fired = (facts["account_age_days"] < rule["max_account_age_days"]) & (facts["amount"] >= rule["min_amount"])
+    return fired, fired
+
+
+# Same rule kinds as RULE_KINDS, over whole columns: (value array, fired array)
+VECTOR_RULE_KINDS = {
+    "feature_at_least": _vector_feature_at_least,
+    "amount_ratio_at_least": _vector_amount_ratio_at_least,
+    "unseen_value": _vector_unseen_value,
+    "changed_from": _vector_changed_from,
+    "young_account_amount": _vector_young_account_amount,
+}
+
+# How a kind's raw value array maps to the per-transaction signal value
+_VALUE_OUTPUT = {
+    "feature_at_least": lambda v: v.item() if hasattr(v, "item") else v,
+    "amount_ratio_at_least": lambda v: round(float(v), 2),
+}
+
+
+def score_batch(columns: dict, plan: RulePlan | None = None) -> dict:
+    """
+    Score a chunk of transactions given as columnar arrays (see columns_from_rows), sorted by
+    (user_id, timestamp). Each row's history is the earlier rows of its user within the chunk, so include
+    the preceding 30 days of each user's transactions as context and ignore their results.
+    Same signals and scores as compute_signals over the same history. Returns
+    {"plan", "risk_score", "candidate", "fired": {name: bool[]}, "value": {name: raw[]}, "features"};
+    signals_at() turns one row back into the per-transaction signal list.
+    """
+    plan = plan or current_rules()
+    missing = [c for c in BATCH_COLUMNS if c not in columns]
+    if missing:
+        raise ValueError(f"missing columns: {missing}")
+    user, ts = columns["user_id"], columns["timestamp"]
+    if len(user) > 1:
+        key_user, key_ts = user.astype(str), np.array([t or "" for t in ts], dtype=object)
+        out_of_order = (key_user[1:] < key_user[:-1]) | ((key_user[1:] == key_user[:-1]) & (key_ts[1:] < key_ts[:-1]))
+        if out_of_order.any():
+            raise ValueError("columns must be sorted by (user_id, timestamp)")
+
+    features = _batch_features(columns)
+    facts = {**features, "amount": columns["amount"], "account_age_days": columns["account_age_days"]}
+    fired, values = {}, {}
+    for rule in plan.rules:
+        config = {**rule.params, "threshold": rule.threshold}
+        values[rule.name], fired[rule.name] = VECTOR_RULE_KINDS[rule.kind](config, facts, columns)
+    score, candidate = _batch_score_and_candidate(plan, fired, len(user))
+    return {"plan": plan, "risk_score": score, "candidate": candidate, "fired": fired, "value": values, "features": features}
+
+
+def _batch_score_and_candidate(plan: RulePlan, fired: dict, n: int) -> tuple["np.ndarray", "np.ndarray"]:
+    """risk_score_and_candidate over whole columns."""
+    score = np.zeros(n, dtype=np.int64)
+    for rule in plan.rules:
+        score += np.where(fired[rule.name], rule.weight, 0)
+    score = np.clip(score, 0, 100)
+    candidate = np.where(
+        score >= plan.block_threshold,
+        "block_candidate",
+        np.where((score >= plan.review_min) & (score <= plan.review_max), "review_candidate", "approve_candidate"),
+    )
+    return score, candidate
+
+
+def override_fired(batch: dict, fired: dict[str, "np.ndarray"]) -> dict:
+    """A score_batch result with some rules' fired arrays replaced (e.g. by stored outcomes), scores recomputed."""
+    fired = {**batch["fired"], **fired}
+    score, candidate = _batch_score_and_candidate(batch["plan"], fired, len(batch["risk_score"]))
+    return {**batch, "fired": fired, "risk_score": score, "candidate": candidate}
+
+
+def signals_at(batch: dict, columns: dict, i: int) -> list[dict]:
+    """Row i of a score_batch result as the signal list compute_signals returns (explanations for fired signals only)."""
+    plan: RulePlan = batch["plan"]
+    features = batch["features"]
+    facts = {
+        "amount": float(columns["amount"][i]),
+        "currency": columns["currency"][i] if "currency" in columns else None,
+        "account_age_days": columns["account_age_days"][i].item(),
+        "device_id": columns["device_id"][i],
+        "country": columns["country"][i],
+        "psp": columns["psp"][i],
+        "withdrawals_20m_count": int(features["withdrawals_20m_count"][i]),
+        "avg_amount_30d": float(features["avg_amount_30d"][i]),
+        "last_country": features["last_country"][i],
+        **{key: features[key][i].item() for key in VELOCITY_FACT_KEYS},
+    }
+    signals = []
+    for rule in plan.rules:
+        raw = batch["value"][rule.name][i]
+        value = _VALUE_OUTPUT.get(rule.kind, bool)(raw)
+        fired = bool(batch["fired"][rule.name][i])
+        signals.append({
+            "name": rule.name,
+            "value": value,
+            "threshold": rule.threshold,
+            "weight": rule.weight,
+            "fired": fired,
+            "explanation": rule.explanation.format_map({**facts, **rule.params, "value": value})
+            if fired
+            else rule.explanation_unfired,
+        })
+    return signals
@@ -0,0 +1,138 @@
+"""Per-transaction scoring context shared by decision_service, case_service and llm_client.
+
+What the pipeline learns about a transaction (user history, linked accounts, parsed signals) is
+loaded or computed once and carried along, including through the case pack job payload.
+"""
+from dataclasses import asdict, dataclass, field
+
+from db import get_cursor
+
+CONTEXT_HISTORY_LIMIT = 50  # history / linked rows kept for case packs
+
+_TX_COLUMNS = """id, timestamp, type, amount, currency, user_id, account_age_days,
+                   country, ip_hash, device_id, psp, status"""
+
+
+def load_user_history(user_id: str, before_ts: str, limit: int = 100) -> list[dict]:
+    """The user's last `limit` transactions before before_ts, oldest first."""
+    with get_cursor() as cur:
+        cur.execute(
+            f"""
+            SELECT {_TX_COLUMNS}
+            FROM transactions
+            WHERE user_id = ? AND timestamp < ?
+            ORDER BY timestamp DESC
+            LIMIT ?
+            """,
+            (user_id, before_ts, limit),
+        )
+        rows = cur.fetchall()
+    return [dict(r) for r in reversed(rows)]
+
+
+def load_user_window(user_id: str, since_ts: str, before_ts: str) -> list[dict]:
+    """All the user's transactions with since_ts <= timestamp < before_ts, oldest first (no row limit)."""
+    with get_cursor() as cur:
+        cur.execute(
+            f"""
+            SELECT {_TX_COLUMNS}
+            FROM transactions
+            WHERE user_id = ? AND timestamp >= ? AND timestamp < ?
+            ORDER BY timestamp ASC
+            """,
+            (user_id, since_ts, before_ts),
+        )
+        rows = cur.fetchall()
+    return [dict(r) for r in rows]
+
+
+def load_user_profile(user_id: str, before_ts: str) -> dict:
+    """Devices, PSPs and last country of the user's transactions before before_ts (the features with no window)."""
+    with get_cursor() as cur:
+        cur.execute(
+            "SELECT DISTINCT device_id FROM transactions WHERE user_id = ? AND timestamp < ?",
+            (user_id, before_ts),
+        )
+        devices = {r["device_id"] for r in cur.fetchall() if r["device_id"]}
+        cur.execute(
+            "SELECT DISTINCT psp FROM transactions WHERE user_id = ? AND timestamp < ?",
+            (user_id, before_ts),
+        )
+        psps = {r["psp"] for r in cur.fetchall() if r["psp"]}
+        cur.execute(
+            "SELECT country FROM transactions WHERE user_id = ? AND timestamp < ? ORDER BY timestamp DESC LIMIT 1",
+            (user_id, before_ts),
+        )
+        row = cur.fetchone()
+    return {"known_devices": devices, "known_psps": psps, "last_country": row["country"] if row else None}
+
+
+def load_linked_context(transaction: dict, limit: int = 50) -> list[dict]:
+    """Transactions from same ip_hash or device_id (excluding current user), newest first."""
+    ip_hash = transaction.get("ip_hash")
+    device_id = transaction.get("device_id")
+    user_id = transaction.get("user_id")
+    if not ip_hash and not device_id:
+        return []
+    conditions = []
+    params = []
+    if ip_hash:
+        conditions.append("ip_hash = ?")
+        params.append(ip_hash)
+    if device_id:
+        conditions.append("device_id = ?")
+        params.append(device_id)
+    where = " OR ".join(conditions)
+    params.append(user_id)
+    with get_cursor() as cur:
+        cur.execute(
+            f"""
+            SELECT {_TX_COLUMNS}
+            FROM transactions
+            WHERE ({where}) AND user_id != ?
+            ORDER BY timestamp DESC
+            LIMIT ?
+            """,
+            (*params, limit),
+        )
+        rows = cur.fetchall()
+    return [dict(r) for r in rows]
+
+
+@dataclass
+class ScoringContext:
+    transaction: dict
+    signals: list[dict] = field(default_factory=list)
+    risk_score_base: int = 0
+    candidate: str = ""
+    routed: bool = False  # sent to the LLM by the gating policy
+    velocity_counted: bool = False  # already in the velocity counters (scored before), so not counted again
+    history: list[dict] | None = None  # user's earlier transactions, oldest first (None = not loaded)
+    linked: list[dict] | None = None  # other users on the same IP/device, newest first (None = not loaded)
+    features: dict | None = field(default=None, repr=False)  # user features the signals came from (not in payloads)
+
+    def user_history(self, limit: int = CONTEXT_HISTORY_LIMIT) -> list[dict]:
+        """Last `limit` earlier transactions of the user, loaded on first use."""
+        if self.history is None:
+            self.history = load_user_history(
+                self.transaction.get("user_id", ""), self.transaction.get("timestamp", ""), limit
+            )
+        return self.history[-limit:]
+
+    def linked_context(self, limit: int = CONTEXT_HISTORY_LIMIT) -> list[dict]:
+        """Linked-account transactions, loaded on first use."""
+        if self.linked is None:
+            self.linked = load_linked_context(self.transaction, limit)
+        return self.linked[:limit]
+
+    def to_payload(self) -> dict:
+        """JSON-safe form for job payloads (history trimmed to what case packs use)."""
+        payload = asdict(self)
+        del payload["features"]
+        if self.history is not None:
+            payload["history"] = self.history[-CONTEXT_HISTORY_LIMIT:]
+        return payload
+
+    @classmethod
+    def from_payload(cls, payload: dict) -> "ScoringContext":
+        return cls(**payload)
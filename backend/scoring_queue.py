@@ -0,0 +1,165 @@
+"""Scoring work queue over unscored transactions (scored_at IS NULL), with leased claims.
+
+Workers claim disjoint batches atomically; a claim expires after its lease so a crashed worker's rows
+are picked up again, up to SCORING_MAX_ATTEMPTS claims per transaction. Writing a decision marks the
+row scored and clears its claim (decision_service.persist_decisions).
+
+Run a worker process: python scoring_queue.py [--batch 50] [--once]
+"""
+import argparse
+import os
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from db import get_cursor, init_db, unit_of_work
+from decision_service import commit_decisions, prepare_decisions
+
+SCORING_LEASE_SECONDS = float(os.getenv("SCORING_LEASE_SECONDS", "60"))
+SCORING_MAX_ATTEMPTS = int(os.getenv("SCORING_MAX_ATTEMPTS", "5"))
+SCORING_BATCH_SIZE = int(os.getenv("SCORING_BATCH_SIZE", "50"))
+SCORING_POLL_SECONDS = float(os.getenv("SCORING_POLL_SECONDS", "1"))
+
+_TX_COLUMNS = """id, timestamp, type, amount, currency, user_id, account_age_days,
+                   country, ip_hash, device_id, psp, status"""
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def claim(limit: int = 1, lease_seconds: float = SCORING_LEASE_SECONDS) -> tuple[str, list[dict], str]:
+    """
+    Atomically lease up to `limit` of the oldest unscored, unclaimed transactions.
+    Returns (claim_token, transactions oldest first, lease expiry).
+    """
+    now = _now()
+    token = str(uuid.uuid4())
+    lease_until = (now + timedelta(seconds=lease_seconds)).isoformat()
+    with get_cursor() as cur:
+        cur.execute(
+            """
+            UPDATE transactions
+            SET claim_token = ?, claimed_until = ?, claim_attempts = claim_attempts + 1
+            WHERE id IN (
+                SELECT id FROM transactions
+                WHERE scored_at IS NULL
+                  AND (claimed_until IS NULL OR claimed_until < ?)
+                  AND claim_attempts < ?
+                ORDER BY timestamp, id
+                LIMIT ?
+            )
+            """,
+            (token, lease_until, now.isoformat(), SCORING_MAX_ATTEMPTS, limit),
+        )
+        if cur.rowcount == 0:
+            return token, [], lease_until
+        cur.execute(
+            f"SELECT {_TX_COLUMNS} FROM transactions WHERE claim_token = ? ORDER BY timestamp, id",
+            (token,),
+        )
+        rows = cur.fetchall()
+    return token, [dict(r) for r in rows], lease_until
+
+
+def release(claim_token: str, transaction_ids: list[str] | None = None) -> int:
+    """Give claimed, still unscored transactions back to the queue (counts as a failed attempt). Returns rows released."""
+    ids_filter, params = "", []
+    if transaction_ids:
+        ids_filter = f" AND id IN ({','.join('?' * len(transaction_ids))})"
+        params = list(transaction_ids)
+    with get_cursor() as cur:
+        cur.execute(
+            f"""
+            UPDATE transactions SET claim_token = NULL, claimed_until = NULL
+            WHERE claim_token = ? AND scored_at IS NULL{ids_filter}
+            """,
+            (claim_token, *params),
+        )
+        return cur.rowcount
+
+
+def score_claimed(claim_token: str, transactions: list[dict]) -> int:
+    """
+    Score a claimed batch in place (rows are not re-inserted). Rows whose lease was lost to another
+    worker are skipped. Returns the number scored.
+    """
+    if not transactions:
+        return 0
+    items, feature_updates = prepare_decisions(transactions)
+    ids = [tx["id"] for tx in transactions]
+    with unit_of_work():
+        with get_cursor() as cur:
+            # Take the write lock and confirm the claim is still ours before writing decisions
+            cur.execute(
+                f"""
+                UPDATE transactions SET claimed_until = ?
+                WHERE claim_token = ? AND scored_at IS NULL AND id IN ({','.join('?' * len(ids))})
+                """,
+                (_now().isoformat(), claim_token, *ids),
+            )
+            cur.execute(
+                f"SELECT id FROM transactions WHERE claim_token = ? AND id IN ({','.join('?' * len(ids))})",
+                (claim_token, *ids),
+            )
+            held = {r["id"] for r in cur.fetchall()}
+        items = [item for item in items if item["context"].transaction["id"] in held]
+        if not items:
+            return 0
+        if len(items) < len(ids):
+            # Feature state was folded over the whole batch; let the next lookup rebuild it
+            feature_updates = {user_id: None for user_id in feature_updates}
+        commit_decisions(items, feature_updates)
+    return len(items)
+
+
+def drain(batch_size: int = SCORING_BATCH_SIZE, once: bool = False) -> int:
+    """Worker loop: claim, score, repeat. With once=True stop when the queue is empty. Returns rows scored."""
+    scored = 0
+    while True:
+        token, transactions, _ = claim(batch_size)
+        if not transactions:
+            if once:
+                return scored
+            time.sleep(SCORING_POLL_SECONDS)
+            continue
+        try:
+            scored += score_claimed(token, transactions)
+        except Exception as e:
+            print(f"⚠️  Scoring batch {token} failed ({len(transactions)} tx): {e}")
+            release(token)
+
+
+def queue_stats() -> dict:
+    """Unscored backlog, rows under lease, rows out of attempts, and the oldest unscored timestamp."""
+    now = _now().isoformat()
+    with get_cursor() as cur:
+        cur.execute(
+            """
+            SELECT COUNT(*) AS unscored,
+                   SUM(claimed_until >= ?) AS leased,
+                   SUM(claim_attempts >= ?) AS exhausted,
+                   MIN(timestamp) AS oldest_timestamp
+            FROM transactions
+            WHERE scored_at IS NULL
+            """,
+            (now, SCORING_MAX_ATTEMPTS),
+        )
+        row = dict(cur.fetchone())
+    return {
+        "unscored": row["unscored"],
+        "leased": row["leased"] or 0,
+        "exhausted": row["exhausted"] or 0,
+        "oldest_unscored_timestamp": row["oldest_timestamp"],
+        "lease_seconds": SCORING_LEASE_SECONDS,
+        "max_attempts": SCORING_MAX_ATTEMPTS,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drain the scoring queue")
+    parser.add_argument("--batch", type=int, default=SCORING_BATCH_SIZE)
+    parser.add_argument("--once", action="store_true", help="exit when the queue is empty")
+    args = parser.parse_args()
+    init_db()
+    print(f"✅ Scored {drain(args.batch, args.once)} transactions")
@@ -170,9 +170,12 @@ def run_seed() -> dict:
     print("Clearing existing data...")
     with get_cursor() as cur:
         cur.execute("DELETE FROM audit_log")
+        cur.execute("DELETE FROM case_transactions")
         cur.execute("DELETE FROM cases")
         cur.execute("DELETE FROM risk_decisions")
         cur.execute("DELETE FROM transactions")
+        cur.execute("DELETE FROM user_features")
+        cur.execute("DELETE FROM jobs")
     
     print("Generating synthetic transactions...")
     start_dt = datetime.now(timezone.utc)
@@ -0,0 +1,225 @@
+"""Shadow (challenger) rule sets scored alongside the live rules, off the request path.
+
+Each rule file in SHADOW_RULES_PATHS is compiled like rules.json and hot-reloaded the same way.
+After a decision commits, its transaction and user features are handed to a bounded queue (dropped,
+and counted, when the queue is full); one worker thread scores them with every shadow set and stores
+one compact row per (set, transaction) in shadow_decisions. report() summarizes the flips.
+"""
+import os
+import queue
+import threading
+from datetime import datetime, timezone
+
+from db import get_cursor, unit_of_work
+from risk_engine import (
+    RISK_RULES_RELOAD_SECONDS,
+    RulePlan,
+    RuleSource,
+    compute_signals_from_features,
+    risk_score_and_candidate,
+)
+
+SHADOW_RULES_PATHS = [p.strip() for p in os.getenv("SHADOW_RULES_PATHS", "").split(",") if p.strip()]
+SHADOW_QUEUE_SIZE = int(os.getenv("SHADOW_QUEUE_SIZE", "10000"))
+SHADOW_WRITE_BATCH = int(os.getenv("SHADOW_WRITE_BATCH", "200"))
+
+_CANDIDATE_DECISIONS = {"block_candidate": "block", "review_candidate": "review", "approve_candidate": "approve"}
+
+# set name (file name without .json) -> source
+_sources = {os.path.splitext(os.path.basename(p))[0]: RuleSource(p, RISK_RULES_RELOAD_SECONDS) for p in SHADOW_RULES_PATHS}
+_queue: queue.Queue = queue.Queue(maxsize=SHADOW_QUEUE_SIZE)
+_worker: threading.Thread | None = None
+_worker_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {"queued": 0, "dropped": 0, "evaluated": 0, "errors": 0}
+_broken: set[str] = set()  # sets whose file failed to load (warned once until it loads)
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def enabled() -> bool:
+    return bool(_sources)
+
+
+def load() -> None:
+    """Compile every shadow set now (startup); a bad file is reported and that set skipped until it is fixed."""
+    for name in _sources:
+        plan = _plan(name)
+        if plan is not None:
+            print(f"✅ Shadow rule set {name}: v{plan.version} from {_sources[name].path}")
+
+
+def _plan(name: str) -> RulePlan | None:
+    try:
+        plan = _sources[name].current()
+    except ValueError as e:
+        if name not in _broken:
+            _broken.add(name)
+            print(f"⚠️  Shadow rule set {name} unavailable: {e}")
+        return None
+    _broken.discard(name)
+    return plan
+
+
+def submit(items: list[tuple[dict, dict, str, int]]) -> None:
+    """
+    Hand (transaction, features, live candidate, live base score) tuples to the shadow worker.
+    Never blocks: items that do not fit in the queue are dropped. Call after commit.
+    """
+    if not _sources:
+        return
+    _ensure_worker()
+    queued = dropped = 0
+    for item in items:
+        try:
+            _queue.put_nowait(item)
+            queued += 1
+        except queue.Full:
+            dropped += 1
+    with _stats_lock:
+        _stats["queued"] += queued
+        _stats["dropped"] += dropped
+
+
+def _ensure_worker() -> None:
+    global _worker
+    if _worker is not None:
+        return
+    with _worker_lock:
+        if _worker is None:
+            _worker = threading.Thread(target=_worker_loop, name="shadow-rules", daemon=True)
+            _worker.start()
+
+
+def _score(items: list[tuple[dict, dict, str, int]]) -> list[tuple]:
+    rows = []
+    now = _now_iso()
+    for name in _sources:
+        plan = _plan(name)
+        if plan is None:
+            continue
+        for transaction, features, live_candidate, live_score in items:
+            signals = compute_signals_from_features(transaction, features, plan)
+            score, candidate = risk_score_and_candidate(signals, plan)
+            rows.append((
+                name,
+                transaction.get("id", ""),
+                str(plan.version),
+                _CANDIDATE_DECISIONS[live_candidate],
+                live_score,
+                _CANDIDATE_DECISIONS[candidate],
+                score,
+                ",".join(s["name"] for s in signals if s["fired"]),
+                now,
+            ))
+    return rows
+
+
+def _worker_loop() -> None:
+    while True:
+        item = _queue.get()
+        if item is None:
+            return
+        items = [item]
+        stop = False
+        while len(items) < SHADOW_WRITE_BATCH:
+            try:
+                item = _queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                stop = True
+                break
+            items.append(item)
+        try:
+            rows = _score(items)
+            with unit_of_work():
+                with get_cursor() as cur:
+                    cur.executemany(
+                        """
+                        INSERT OR REPLACE INTO shadow_decisions
+                            (shadow_set, transaction_id, rules_version, live_decision, live_score,
+                             shadow_decision, shadow_score, fired, created_at)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                        """,
+                        rows,
+                    )
+            with _stats_lock:
+                _stats["evaluated"] += len(items)
+        except Exception as e:
+            with _stats_lock:
+                _stats["errors"] += len(items)
+            print(f"⚠️  Shadow scoring failed for {len(items)} transactions: {e}")
+        if stop:
+            return
+
+
+def stop_worker(timeout: float = 10.0) -> None:
+    """Score what is queued, then stop the worker (app shutdown)."""
+    global _worker
+    if _worker is None:
+        return
+    _queue.put(None)
+    _worker.join(timeout)
+    _worker = None
+
+
+def report(shadow_set: str | None = None, since: str | None = None, until: str | None = None) -> dict:
+    """
+    Per shadow set: transactions compared, live -> shadow decision flips, and rows by live/shadow decision.
+    Live decisions here are the live rules' own (before LLM adjudication), so only the rules differ.
+    """
+    conditions, params = [], []
+    for cond, value in (("shadow_set = ?", shadow_set), ("created_at >= ?", since), ("created_at < ?", until)):
+        if value is not None:
+            conditions.append(cond)
+            params.append(value)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    with get_cursor() as cur:
+        cur.execute(
+            f"""
+            SELECT shadow_set, live_decision, shadow_decision, COUNT(*) AS n,
+                   SUM(shadow_score - live_score) AS score_delta, MAX(rules_version) AS rules_version
+            FROM shadow_decisions
+            {where}
+            GROUP BY shadow_set, live_decision, shadow_decision
+            """,
+            params,
+        )
+        rows = cur.fetchall()
+    sets: dict[str, dict] = {}
+    for r in rows:
+        entry = sets.setdefault(r["shadow_set"], {
+            "rules_version": r["rules_version"],
+            "compared": 0,
+            "flipped": 0,
+            "flips": {},
+            "live": {},
+            "shadow": {},
+            "avg_score_delta": 0.0,
+        })
+        entry["compared"] += r["n"]
+        entry["avg_score_delta"] += r["score_delta"] or 0
+        entry["live"][r["live_decision"]] = entry["live"].get(r["live_decision"], 0) + r["n"]
+        entry["shadow"][r["shadow_decision"]] = entry["shadow"].get(r["shadow_decision"], 0) + r["n"]
+        if r["live_decision"] != r["shadow_decision"]:
+            entry["flipped"] += r["n"]
+            entry["flips"][f"{r['live_decision']}->{r['shadow_decision']}"] = r["n"]
+    for entry in sets.values():
+        entry["avg_score_delta"] = round(entry["avg_score_delta"] / entry["compared"], 2) if entry["compared"] else 0.0
+        entry["flip_rate"] = round(entry["flipped"] / entry["compared"], 4) if entry["compared"] else None
+        entry["flips"] = dict(sorted(entry["flips"].items(), key=lambda kv: -kv[1]))
+    return {"sets": sets, "stats": shadow_stats()}
+
+
+def shadow_stats() -> dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    return {
+        "sets": {name: (s.plan.version if s.plan else None) for name, s in _sources.items()},
+        "queue_depth": _queue.qsize(),
+        "queue_size": SHADOW_QUEUE_SIZE,
+        **stats,
+    }
@@ -0,0 +1,63 @@
+"""Test setup: a throwaway database and no LLM key, set before any backend module is imported."""
+import os
+import sys
+import tempfile
+
+os.environ["DATABASE_PATH"] = os.path.join(tempfile.mkdtemp(prefix="fraudops-test-"), "fraudops.db")
+os.environ["GEMINI_API_KEY"] = ""
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+
+import velocity  # noqa: E402
+from db import get_cursor, init_db  # noqa: E402
+
+_TABLES = ("backfill_checkpoints", "backfill_runs", "jobs", "case_transactions", "cases", "risk_decisions", "audit_log", "user_features", "transactions")
+
+
+@pytest.fixture
+def db():
+    """Fresh tables for each test."""
+    init_db()
+    with get_cursor() as cur:
+        for table in _TABLES:
+            cur.execute(f"DELETE FROM {table}")
+    yield
+
+
+@pytest.fixture
+def counters(db):
+    """Empty velocity counters (rebuilt from the emptied tables)."""
+    velocity.rebuild()
+
+
+@pytest.fixture
+def client(db):
+    """API test client. Startup hooks do not run: no background workers."""
+    from fastapi.testclient import TestClient
+
+    import case_service
+    import main
+
+    case_service._detail_cache.clear()  # keyed by case version, which restarts with the emptied tables
+    return TestClient(main.app)
+
+
+@pytest.fixture
+def add_transaction(db):
+    """Insert a transactions row (defaults for the columns not given)."""
+    return _insert_transaction
+
+
+def _insert_transaction(tx: dict) -> None:
+    with get_cursor() as cur:
+        cur.execute(
+            """
+            INSERT INTO transactions (id, timestamp, type, amount, currency, user_id, account_age_days,
+                                      country, ip_hash, device_id, psp, status)
+            VALUES (:id, :timestamp, :type, :amount, :currency, :user_id, :account_age_days,
+                    :country, :ip_hash, :device_id, :psp, :status)
+            """,
+            {"currency": "USD", "account_age_days": 100, "country": "US", "ip_hash": None, "device_id": None,
+             "psp": "stripe", "status": "pending", **tx},
+        )
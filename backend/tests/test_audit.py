@@ -0,0 +1,20 @@
+"""Audit log: stream resume (events_after) follows commit order, not created_at."""
+import audit_service
+from db import unit_of_work
+
+
+def test_resume_includes_events_stamped_before_but_committed_after(db, monkeypatch):
+    first = audit_service.append("system", "CASE_CREATED", {"case_id": "case_1"})
+    # A writer that stamped created_at before `first` committed, but committed after it
+    monkeypatch.setattr(audit_service, "_now_iso", lambda: "2000-01-01T00:00:00+00:00")
+    with unit_of_work():
+        late = audit_service.append("system", "CASE_ACTION", {"case_id": "case_1"})
+        batch = audit_service.append_many([("system", "CASE_PACK_READY", {"case_id": "case_1"}),
+                                           ("analyst", "CASE_ACTION", {"case_id": "case_1"})])
+
+    resumed = audit_service.events_after(first)
+
+    assert [e["event_id"] for e in resumed] == [late, *batch]
+    assert [e["event_id"] for e in audit_service.events_after(late, {"CASE_ACTION"})] == [batch[1]]
+    assert audit_service.events_after(batch[-1]) == []
+    assert audit_service.events_after("unknown") is None
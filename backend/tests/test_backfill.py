@@ -0,0 +1,92 @@
+"""Historical re-score (backfill) against decisions scored live."""
+import json
+
+import backfill
+import decision_service
+from db import get_cursor
+from models import LLMDecisionOutput, RiskDecision
+from risk_engine import current_rules, risk_score_and_candidate
+from scoring_context import ScoringContext
+
+
+def test_backfill_keeps_live_device_velocity_outcomes(counters, add_transaction):
+    # Card testing: a new card (user) every few seconds on one device; the live counters see them all
+    for i in range(5):
+        tx = {"id": f"tx_{i}", "timestamp": f"2026-10-01T12:00:{10 + 5 * i:02d}+00:00", "type": "deposit",
+              "amount": 5.0, "user_id": f"card_{i}", "device_id": "dev_1"}
+        add_transaction(tx)
+        decision_service.run_decision(tx)
+    with get_cursor() as cur:
+        cur.execute("SELECT id, status FROM transactions ORDER BY id")
+        live = {r["id"]: r["status"] for r in cur.fetchall()}
+    assert live["tx_4"] != live["tx_0"]  # the burst raised the later ones
+
+    run_id = backfill.start_run("2026-10-01T00:00:00+00:00", "2026-10-02T00:00:00+00:00", dry_run=False, partitions=1)
+    report = backfill._run_partition(run_id, 0, [f"card_{i}" for i in range(5)])
+
+    assert report["changed"] == 0
+    with get_cursor() as cur:
+        cur.execute("SELECT id, status FROM transactions ORDER BY id")
+        assert {r["id"]: r["status"] for r in cur.fetchall()} == live
+        cur.execute("SELECT signals_json FROM risk_decisions d JOIN transactions t ON t.latest_decision_id = d.id WHERE t.id = 'tx_4'")
+        signals = {s["name"]: s for s in json.loads(cur.fetchone()["signals_json"])}
+    assert signals["device_burst_1m"]["fired"]
+
+
+def _escalated_by_llm(add_transaction, monkeypatch) -> None:
+    """tx_1 scored by the rules (approve), then escalated to block by the LLM refinement."""
+    tx = {"id": "tx_1", "timestamp": "2026-10-01T12:00:00+00:00", "type": "withdrawal", "amount": 900.0,
+          "user_id": "user_1", "device_id": "dev_1"}
+    add_transaction(tx)
+    decision_service.run_decision(tx)
+    with get_cursor() as cur:
+        cur.execute("SELECT d.* FROM risk_decisions d JOIN transactions t ON t.latest_decision_id = d.id WHERE t.id = 'tx_1'")
+        row = dict(cur.fetchone())
+    assert row["decision"] == "approve"
+    ctx = ScoringContext(tx)
+    ctx.signals = json.loads(row["signals_json"])
+    ctx.risk_score_base, ctx.candidate = risk_score_and_candidate(ctx.signals)
+    ctx.routed = True
+    decision = RiskDecision(**row)
+    output = LLMDecisionOutput(decision="block", risk_score=90, rationale="mule pattern", top_signals=[], confidence="high")
+    monkeypatch.setattr(decision_service, "adjudicate_decision", lambda *args: output)
+    decision_service._refine_decision(ctx, decision, None)
+
+
+def _latest(transaction_id: str) -> dict:
+    with get_cursor() as cur:
+        cur.execute(
+            "SELECT t.status, d.decision, d.risk_score FROM transactions t JOIN risk_decisions d ON d.id = t.latest_decision_id WHERE t.id = ?",
+            (transaction_id,),
+        )
+        return dict(cur.fetchone())
+
+
+def test_backfill_compares_with_the_rule_outcome_not_the_llm_decision(counters, add_transaction, monkeypatch):
+    _escalated_by_llm(add_transaction, monkeypatch)
+
+    run_id = backfill.start_run("2026-10-01T00:00:00+00:00", "2026-10-02T00:00:00+00:00", dry_run=False, partitions=1)
+    report = backfill._run_partition(run_id, 0, ["user_1"])
+
+    assert report["changed"] == 0
+    assert report["adjudicated"] == {}
+    assert _latest("tx_1") == {"status": "block", "decision": "block", "risk_score": 90}
+
+
+def test_backfill_reports_llm_decisions_the_new_rules_disagree_with(counters, add_transaction, monkeypatch):
+    _escalated_by_llm(add_transaction, monkeypatch)
+    # New rules: a new device alone is now worth a review
+    config = json.loads(json.dumps(current_rules().config))
+    for signal in config["signals"]:
+        if signal["name"] == "new_device":
+            signal["weight"] = 50
+
+    run_id = backfill.start_run("2026-10-01T00:00:00+00:00", "2026-10-02T00:00:00+00:00", dry_run=False, partitions=1)
+    with get_cursor() as cur:
+        cur.execute("UPDATE backfill_runs SET rules_json = ? WHERE run_id = ?", (json.dumps(config), run_id))
+    report = backfill._run_partition(run_id, 0, ["user_1"])
+
+    assert report["changed"] == 0
+    assert report["adjudicated"] == {"block->review": 1}
+    assert backfill.run_status(run_id)["adjudicated"] == {"block->review": 1}
+    assert _latest("tx_1") == {"status": "block", "decision": "block", "risk_score": 90}
@@ -0,0 +1,74 @@
+"""risk_engine.score_batch (backfill, shadow) against the per-transaction path (compute_signals), signal for signal."""
+import random
+from datetime import datetime, timedelta, timezone
+from itertools import groupby
+
+import pytest
+
+from risk_engine import (
+    VELOCITY_FACT_KEYS,
+    build_features,
+    columns_from_rows,
+    compute_signals,
+    risk_score_and_candidate,
+    score_batch,
+    signals_at,
+)
+from seed import seed_fraudulent_transactions, seed_normal_users
+
+
+def _random_transactions(n_users: int) -> list[dict]:
+    """Dense, messy histories: bursts, equal timestamps, missing optional fields, cent amounts."""
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    txs = []
+    for u in range(n_users):
+        t = start
+        for _ in range(random.randint(1, 40)):
+            if random.random() > 0.2:  # 20% share the previous timestamp
+                t += timedelta(seconds=random.choice([4, 20, 55, 60, 180, 420, 1800, 36000, 86400, 1200000, 3000000]))
+            txs.append({
+                "id": f"tx_{len(txs)}",
+                "timestamp": t.isoformat(),
+                "type": random.choice(["deposit", "withdrawal", "withdrawal", "trade"]),
+                "amount": random.choice([round(random.uniform(1, 5000), 2), 1000.0, 300.0, 100.0]),
+                "currency": "USD",
+                "user_id": f"user_{u:03d}",
+                "account_age_days": random.choice([None, 0, 5, 29, 30, 400]),
+                "country": random.choice(["US", "GB", "NG", None]),
+                "device_id": random.choice(["dev_a", "dev_b", "dev_c", None, ""]),
+                "ip_hash": random.choice(["ip_a", "ip_b", None]),
+                "psp": random.choice(["stripe", "adyen", None]),
+            })
+    return txs
+
+
+def _mismatches(rows: list[dict]) -> list[str]:
+    """Score rows both ways; returns a description of each transaction that differs."""
+    rows = sorted(rows, key=lambda r: (r["user_id"], r["timestamp"]))
+    columns = columns_from_rows(rows)
+    batch = score_batch(columns)
+    mismatches = []
+    i = 0
+    for _, user_rows in groupby(rows, key=lambda r: r["user_id"]):
+        user_rows = list(user_rows)
+        for tx in user_rows:
+            expected = compute_signals(tx, user_rows)
+            got = signals_at(batch, columns, i)
+            score = (int(batch["risk_score"][i]), str(batch["candidate"][i]))
+            features = build_features(tx, user_rows)
+            velocity_ok = all(batch["features"][k][i].item() == features[k] for k in VELOCITY_FACT_KEYS)
+            if got != expected or score != risk_score_and_candidate(expected) or not velocity_ok:
+                mismatches.append(f"{tx['id']}: expected {expected} {risk_score_and_candidate(expected)}, got {got} {score}")
+            i += 1
+    return mismatches
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_score_batch_matches_compute_signals(seed):
+    random.seed(seed)
+    now = datetime.now(timezone.utc)
+    rows = seed_normal_users(None, now) + seed_fraudulent_transactions(None, now) + _random_transactions(30)
+
+    mismatches = _mismatches(rows)
+
+    assert not mismatches, f"{len(mismatches)} of {len(rows)} differ, e.g. {mismatches[:3]}"
@@ -0,0 +1,180 @@
+"""Analyst actions on cases, single and bulk: which transactions change and which case versions move."""
+import json
+
+import pytest
+
+import case_service
+import decision_service
+from db import get_cursor, unit_of_work
+from scoring_context import ScoringContext
+
+
+def _cross_user_case(add_transaction) -> str:
+    """An open case on user_1 that also holds user_1's second transaction and user_2's, linked by device."""
+    base = {"timestamp": "2026-10-01T12:00:00+00:00", "type": "withdrawal", "amount": 900.0, "device_id": "dev_1"}
+    add_transaction({**base, "id": "tx_a1", "user_id": "user_1"})
+    add_transaction({**base, "id": "tx_a2", "user_id": "user_1", "timestamp": "2026-10-01T12:05:00+00:00"})
+    add_transaction({**base, "id": "tx_b1", "user_id": "user_2", "timestamp": "2026-10-01T12:10:00+00:00"})
+    with get_cursor() as cur:
+        cur.execute(
+            "INSERT INTO cases (case_id, primary_transaction_id, status, created_at) VALUES ('case_1', 'tx_a1', 'open', ?)",
+            (base["timestamp"],),
+        )
+        cur.executemany(
+            "INSERT INTO case_transactions (case_id, transaction_id, added_at) VALUES ('case_1', ?, ?)",
+            [("tx_a1", "2026-10-01T12:00:00"), ("tx_a2", "2026-10-01T12:05:00"), ("tx_b1", "2026-10-01T12:10:00")],
+        )
+    return "case_1"
+
+
+def _statuses() -> dict:
+    with get_cursor() as cur:
+        cur.execute("SELECT id, status FROM transactions")
+        return {r["id"]: r["status"] for r in cur.fetchall()}
+
+
+def _last_action_audit() -> dict:
+    with get_cursor() as cur:
+        cur.execute("SELECT payload_json FROM audit_log WHERE event_type = 'CASE_ACTION' ORDER BY rowid DESC LIMIT 1")
+        return json.loads(cur.fetchone()["payload_json"])
+
+
+def test_action_leaves_other_users_transactions_alone(add_transaction):
+    case_id = _cross_user_case(add_transaction)
+
+    case_service.apply_action(case_id, "block", "confirmed fraud")
+
+    assert _statuses() == {"tx_a1": "blocked", "tx_a2": "blocked", "tx_b1": "pending"}
+    assert _last_action_audit()["transaction_ids"] == ["tx_a1", "tx_a2"]
+
+
+def test_bulk_action_leaves_other_users_transactions_alone(add_transaction):
+    case_id = _cross_user_case(add_transaction)
+
+    summary = case_service.apply_bulk_action("approve", None, case_ids=[case_id])
+
+    assert summary["updated_transactions"] == 2
+    assert _statuses() == {"tx_a1": "approved", "tx_a2": "approved", "tx_b1": "pending"}
+    assert _last_action_audit()["transaction_ids"] == ["tx_a1", "tx_a2"]
+
+
+def test_rescoring_a_case_transaction_bumps_the_case_version(add_transaction):
+    case_id = _cross_user_case(add_transaction)
+    before = case_service.get_case(case_id)["version"]
+    ctx = ScoringContext({"id": "tx_b1", "user_id": "user_2"})
+    ctx.signals, ctx.candidate, ctx.risk_score_base, ctx.routed = [], "approve_candidate", 10, False
+
+    with unit_of_work():
+        decision_service.persist_decisions([(decision_service._build_decision(ctx, None), ctx.candidate)])
+
+    assert case_service.get_case(case_id)["version"] == before + 1
+
+
+def _shared_transaction_cases(add_transaction) -> None:
+    """tx_1 flagged twice: in case_1 (its first flag) and case_2 (opened on a re-score)."""
+    add_transaction({"id": "tx_1", "timestamp": "2026-10-01T12:00:00+00:00", "type": "withdrawal", "amount": 900.0,
+                     "user_id": "user_1", "status": "review"})
+    with get_cursor() as cur:
+        cur.executemany(
+            "INSERT INTO cases (case_id, primary_transaction_id, status, created_at) VALUES (?, 'tx_1', 'open', ?)",
+            [("case_1", "2026-10-01T12:00:00"), ("case_2", "2026-10-02T12:00:00")],
+        )
+        cur.executemany(
+            "INSERT INTO case_transactions (case_id, transaction_id, added_at) VALUES (?, 'tx_1', ?)",
+            [("case_1", "2026-10-01T12:00:00"), ("case_2", "2026-10-02T12:00:00")],
+        )
+
+
+def test_action_through_another_case_changes_the_etag(client, add_transaction):
+    _shared_transaction_cases(add_transaction)
+    etag = client.get("/cases/case_1").headers["etag"]
+    assert client.get("/cases/case_1", headers={"If-None-Match": etag}).status_code == 304
+
+    assert client.post("/cases/case_2/action", json={"action": "block"}).status_code == 200
+
+    response = client.get("/cases/case_1", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+    assert response.json()["transaction"]["status"] == "blocked"
+
+
+
+def test_bulk_action_through_another_case_changes_the_etag(client, add_transaction):
+    _shared_transaction_cases(add_transaction)
+    etag = client.get("/cases/case_1").headers["etag"]
+
+    assert client.post("/cases/actions/bulk", json={"action": "approve", "case_ids": ["case_2"]}).status_code == 200
+
+    response = client.get("/cases/case_1", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["transaction"]["status"] == "approved"
+
+
+def _cases(add_transaction, count: int) -> list[str]:
+    """Open cases case_0..case_{count-1} (one transaction each), created a day apart; every other one high confidence."""
+    with get_cursor() as cur:
+        for i in range(count):
+            add_transaction({"id": f"tx_{i}", "timestamp": f"2026-10-{i + 1:02d}T12:00:00+00:00", "type": "withdrawal",
+                             "amount": 900.0, "user_id": f"user_{i}", "status": "review"})
+            cur.execute(
+                "INSERT INTO cases (case_id, primary_transaction_id, status, confidence, created_at) VALUES (?, ?, 'open', ?, ?)",
+                (f"case_{i}", f"tx_{i}", "high" if i % 2 else "low", f"2026-10-{i + 1:02d}T12:00:00"),
+            )
+            cur.execute(
+                "INSERT INTO case_transactions (case_id, transaction_id, added_at) VALUES (?, ?, ?)",
+                (f"case_{i}", f"tx_{i}", f"2026-10-{i + 1:02d}T12:00:00"),
+            )
+    return [f"case_{i}" for i in range(count)]
+
+
+def _bulk_audit(bulk_action_id: str) -> list[dict]:
+    with get_cursor() as cur:
+        cur.execute("SELECT payload_json FROM audit_log WHERE event_type = 'CASE_ACTION'")
+        payloads = [json.loads(r["payload_json"]) for r in cur.fetchall()]
+    return [p for p in payloads if p.get("bulk_action_id") == bulk_action_id]
+
+
+def test_bulk_action_by_case_ids_reports_missing_ones(add_transaction):
+    _cases(add_transaction, 3)
+
+    summary = case_service.apply_bulk_action("block", "ring", case_ids=["case_0", "case_2", "case_x", "case_0"])
+
+    assert summary["matched"] == 2
+    assert sorted(summary["case_ids"]) == ["case_0", "case_2"]
+    assert summary["not_found"] == ["case_x"]
+    assert summary["updated_transactions"] == 2
+    assert _statuses() == {"tx_0": "blocked", "tx_1": "review", "tx_2": "blocked"}
+    audit = _bulk_audit(summary["bulk_action_id"])
+    assert sorted(p["case_id"] for p in audit) == ["case_0", "case_2"]
+    assert all(p["note"] == "ring" and p["action"] == "block" for p in audit)
+
+
+def test_bulk_action_by_filter(add_transaction):
+    _cases(add_transaction, 4)
+
+    summary = case_service.apply_bulk_action(
+        "approve", None, filters={"status": "open", "confidence": "high", "created_from": "2026-10-02T00:00:00"}
+    )
+
+    assert sorted(summary["case_ids"]) == ["case_1", "case_3"]
+    assert summary["not_found"] == []
+    assert _statuses() == {"tx_0": "review", "tx_1": "approved", "tx_2": "review", "tx_3": "approved"}
+    assert len(_bulk_audit(summary["bulk_action_id"])) == 2
+    assert case_service.get_case("case_1")["status"] == "closed"
+    assert case_service.get_case("case_0")["status"] == "open"
+
+
+def test_bulk_action_over_the_cap_changes_nothing(add_transaction, monkeypatch):
+    _cases(add_transaction, 3)
+    monkeypatch.setattr(case_service, "CASE_BULK_MAX_CASES", 2)
+    versions = {c: case_service.get_case(c)["version"] for c in ("case_0", "case_1", "case_2")}
+
+    with pytest.raises(ValueError):
+        case_service.apply_bulk_action("block", None, filters={"status": "open"})
+
+    assert _statuses() == {"tx_0": "review", "tx_1": "review", "tx_2": "review"}
+    assert {c: case_service.get_case(c)["version"] for c in versions} == versions
+    with get_cursor() as cur:
+        cur.execute("SELECT COUNT(*) FROM audit_log WHERE event_type = 'CASE_ACTION'")
+        assert cur.fetchone()[0] == 0
+    assert case_service.apply_bulk_action("block", None, case_ids=["case_0", "case_1"])["matched"] == 2
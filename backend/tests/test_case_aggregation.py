@@ -0,0 +1,53 @@
+"""Case aggregation (CASE_AGGREGATION_ENABLED): per-user cases, cross-referenced across users on a shared device."""
+import case_service
+import decision_service
+from db import get_cursor, unit_of_work
+from scoring_context import ScoringContext
+
+
+def _flag(add_transaction, tx_id: str, user_id: str, minute: int) -> str:
+    """A flagged (review) transaction on dev_1 handed to open_or_attach_case. Returns its case_id."""
+    tx = {"id": tx_id, "timestamp": f"2026-10-01T12:{minute:02d}:00+00:00", "type": "withdrawal", "amount": 900.0,
+          "currency": "USD", "user_id": user_id, "device_id": "dev_1"}
+    add_transaction({**tx, "status": "review"})
+    ctx = ScoringContext(tx)
+    ctx.signals, ctx.candidate, ctx.risk_score_base, ctx.routed = [], "review_candidate", 60, False
+    with unit_of_work():
+        return case_service.open_or_attach_case(ctx, decision_service._build_decision(ctx, None))
+
+
+def _case_transactions() -> dict:
+    with get_cursor() as cur:
+        cur.execute("SELECT case_id, transaction_id FROM case_transactions ORDER BY added_at, transaction_id")
+        by_case: dict[str, list[str]] = {}
+        for r in cur.fetchall():
+            by_case.setdefault(r["case_id"], []).append(r["transaction_id"])
+        return by_case
+
+
+def test_other_users_on_the_device_get_their_own_resolvable_case(add_transaction, monkeypatch):
+    monkeypatch.setattr(case_service, "CASE_AGGREGATION_ENABLED", True)
+    monkeypatch.setattr(case_service, "CASE_AGGREGATION_KEYS", ["user_id", "device_id", "ip_hash"])
+
+    case_a = _flag(add_transaction, "tx_a1", "user_a", 0)
+    assert _flag(add_transaction, "tx_a2", "user_a", 5) == case_a
+    case_b = _flag(add_transaction, "tx_b1", "user_b", 10)
+
+    assert case_b != case_a
+    assert _case_transactions() == {case_a: ["tx_a1", "tx_a2"], case_b: ["tx_b1"]}
+    evidence_a = case_service.get_case(case_a)["evidence"]
+    evidence_b = case_service.get_case(case_b)["evidence"]
+    assert any(case_b in e["item"] and e["transaction_ids"] == ["tx_b1"] for e in evidence_a)
+    assert any(case_a in e["item"] and e["transaction_ids"] == ["tx_a2"] for e in evidence_b)
+
+    case_service.apply_action(case_b, "block", "mule account")
+
+    with get_cursor() as cur:
+        cur.execute("SELECT id, status FROM transactions ORDER BY id")
+        assert {r["id"]: r["status"] for r in cur.fetchall()} == {"tx_a1": "review", "tx_a2": "review", "tx_b1": "blocked"}
+
+
+def test_aggregation_is_off_by_default(add_transaction):
+    assert not case_service.CASE_AGGREGATION_ENABLED
+    first = _flag(add_transaction, "tx_a1", "user_a", 0)
+    assert _flag(add_transaction, "tx_a2", "user_a", 5) != first
@@ -0,0 +1,56 @@
+"""POST /transactions/ingest and /transactions/ingest/batch."""
+import random
+from datetime import datetime, timedelta, timezone
+
+
+def _burst(prefix: str) -> list[dict]:
+    """Three users interleaved on a shared device and IP, timestamps shuffled (out of order)."""
+    start = datetime(2026, 10, 1, 12, tzinfo=timezone.utc)
+    rng = random.Random(7)
+    txs = []
+    for i in range(24):
+        user = i % 3
+        txs.append({
+            "id": f"{prefix}tx_{i:02d}",
+            "timestamp": (start + timedelta(seconds=40 * i)).isoformat(),
+            "type": "withdrawal" if i % 4 else "deposit",
+            "amount": [50.0, 900.0, 2500.0][i % 3] * (1 + i // 12),
+            "user_id": f"{prefix}user_{user}",
+            "account_age_days": [3, 200, 40][user],
+            "country": "NG" if i in (13, 20) else "US",
+            "device_id": f"{prefix}dev_{'shared' if i % 2 else user}",
+            "ip_hash": f"{prefix}ip_1",
+            "psp": "adyen" if i == 17 else "stripe",
+        })
+    rng.shuffle(txs)
+    return txs
+
+
+def _outcome(result: dict) -> tuple:
+    decision = result["decision"]
+    return decision["decision"], decision["risk_score"], decision["signals_json"], result["case_id"] is not None
+
+
+def test_batch_results_are_in_input_order(client, counters):
+    txs = _burst("")
+
+    response = client.post("/transactions/ingest/batch", json={"transactions": txs})
+
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [r["transaction"]["id"] for r in results] == [t["id"] for t in txs]
+    assert [r["decision"]["transaction_id"] for r in results] == [t["id"] for t in txs]
+
+
+def test_batch_matches_ingesting_one_by_one(client, counters):
+    # Same burst twice under different user/device/IP names, so the two runs share no features
+    batch = client.post("/transactions/ingest/batch", json={"transactions": _burst("a_")}).json()["results"]
+    singles = [
+        client.post("/transactions/ingest", json=tx).json()
+        for tx in sorted(_burst("b_"), key=lambda t: t["timestamp"])
+    ]
+
+    by_batch = {r["transaction"]["id"][2:]: _outcome(r) for r in batch}
+    by_single = {r["transaction"]["id"][2:]: _outcome(r) for r in singles}
+    assert by_batch == by_single
+    assert {decision for decision, *_ in by_batch.values()} != {"approve"}  # the burst flags some
@@ -0,0 +1,51 @@
+"""Job queue: kinds with dedicated workers, and lease renewal by long-running handlers."""
+import job_queue
+from db import get_cursor, unit_of_work
+
+
+def _register(monkeypatch, kind: str, handler, dedicated_workers: int = 0) -> None:
+    monkeypatch.setattr(job_queue, "_handlers", dict(job_queue._handlers))
+    monkeypatch.setattr(job_queue, "_dedicated", dict(job_queue._dedicated))
+    job_queue.register_handler(kind, handler, dedicated_workers=dedicated_workers)
+
+
+def _enqueue(kind: str) -> str:
+    with unit_of_work():
+        return job_queue.enqueue(kind, {})
+
+
+def _job(job_id: str) -> dict:
+    with get_cursor() as cur:
+        cur.execute("SELECT status, locked_until FROM jobs WHERE id = ?", (job_id,))
+        return dict(cur.fetchone())
+
+
+def test_dedicated_kind_is_not_run_by_shared_workers(db, monkeypatch):
+    ran = []
+    _register(monkeypatch, "slow", lambda payload: ran.append("slow"), dedicated_workers=1)
+    job_id = _enqueue("slow")
+
+    assert job_queue.run_one() is False
+    assert _job(job_id)["status"] == "queued"
+    assert job_queue.run_one("slow") is True
+    assert ran == ["slow"] and _job(job_id)["status"] == "done"
+
+
+def test_handler_can_renew_its_lease(db, monkeypatch):
+    seen = {}
+
+    def handler(payload):
+        lease = job_queue.current_lease()
+        with get_cursor() as cur:
+            cur.execute("UPDATE jobs SET locked_until = '2000-01-01T00:00:00+00:00' WHERE id = ?", (lease[0],))
+        with unit_of_work():
+            seen["renewed"] = job_queue.renew_lease(*lease)
+        seen["job"] = _job(lease[0])
+
+    _register(monkeypatch, "long", handler)
+    _enqueue("long")
+
+    assert job_queue.run_one() is True
+    assert seen["renewed"] is True
+    assert seen["job"]["status"] == "running" and seen["job"]["locked_until"] > "2000-01-01T00:00:00+00:00"
+    assert job_queue.current_lease() is None
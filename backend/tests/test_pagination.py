@@ -0,0 +1,68 @@
+"""Keyset pagination of /cases and /audit (X-Next-Cursor), with rows sharing created_at across pages."""
+from db import get_cursor
+
+
+def _pages(client, path: str, params: dict) -> list[list[dict]]:
+    """Follow X-Next-Cursor to the end; returns every page."""
+    pages, cursor = [], None
+    while True:
+        response = client.get(path, params={**params, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200
+        pages.append(response.json())
+        cursor = response.headers.get("x-next-cursor")
+        if cursor is None:
+            return pages
+        assert len(pages) < 50
+
+
+def test_cases_pages_have_no_duplicates_or_gaps(client):
+    # 14 cases over 4 timestamps: groups of 4 straddle every 3-row page boundary
+    with get_cursor() as cur:
+        cur.executemany(
+            "INSERT INTO cases (case_id, primary_transaction_id, status, created_at) VALUES (?, ?, ?, ?)",
+            [
+                (f"case_{i:02d}", f"tx_{i}", "closed" if i % 5 == 4 else "open", f"2026-10-0{1 + i // 4}T12:00:00")
+                for i in range(14)
+            ],
+        )
+    expected = sorted(
+        ((f"2026-10-0{1 + i // 4}T12:00:00", f"case_{i:02d}") for i in range(14) if i % 5 != 4), reverse=True
+    )
+
+    pages = _pages(client, "/cases", {"limit": 3, "status": "open"})
+
+    served = [(c["created_at"], c["case_id"]) for page in pages for c in page]
+    assert served == expected
+    assert all(len(page) == 3 for page in pages[:-1])
+    assert len(pages) == -(-len(expected) // 3)
+
+
+def test_audit_pages_have_no_duplicates_or_gaps(client):
+    # 12 events at 3 instants from two actors; the filter keeps 8 of them
+    with get_cursor() as cur:
+        cur.executemany(
+            "INSERT INTO audit_log (event_id, actor, event_type, payload_json, created_at) VALUES (?, ?, 'CASE_ACTION', '{}', ?)",
+            [(f"ev_{i:02d}", "analyst" if i % 3 else "system", f"2026-10-01T12:00:0{i // 4}") for i in range(12)],
+        )
+    expected = sorted(
+        ((f"2026-10-01T12:00:0{i // 4}", f"ev_{i:02d}") for i in range(12) if i % 3), reverse=True
+    )
+
+    pages = _pages(client, "/audit", {"limit": 3, "actor": "analyst", "event_type": "CASE_ACTION"})
+
+    served = [(e["created_at"], e["event_id"]) for page in pages for e in page]
+    assert served == expected
+    assert [len(page) for page in pages] == [3, 3, 2]
+
+
+def test_last_full_page_has_no_next_cursor(client):
+    with get_cursor() as cur:
+        cur.executemany(
+            "INSERT INTO cases (case_id, primary_transaction_id, status, created_at) VALUES (?, ?, 'open', '2026-10-01T12:00:00')",
+            [(f"case_{i}", f"tx_{i}") for i in range(4)],
+        )
+
+    pages = _pages(client, "/cases", {"limit": 2})
+
+    assert [len(page) for page in pages] == [2, 2]
+    assert client.get("/cases", params={"cursor": "not-a-cursor"}).status_code == 400
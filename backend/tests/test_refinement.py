@@ -0,0 +1,62 @@
+"""Async LLM refinement of a committed rule-based decision (decision_service._refine_decision)."""
+import decision_service
+from db import get_cursor
+from models import LLMDecisionOutput
+from scoring_context import ScoringContext
+
+
+def _committed(add_transaction, candidate: str, score: int):
+    """A transaction whose rule-based decision has been committed, as _queue_refinement hands it over."""
+    tx = {"id": "tx_1", "timestamp": "2026-10-01T12:00:00+00:00", "type": "withdrawal", "amount": 900.0, "user_id": "user_1"}
+    ctx = ScoringContext(tx)
+    ctx.signals, ctx.candidate, ctx.risk_score_base, ctx.routed = [], candidate, score, True
+    decision = decision_service._build_decision(ctx, None)
+    add_transaction({**tx, "status": decision.decision})
+    return ctx, decision
+
+
+def _llm_answers(monkeypatch, decision: str, score: int) -> None:
+    output = LLMDecisionOutput(decision=decision, risk_score=score, rationale="model rationale", top_signals=[], confidence="high")
+    monkeypatch.setattr(decision_service, "adjudicate_decision", lambda *args: output)
+
+
+def _latest(transaction_id: str) -> tuple[str, dict]:
+    with get_cursor() as cur:
+        cur.execute(
+            """
+            SELECT t.status, d.decision, d.risk_score, d.llm_rationale
+            FROM transactions t JOIN risk_decisions d ON d.id = t.latest_decision_id
+            WHERE t.id = ?
+            """,
+            (transaction_id,),
+        )
+        row = cur.fetchone()
+    return row["status"], dict(row)
+
+
+def test_refinement_does_not_downgrade_a_block(add_transaction, monkeypatch):
+    ctx, decision = _committed(add_transaction, "block_candidate", 85)
+    _llm_answers(monkeypatch, "review", 55)
+
+    decision_service._refine_decision(ctx, decision, "case_1")
+
+    status, latest = _latest("tx_1")
+    assert status == "block"
+    assert latest["decision"] == "block"
+    assert latest["risk_score"] == 85
+    assert "LLM recommended review" in latest["llm_rationale"]
+
+
+def test_refinement_can_escalate_an_approve(add_transaction, monkeypatch):
+    ctx, decision = _committed(add_transaction, "approve_candidate", 20)
+    _llm_answers(monkeypatch, "review", 60)
+
+    decision_service._refine_decision(ctx, decision, None)
+
+    status, latest = _latest("tx_1")
+    assert status == "review"
+    assert latest["decision"] == "review"
+    assert latest["risk_score"] == 60
+    with get_cursor() as cur:
+        cur.execute("SELECT COUNT(*) FROM case_transactions WHERE transaction_id = ?", ("tx_1",))
+        assert cur.fetchone()[0] == 1
@@ -0,0 +1,55 @@
+"""Re-scoring stored transactions (and out-of-order ingest), which reads features from the stored history."""
+from datetime import datetime, timedelta, timezone
+
+import decision_service
+
+
+def _history(add_transaction) -> list[dict]:
+    """120 deposits over 20 days: 20 of 1000 first, then 100 of 10 (more than decision_service.HISTORY_LIMIT)."""
+    start = datetime(2026, 10, 1, tzinfo=timezone.utc)
+    rows = []
+    for i in range(120):
+        tx = {"id": f"tx_{i:03d}", "timestamp": (start + timedelta(hours=4 * i)).isoformat(), "type": "deposit",
+              "amount": 1000.0 if i < 20 else 10.0, "user_id": "user_1", "device_id": "dev_1"}
+        add_transaction(tx)
+        rows.append(tx)
+    return rows
+
+
+def test_rescore_averages_the_whole_30_day_window(counters, add_transaction):
+    _history(add_transaction)
+    target = {"id": "tx_target", "timestamp": "2026-10-21T10:00:00+00:00", "type": "deposit", "amount": 100.0,
+              "user_id": "user_1", "device_id": "dev_1", "currency": "USD", "account_age_days": 100,
+              "country": "US", "psp": "stripe"}
+    add_transaction(target)
+    later = {**target, "id": "tx_later", "timestamp": "2026-10-22T10:00:00+00:00", "amount": 10.0}
+    add_transaction(later)
+    decision_service.run_decision(later)  # the feature store now covers the target's timestamp
+
+    items, _ = decision_service.prepare_decisions([target])
+
+    ctx = items[0]["context"]
+    assert ctx.features["avg_amount_30d"] == (20 * 1000 + 100 * 10) / 120
+    assert ctx.features["known_devices"] == {"dev_1"}
+    signals = {s["name"]: s for s in ctx.signals}
+    assert not signals["amount_vs_user_avg"]["fired"]  # 100 vs 175, but 10x a truncated 100-row average
+    assert len(ctx.history) == decision_service.HISTORY_LIMIT
+
+
+def test_rescore_remembers_devices_from_before_the_window(counters, add_transaction):
+    old = {"id": "tx_old", "timestamp": "2026-08-01T10:00:00+00:00", "type": "deposit", "amount": 50.0,
+           "user_id": "user_1", "device_id": "dev_old", "country": "DE"}
+    add_transaction(old)
+    target = {**old, "id": "tx_target", "timestamp": "2026-10-21T10:00:00+00:00", "currency": "USD",
+              "account_age_days": 100, "psp": "stripe"}
+    add_transaction(target)
+    later = {**target, "id": "tx_later", "timestamp": "2026-10-22T10:00:00+00:00"}
+    add_transaction(later)
+    decision_service.run_decision(later)
+
+    items, _ = decision_service.prepare_decisions([target])
+
+    features = items[0]["context"].features
+    assert features["known_devices"] == {"dev_old"}
+    assert features["last_country"] == "DE"
+    assert features["avg_amount_30d"] == 0
@@ -0,0 +1,80 @@
+"""Live rule reloads: POST /rules/reload and the RISK_RULES_RELOAD_SECONDS file watcher."""
+import json
+import os
+import time
+
+import pytest
+
+import risk_engine
+
+_RULES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "rules.json")
+
+
+@pytest.fixture
+def rules_file(tmp_path, monkeypatch):
+    """A copy of rules.json served as the live rules (watcher checking every 10 ms). Returns (path, config)."""
+    path = tmp_path / "rules.json"
+    with open(_RULES, encoding="utf-8") as f:
+        config = json.load(f)
+    path.write_text(json.dumps(config))
+    source = risk_engine.RuleSource(str(path), reload_seconds=0.01)
+    source.reload()
+    monkeypatch.setattr(risk_engine, "_live_rules", source)
+    return path, config
+
+
+def _edited(config: dict, version: int, new_device_weight: int) -> str:
+    config = json.loads(json.dumps(config))
+    config["version"] = version
+    for signal in config["signals"]:
+        if signal["name"] == "new_device":
+            signal["weight"] = new_device_weight
+    return json.dumps(config)
+
+
+def _weight(plan, name: str) -> int:
+    return next(rule.weight for rule in plan.rules if rule.name == name)
+
+
+def _wait_for_watcher(source) -> None:
+    """Let the watcher's check interval pass and mtime move on (coarse-mtime filesystems)."""
+    time.sleep(max(source.reload_seconds, 0.02))
+
+
+def test_watcher_picks_up_a_valid_edit_and_keeps_it_over_an_invalid_one(rules_file):
+    path, config = rules_file
+    version = risk_engine.current_rules().version
+
+    _wait_for_watcher(risk_engine._live_rules)
+    path.write_text(_edited(config, version + 1, 45))
+    _wait_for_watcher(risk_engine._live_rules)
+    plan = risk_engine.current_rules()
+    assert (plan.version, _weight(plan, "new_device")) == (version + 1, 45)
+
+    path.write_text('{"version": 99, "signals": [')
+    _wait_for_watcher(risk_engine._live_rules)
+    assert risk_engine.current_rules() is plan
+
+
+def test_reload_endpoint_rejects_an_invalid_file_and_applies_a_valid_one(client, counters, rules_file):
+    path, config = rules_file
+    before = risk_engine.current_rules()
+
+    broken = json.loads(_edited(config, before.version + 1, 45))
+    broken["bands"]["block_threshold"] = "high"
+    path.write_text(json.dumps(broken))
+    response = client.post("/rules/reload")
+    assert response.status_code == 400
+    assert risk_engine.current_rules() is before
+    assert client.get("/rules").json()["version"] == before.version
+
+    path.write_text(_edited(config, before.version + 1, 45))
+    response = client.post("/rules/reload")
+    assert response.status_code == 200
+    assert response.json()["version"] == before.version + 1
+
+    tx = {"id": "tx_1", "timestamp": "2026-10-01T12:00:00+00:00", "type": "deposit", "amount": 50.0,
+          "user_id": "user_1", "device_id": "dev_1"}
+    decision = client.post("/transactions/ingest", json=tx).json()["decision"]
+    signals = {s["name"]: s for s in json.loads(decision["signals_json"])}
+    assert signals["new_device"]["weight"] == 45
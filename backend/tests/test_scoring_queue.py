@@ -0,0 +1,50 @@
+"""Scoring queue: claim -> score -> release over unscored transactions."""
+import scoring_queue
+from db import get_cursor
+
+
+def _unscored(add_transaction, n: int = 3) -> list[str]:
+    ids = [f"tx_{i}" for i in range(n)]
+    for i, tx_id in enumerate(ids):
+        add_transaction({"id": tx_id, "timestamp": f"2026-10-01T12:0{i}:00+00:00", "type": "deposit",
+                         "amount": 50.0, "user_id": "user_1"})
+    return ids
+
+
+def _rows() -> dict:
+    with get_cursor() as cur:
+        cur.execute("SELECT id, scored_at, claim_token, latest_decision_id FROM transactions")
+        return {r["id"]: dict(r) for r in cur.fetchall()}
+
+
+def test_claim_score_and_release(counters, add_transaction):
+    ids = _unscored(add_transaction)
+
+    token, claimed, _ = scoring_queue.claim(2)
+    assert [tx["id"] for tx in claimed] == ids[:2]
+    assert scoring_queue.score_claimed(token, claimed) == 2
+    rows = _rows()
+    assert all(rows[i]["scored_at"] and rows[i]["latest_decision_id"] and rows[i]["claim_token"] is None for i in ids[:2])
+
+    token, claimed, _ = scoring_queue.claim(5)
+    assert [tx["id"] for tx in claimed] == ids[2:]
+    assert scoring_queue.release(token) == 1
+    assert _rows()[ids[2]]["claim_token"] is None
+    assert scoring_queue.drain(once=True) == 1
+    assert scoring_queue.queue_stats()["unscored"] == 0
+
+
+def test_partial_lease_loss_scores_the_rows_still_held(counters, add_transaction):
+    ids = _unscored(add_transaction)
+    token, claimed, _ = scoring_queue.claim(3)
+    with get_cursor() as cur:
+        cur.execute("UPDATE transactions SET claim_token = 'other-worker' WHERE id = ?", (ids[1],))
+
+    assert scoring_queue.score_claimed(token, claimed) == 2
+
+    rows = _rows()
+    assert rows[ids[0]]["scored_at"] and rows[ids[2]]["scored_at"]
+    assert rows[ids[1]]["scored_at"] is None and rows[ids[1]]["claim_token"] == "other-worker"
+    with get_cursor() as cur:
+        cur.execute("SELECT COUNT(*) AS n FROM user_features WHERE user_id = 'user_1'")
+        assert cur.fetchone()["n"] == 0  # folded over the lost row too: dropped, rebuilt on next lookup
@@ -0,0 +1,55 @@
+"""Live velocity counters: a transaction is counted once, on its first committed decision."""
+import json
+
+import pytest
+
+import decision_service
+import velocity
+from db import unit_of_work
+
+
+def _card_test(i: int) -> dict:
+    """Card-testing pattern: a new card (user) every few seconds on the same device."""
+    return {"id": f"tx_{i}", "timestamp": f"2026-10-01T12:00:{10 + 5 * i:02d}+00:00", "type": "deposit",
+            "amount": 5.0, "user_id": f"card_{i}", "device_id": "dev_1"}
+
+
+def _device_count(decision) -> int:
+    signals = {s["name"]: s for s in json.loads(decision.signals_json)}
+    return signals["device_burst_1m"]["value"]
+
+
+def test_rescoring_does_not_count_a_transaction_again(counters, add_transaction):
+    before = velocity.velocity_stats()["counted"]
+    txs = [_card_test(i) for i in range(3)]
+    for tx in txs:
+        add_transaction(tx)
+        decision_service.run_decision(tx)
+    for _ in range(2):
+        rescored = [decision_service.run_decision(tx)[0] for tx in txs]
+
+    assert velocity.velocity_stats()["counted"] == before + 3
+    assert [_device_count(d) for d in rescored] == [0, 1, 2]  # each still sees only the earlier ones
+    add_transaction(_card_test(3))
+    assert _device_count(decision_service.run_decision(_card_test(3))[0]) == 3
+
+
+def test_batch_sees_earlier_rows_and_counts_them_on_commit(counters, add_transaction):
+    before = velocity.velocity_stats()["counted"]
+    txs = [_card_test(i) for i in (2, 0, 1)]
+    items, feature_updates = decision_service.prepare_decisions(txs)
+
+    assert [_device_count(item["decision"]) for item in items] == [2, 0, 1]
+    assert velocity.velocity_stats()["counted"] == before
+
+    with pytest.raises(RuntimeError):
+        with unit_of_work():
+            decision_service.commit_decisions(items, feature_updates)
+            raise RuntimeError("rolled back")
+    assert velocity.velocity_stats()["counted"] == before
+
+    for tx in txs:
+        add_transaction(tx)
+    with unit_of_work():
+        decision_service.commit_decisions(items, feature_updates)
+    assert velocity.velocity_stats()["counted"] == before + 3
@@ -0,0 +1,277 @@
+"""In-memory sliding-window velocity counters: transaction count and amount per user, device and IP over
+1m / 5m / 1h / 24h (risk_engine.VELOCITY_WINDOWS).
+
+Each key keeps, per window, a ring of VELOCITY_BUCKETS time buckets and their running totals. Moving to a
+newer bucket clears only the buckets that fell out, so reading and updating a key costs the same for any
+window length. Windows are in event time (transaction timestamps) and bucket-aligned, the definition
+risk_engine uses to rebuild these facts from history; with in-order ingest the values match.
+
+Keys live in LRU order up to VELOCITY_MAX_KEYS (~1 KB each; an evicted key starts again from zero).
+Scoring only reads the counters (lookup_batch); a transaction is counted once, by record() after its first
+decision commits, so retries and queue re-claims never count it twice. Re-scores of counted transactions
+read the same windows from the stored transactions instead, since the rings only hold recent buckets.
+On startup the counters are rebuilt from the last 24h of scored transactions. Late transactions (older
+than a key's newest bucket) read the buckets up to their own that the ring still holds.
+"""
+import json
+import os
+import threading
+from array import array
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from db import get_cursor
+from risk_engine import (
+    VELOCITY_BUCKETS,
+    VELOCITY_FACT_KEYS,
+    VELOCITY_KEYS,
+    VELOCITY_WINDOWS,
+    history_epochs,
+    history_velocity,
+    to_cents,
+    to_epoch_us,
+    velocity_bucket_us,
+)
+
+VELOCITY_MAX_KEYS = int(os.getenv("VELOCITY_MAX_KEYS", "50000"))
+
+_WINDOWS = list(VELOCITY_WINDOWS)
+_WIDTHS = [velocity_bucket_us(w) for w in _WINDOWS]
+_N = VELOCITY_BUCKETS
+_ZERO_FACTS = {key: 0.0 if "_amount_" in key else 0 for key in VELOCITY_FACT_KEYS}
+_MAX_RECENT_IDS = 100_000  # ids counted lately, so a commit retried in that span is not counted twice
+
+
+class _Rings:
+    """Per window: _N (count, cents) buckets, flattened into one array, plus the window totals."""
+
+    __slots__ = ("heads", "slots", "totals")
+
+    def __init__(self):
+        self.heads: list[int | None] = [None] * len(_WINDOWS)  # newest bucket index per window
+        self.slots = array("q", bytes(8 * 2 * _N * len(_WINDOWS)))
+        self.totals = array("q", bytes(8 * 2 * len(_WINDOWS)))
+
+    def _advance(self, w: int, bucket: int) -> None:
+        head = self.heads[w]
+        if head is not None and bucket <= head:
+            return
+        base = 2 * _N * w
+        if head is None or bucket - head >= _N:
+            for j in range(base, base + 2 * _N):
+                self.slots[j] = 0
+            self.totals[2 * w] = self.totals[2 * w + 1] = 0
+        else:
+            for b in range(head + 1, bucket + 1):
+                j = base + 2 * (b % _N)
+                self.totals[2 * w] -= self.slots[j]
+                self.totals[2 * w + 1] -= self.slots[j + 1]
+                self.slots[j] = self.slots[j + 1] = 0
+        self.heads[w] = bucket
+
+    def read(self, ts_us: int) -> list[tuple[int, int]]:
+        """
+        (count, cents) per window ending at ts_us's bucket, without moving the ring. For a bucket older
+        than the newest, only the window's buckets the ring still holds are summed.
+        """
+        totals = []
+        for w, width in enumerate(_WIDTHS):
+            bucket, head = ts_us // width, self.heads[w]
+            count, cents = self.totals[2 * w], self.totals[2 * w + 1]
+            if head is None or bucket - head >= _N:
+                count = cents = 0
+            elif bucket >= head:
+                for b in range(head + 1, bucket + 1):  # the buckets moving would clear
+                    j = 2 * _N * w + 2 * (b % _N)
+                    count -= self.slots[j]
+                    cents -= self.slots[j + 1]
+            else:
+                count = cents = 0
+                for b in range(head - _N + 1, bucket + 1):
+                    j = 2 * _N * w + 2 * (b % _N)
+                    count += self.slots[j]
+                    cents += self.slots[j + 1]
+            totals.append((count, cents))
+        return totals
+
+    def add(self, ts_us: int, cents: int) -> None:
+        for w, width in enumerate(_WIDTHS):
+            bucket = ts_us // width
+            self._advance(w, bucket)
+            if bucket > self.heads[w] - _N:  # still inside the ring
+                j = 2 * _N * w + 2 * (bucket % _N)
+                self.slots[j] += 1
+                self.slots[j + 1] += cents
+                self.totals[2 * w] += 1
+                self.totals[2 * w + 1] += cents
+
+
+_rings: OrderedDict[tuple[str, str], _Rings] = OrderedDict()
+_recent_ids: OrderedDict[str, None] = OrderedDict()
+_lock = threading.Lock()
+_stats = {"counted": 0, "evicted": 0, "rebuilt": 0}
+
+
+def counted_ids(transaction_ids: list[str]) -> set[str]:
+    """Which of these transactions the counters already hold: the scored ones (counted on their first decision, or by rebuild)."""
+    with get_cursor() as cur:
+        cur.execute(
+            "SELECT id FROM transactions WHERE id IN (SELECT value FROM json_each(?)) AND latest_decision_id IS NOT NULL",
+            (json.dumps(transaction_ids),),
+        )
+        return {r["id"] for r in cur.fetchall()}
+
+
+def lookup_batch(transactions: list[dict], counted: set[str]) -> list[dict]:
+    """
+    Velocity facts (risk_engine.VELOCITY_FACT_KEYS) per transaction, in input order. New transactions
+    see every transaction counted before them plus the new ones earlier in the batch (by timestamp, then
+    input order); those in `counted` (re-scores) see the stored transactions before them. Counts nothing;
+    see record().
+    """
+    parsed = [to_epoch_us(tx.get("timestamp", "")) for tx in transactions]
+    facts_by_index = [dict(_ZERO_FACTS) for _ in transactions]
+    order = []
+    for i, tx in enumerate(transactions):
+        if parsed[i] is None:
+            continue
+        if tx.get("id") in counted:
+            facts_by_index[i] = _stored_facts(tx, parsed[i])
+        else:
+            order.append(i)
+    order.sort(key=lambda i: (parsed[i], i))
+    pending: dict[tuple[str, str], list[tuple[int, int]]] = {}  # key -> (ts_us, cents) of new batch rows
+    with _lock:
+        for i in order:
+            tx, ts_us, facts = transactions[i], parsed[i], facts_by_index[i]
+            for prefix, field_name in VELOCITY_KEYS.items():
+                value = tx.get(field_name)
+                if not value:
+                    continue
+                key = (prefix, value)
+                rings = _rings.get(key)
+                totals = rings.read(ts_us) if rings is not None else [(0, 0)] * len(_WINDOWS)
+                earlier = pending.setdefault(key, [])
+                for w, (window, width) in enumerate(zip(_WINDOWS, _WIDTHS)):
+                    count, total_cents = totals[w]
+                    bucket = ts_us // width
+                    for t_us, t_cents in earlier:
+                        if bucket - _N < t_us // width <= bucket:
+                            count += 1
+                            total_cents += t_cents
+                    facts[f"{prefix}_count_{window}"] = count
+                    facts[f"{prefix}_amount_{window}"] = total_cents / 100
+                earlier.append((ts_us, to_cents(tx.get("amount"))))
+    return facts_by_index
+
+
+def _stored_facts(transaction: dict, ts_us: int) -> dict:
+    """Velocity facts of a counted transaction from the scored transactions stored before it, any user."""
+    longest = max(_WINDOWS, key=VELOCITY_WINDOWS.get)
+    width = velocity_bucket_us(longest)
+    first_us = (ts_us // width - _N + 1) * width
+    since = datetime.fromtimestamp(first_us / 1_000_000, tz=timezone.utc).isoformat()
+    conditions, params = [], []
+    for field_name in VELOCITY_KEYS.values():
+        if transaction.get(field_name):
+            conditions.append(f"{field_name} = ?")
+            params.append(transaction[field_name])
+    if not conditions:
+        return dict(_ZERO_FACTS)
+    with get_cursor() as cur:
+        cur.execute(
+            f"""
+            SELECT timestamp, amount, user_id, device_id, ip_hash
+            FROM transactions
+            WHERE ({" OR ".join(conditions)}) AND timestamp >= ? AND timestamp < ? AND latest_decision_id IS NOT NULL
+            """,
+            (*params, since, transaction.get("timestamp", "")),
+        )
+        rows = [dict(r) for r in cur.fetchall()]
+    return history_velocity(transaction, ts_us, rows, history_epochs(rows))
+
+
+def _count(transaction: dict) -> bool:
+    """Count one transaction unless its id was counted lately (caller holds _lock). Returns whether it was counted."""
+    tx_id = transaction.get("id")
+    if tx_id:
+        if tx_id in _recent_ids:
+            return False
+        _recent_ids[tx_id] = None
+        if len(_recent_ids) > _MAX_RECENT_IDS:
+            _recent_ids.popitem(last=False)
+    ts_us = to_epoch_us(transaction.get("timestamp", ""))
+    if ts_us is None:
+        return False
+    cents = to_cents(transaction.get("amount"))
+    for prefix, field_name in VELOCITY_KEYS.items():
+        value = transaction.get(field_name)
+        if not value:
+            continue
+        key = (prefix, value)
+        rings = _rings.get(key)
+        if rings is None:
+            rings = _rings[key] = _Rings()
+            if len(_rings) > VELOCITY_MAX_KEYS:
+                _rings.popitem(last=False)
+                _stats["evicted"] += 1
+        else:
+            _rings.move_to_end(key)
+        rings.add(ts_us, cents)
+    _stats["counted"] += 1
+    return True
+
+
+def record(transactions: list[dict]) -> int:
+    """Count newly scored transactions, in timestamp order, each id once. Call after their decisions commit. Returns the number counted."""
+    ordered = sorted(transactions, key=lambda tx: to_epoch_us(tx.get("timestamp", "")) or 0)
+    with _lock:
+        return sum(_count(tx) for tx in ordered)
+
+
+def rebuild() -> int:
+    """Reset the counters and replay scored transactions from the longest window before the newest one. Returns the count replayed."""
+    with _lock:
+        _rings.clear()
+        _recent_ids.clear()
+    with get_cursor() as cur:
+        cur.execute("SELECT MAX(timestamp) AS latest FROM transactions WHERE latest_decision_id IS NOT NULL")
+        latest = cur.fetchone()["latest"]
+        if not latest:
+            return 0
+        try:
+            latest_dt = datetime.fromisoformat(latest.replace("Z", "+00:00"))
+        except ValueError:
+            return 0
+        longest = max(VELOCITY_WINDOWS.values())
+        since = (latest_dt - timedelta(seconds=longest + longest / _N)).isoformat()
+        cur.execute(
+            """
+            SELECT id, timestamp, amount, user_id, device_id, ip_hash
+            FROM transactions
+            WHERE timestamp >= ? AND latest_decision_id IS NOT NULL
+            ORDER BY timestamp, id
+            """,
+            (since,),
+        )
+        replayed = 0
+        for row in cur:
+            with _lock:
+                replayed += _count(dict(row))
+    with _lock:
+        _stats["rebuilt"] = replayed
+    return replayed
+
+
+def velocity_stats() -> dict:
+    with _lock:
+        keys: dict[str, int] = {prefix: 0 for prefix in VELOCITY_KEYS}
+        for prefix, _ in _rings:
+            keys[prefix] += 1
+        return {
+            "keys": keys,
+            "max_keys": VELOCITY_MAX_KEYS,
+            "windows": {w: VELOCITY_WINDOWS[w] for w in _WINDOWS},
+            "buckets_per_window": _N,
+            **_stats,
+        }
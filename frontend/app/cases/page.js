@@ -2,20 +2,28 @@ import Link from 'next/link'
 
 const API_BASE = process.env.NEXT_PUBLIC_API_BASE || 'http://localhost:8000'
 
-async function getCases() {
-  const res = await fetch(`${API_BASE}/cases`, { cache: 'no-store' })
+const PAGE_SIZE = 100
+
+async function getCases(cursor) {
+  const query = new URLSearchParams({ status: 'open', limit: String(PAGE_SIZE) })
+  if (cursor) query.set('cursor', cursor)
+  const res = await fetch(`${API_BASE}/cases?${query}`, { cache: 'no-store' })
   if (!res.ok) throw new Error('Failed to load cases')
   const data = await res.json()
-  const all = Array.isArray(data) ? data : []
-  return all.filter((item) => (item.status || 'open') === 'open')
+  return { cases: Array.isArray(data) ? data : [], nextCursor: res.headers.get('X-Next-Cursor') }
 }
 
 
-export default async function CasesPage() {
+export default async function CasesPage({ searchParams }) {
   let cases = []
+  let nextCursor = null
   let error = ''
+  const params = await searchParams
+  const cursor = params?.cursor || ''
   try {
-    cases = await getCases()
+    const page = await getCases(cursor)
+    cases = page.cases
+    nextCursor = page.nextCursor
   } catch (err) {
     error = err?.message || 'Failed to load cases'
   }
@@ -114,6 +122,12 @@ export default async function CasesPage() {
             </Link>
           ))}
         </div>
+        {(cursor || nextCursor) && (
+          <div style={{ display: 'flex', justifyContent: 'flex-end', gap: 10, marginTop: 16 }}>
+            {cursor && <Link href="/cases" className="page-link">⏮ First page</Link>}
+            {nextCursor && <Link href={`/cases?cursor=${encodeURIComponent(nextCursor)}`} className="page-link">Next page →</Link>}
+          </div>
+        )}
       </div>
       <style>{`
         .back-link:hover {
@@ -121,6 +135,22 @@ export default async function CasesPage() {
           border-color: rgba(59, 130, 246, 0.5) !important;
           color: #60a5fa !important;
         }
+        .page-link {
+          padding: 8px 16px;
+          border-radius: 8px;
+          border: 1px solid rgba(71, 85, 105, 0.5);
+          background: rgba(51, 65, 85, 0.5);
+          color: #94a3b8;
+          text-decoration: none;
+          font-size: 13px;
+          font-weight: 600;
+          transition: all 0.2s ease;
+        }
+        .page-link:hover {
+          border-color: rgba(59, 130, 246, 0.5);
+          background: rgba(59, 130, 246, 0.2);
+          color: #60a5fa;
+        }
         .case-card:hover {
           transform: translateY(-2px);
           box-shadow: 0 12px 40px rgba(59, 130, 246, 0.3);
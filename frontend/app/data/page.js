@@ -2,11 +2,15 @@ import Link from 'next/link'
 
 const API_BASE = process.env.NEXT_PUBLIC_API_BASE || 'http://localhost:8000'
 
-async function getCases() {
-  const res = await fetch(`${API_BASE}/cases`, { cache: 'no-store' })
+const PAGE_SIZE = 100
+
+async function getCases(cursor) {
+  const query = new URLSearchParams({ limit: String(PAGE_SIZE) })
+  if (cursor) query.set('cursor', cursor)
+  const res = await fetch(`${API_BASE}/cases?${query}`, { cache: 'no-store' })
   if (!res.ok) throw new Error('Failed to load cases')
   const data = await res.json()
-  return Array.isArray(data) ? data : []
+  return { cases: Array.isArray(data) ? data : [], nextCursor: res.headers.get('X-Next-Cursor') }
 }
 
 function sortCases(cases, sort, dir) {
@@ -23,13 +27,17 @@ function sortCases(cases, sort, dir) {
 
 export default async function DataPage({ searchParams }) {
   let cases = []
+  let nextCursor = null
   let error = ''
+  const params = await searchParams
+  const sort = params?.sort || 'created_at'
+  const dir = params?.dir || 'desc'
+  const cursor = params?.cursor || ''
   try {
-    const data = await getCases()
-    const params = await searchParams
-    const sort = params?.sort || 'created_at'
-    const dir = params?.dir || 'desc'
-    cases = sortCases(data, sort, dir)
+    // Pages come newest first; the sort pills order the rows of the current page
+    const page = await getCases(cursor)
+    nextCursor = page.nextCursor
+    cases = sortCases(page.cases, sort, dir)
   } catch (err) {
     error = err?.message || 'Failed to load cases'
   }
@@ -133,6 +141,16 @@ export default async function DataPage({ searchParams }) {
             </table>
           )}
         </div>
+        {(cursor || nextCursor) && (
+          <div style={{ display: 'flex', justifyContent: 'flex-end', gap: 10, marginTop: 16 }}>
+            {cursor && <Link href={`/data?sort=${sort}&dir=${dir}`} className="sort-pill">⏮ First page</Link>}
+            {nextCursor && (
+              <Link href={`/data?sort=${sort}&dir=${dir}&cursor=${encodeURIComponent(nextCursor)}`} className="sort-pill">
+                Next page →
+              </Link>
+            )}
+          </div>
+        )}
         <style>{`
           .back-link:hover {
             background: rgba(59, 130, 246, 0.2) !important;